@@ -0,0 +1,848 @@
+#!/usr/bin/env python3
+"""
+APK Signing Bot - Benchmarks
+Compares the in-process signing engine with the jarsigner subprocess path
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import asyncio
+import argparse
+import resource
+import threading
+import statistics
+import tempfile
+import zipfile
+import subprocess
+import functools
+import posixpath
+import socket
+import collections
+from urllib.parse import urlparse
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta, timezone
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, pkcs12
+
+import httpx
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import bot
+
+ALIAS = "bench"
+PASSWORD = "android"
+
+
+def make_keystore(path, key=None):
+    """Write a throwaway PKCS12 keystore usable by both backends"""
+    key = key or rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, ALIAS)])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now).not_valid_after(now + timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    data = pkcs12.serialize_key_and_certificates(
+        ALIAS.encode(), key, cert, None, BestAvailableEncryption(PASSWORD.encode())
+    )
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def make_apk(path, size_mb, entries=200, stored_ratio=0.3):
+    """Write a synthetic APK of roughly size_mb with a mix of stored/deflated entries"""
+    total = int(size_mb * 1024 * 1024)
+    per_entry = max(1, total // entries)
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("AndroidManifest.xml", b"<manifest/>" * 100, zipfile.ZIP_DEFLATED)
+        for i in range(entries):
+            stored = i < entries * stored_ratio
+            name = f"lib/arm64-v8a/lib{i}.so" if stored else f"assets/blob{i}.bin"
+            # Random data compress nahi hota, isliye file size ~ size_mb rahega
+            zf.writestr(name, os.urandom(per_entry), zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+
+
+def time_native(apk, keystore, workdir):
+    out = os.path.join(workdir, "native.apk")
+    start = time.perf_counter()
+    signer = bot.NativeSigner.from_keystore(keystore, ALIAS, PASSWORD)
+    signer.sign(apk, out)
+    return time.perf_counter() - start
+
+
+def time_jarsigner(apk, keystore, workdir):
+    out = os.path.join(workdir, "jarsigner.apk")
+    shutil.copyfile(apk, out)
+    start = time.perf_counter()
+    subprocess.run([
+        "jarsigner", "-keystore", keystore, "-storepass", PASSWORD,
+        "-sigalg", "SHA256withRSA", "-digestalg", "SHA-256", out, ALIAS
+    ], check=True, capture_output=True)
+    subprocess.run(["jarsigner", "-verify", out], check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def bench_v1(sizes, repeat):
+    """Native v1 signer vs jarsigner (sign + verify) across APK sizes"""
+    has_jarsigner = shutil.which("jarsigner") is not None
+    if not has_jarsigner:
+        print("⚠️  jarsigner not found - only the native backend will be measured")
+
+    print(f"{'size':>8} {'native':>10} {'jarsigner':>10}")
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        keystore = os.path.join(workdir, "bench.p12")
+        make_keystore(keystore)
+        for size in sizes:
+            apk = os.path.join(workdir, f"synthetic_{size}.apk")
+            make_apk(apk, size)
+            native = min(time_native(apk, keystore, workdir) for _ in range(repeat))
+            jar = min(time_jarsigner(apk, keystore, workdir) for _ in range(repeat)) if has_jarsigner else None
+            jar_text = f"{jar:9.3f}s" if jar is not None else f"{'-':>10}"
+            print(f"{size:>6}MB {native:9.3f}s {jar_text}")
+
+
+def bench_v2(size, repeat):
+    """v2/v3 chunked digest throughput for increasing worker counts + full v1+v2+v3 sign"""
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        keystore = os.path.join(workdir, "bench.p12")
+        make_keystore(keystore)
+        apk = os.path.join(workdir, f"synthetic_{size}.apk")
+        make_apk(apk, size)
+        signer = bot.NativeSigner.from_keystore(keystore, ALIAS, PASSWORD)
+
+        print(f"\nv2/v3 digest throughput ({size}MB APK, {cpus} CPUs)")
+        print(f"{'workers':>8} {'MB/s':>10}")
+        for workers in worker_counts:
+            best = None
+            for _ in range(repeat):
+                stats = signer.apply_signing_block(apk, os.path.join(workdir, "v2.apk"), ["v2", "v3"], workers)
+                best = stats["digest_seconds"] if best is None else min(best, stats["digest_seconds"])
+            print(f"{workers:>8} {stats['bytes'] / best / 1024 / 1024:10.1f}")
+
+        print(f"\n{'schemes':>10} {'seconds':>10}")
+        for schemes in ("v1", "v2,v3", "v1,v2,v3"):
+            out = os.path.join(workdir, "signed.apk")
+            start = time.perf_counter()
+            signer.sign(apk, out, schemes)
+            print(f"{schemes:>10} {time.perf_counter() - start:10.3f}")
+
+
+def bench_algorithms(repeat):
+    """Keygen and sign (v1+v2+v3, 1MB APK) latency per key algorithm"""
+    print(f"\n{'algorithm':>10} {'keygen ms':>10} {'sign ms':>10}")
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        apk = os.path.join(workdir, "synthetic_1.apk")
+        make_apk(apk, 1)
+        for algorithm in bot.KEY_ALGORITHMS:
+            keygen = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                key = bot.generate_key(algorithm)
+                keygen.append(time.perf_counter() - start)
+
+            keystore = os.path.join(workdir, f"{algorithm}.p12")
+            make_keystore(keystore, key)
+            signer = bot.NativeSigner.from_keystore(keystore, ALIAS, PASSWORD)
+            sign = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                signer.sign(apk, os.path.join(workdir, "signed.apk"))
+                sign.append(time.perf_counter() - start)
+            print(f"{algorithm:>10} {statistics.median(keygen) * 1000:10.1f} {statistics.median(sign) * 1000:10.1f}")
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # client MemoryError se mar gaya to connection reset hota hai
+
+
+def bench_batch(count, size, repeat):
+    """Batch signing throughput on the process pool for increasing worker counts"""
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        app = bot.APKSigningBot()
+        app.cert_dir = workdir
+        make_keystore(os.path.join(workdir, "android.jks"))
+        sources = []
+        for i in range(count):
+            sources.append(os.path.join(workdir, f"source_{i}.apk"))
+            make_apk(sources[-1], size)
+
+        print(f"\nBatch signing ({count} x {size}MB APKs, {cpus} CPUs)")
+        print(f"{'workers':>8} {'seconds':>10} {'APKs/s':>10}")
+        for workers in worker_counts:
+            bot.BATCH_WORKERS = workers
+            best = None
+            for _ in range(repeat):
+                files = []
+                for i, source in enumerate(sources):
+                    files.append(os.path.join(workdir, f"uploaded_batch{i}_{i}.apk"))
+                    shutil.copyfile(source, files[-1])
+                start = time.perf_counter()
+                ok, message = app.sign_batch_process({"batch_files": files, "alias_name": ALIAS, "store_pass": PASSWORD})
+                elapsed = time.perf_counter() - start
+                if not ok:
+                    raise RuntimeError(message)
+                best = elapsed if best is None else min(best, elapsed)
+            print(f"{workers:>8} {best:10.3f} {count / best:10.1f}")
+
+
+def bench_key_cache(repeat):
+    """Cold keystore unlock (JKS/PKCS12 PBE + decrypt) vs unlocked key cache hit"""
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        keystore = os.path.join(workdir, "bench.p12")
+        make_keystore(keystore)
+        cache = bot.UnlockedKeyCache(ttl=60, max_entries=4)
+        cold, warm = [], []
+        for _ in range(repeat):
+            cache.evict()
+            start = time.perf_counter()
+            cache.get_signer(keystore, ALIAS, PASSWORD)
+            cold.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            cache.get_signer(keystore, ALIAS, PASSWORD)
+            warm.append(time.perf_counter() - start)
+        print(f"\nKey unlock: cold {statistics.median(cold) * 1000:.2f} ms, cached {statistics.median(warm) * 1000:.3f} ms")
+        print(f"Key cache stats: {cache.stats()}")
+
+
+def bench_workers(jobs, size, kill_worker=True):
+    """Load test: sign jobs through the worker tier for increasing worker counts
+
+    kill_worker=True ho to har run mein ek worker SIGKILL hota hai - saare jobs
+    phir bhi complete hone chahiye (requeue + respawn).
+    """
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+    cwd = os.getcwd()
+    # Workers spawn hote hi bot import karte hain - cache band, keystore workdir mein
+    os.environ["SIGN_CACHE_MAX_MB"] = "0"
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        os.chdir(workdir)
+        try:
+            os.makedirs("APK_Signing_Keys")
+            make_keystore(os.path.join("APK_Signing_Keys", "android.jks"))
+            make_apk("source.apk", size)
+            print(f"\nWorker tier load test ({jobs} x {size}MB sign jobs, {cpus} CPUs)")
+            print(f"{'workers':>8} {'seconds':>10} {'jobs/s':>10} {'ok':>5} {'restarts':>9}")
+            for workers in worker_counts:
+                tier = bot.WorkerTier(db_path=f"jobs_{workers}.db", processes=workers)
+                tier.start()
+                try:
+                    elapsed, ok = asyncio.run(_load_test(tier, jobs, workers, kill_worker))
+                    print(f"{workers:>8} {elapsed:10.2f} {jobs / elapsed:10.2f} {ok:>5} {tier.restarts:>9}")
+                finally:
+                    tier.stop()
+        finally:
+            os.chdir(cwd)
+
+
+async def _load_test(tier, jobs, workers, kill_worker):
+    user_datas = []
+    for i in range(jobs):
+        apk = os.path.abspath(f"upload_{workers}_{i}.apk")
+        shutil.copyfile("source.apk", apk)
+        user_datas.append({"apk_file": apk, "alias_name": ALIAS, "store_pass": PASSWORD, "schemes": "v1,v2,v3"})
+
+    # Workers ka spawn + import warm-up timing mein na gine
+    await asyncio.sleep(3)
+    start = time.perf_counter()
+    tasks = [asyncio.ensure_future(tier.run(bot.bot.sign_apk_process, ud, timeout=600)) for ud in user_datas]
+    if kill_worker:
+        await asyncio.sleep(0.5)
+        os.kill(tier._workers[0].pid, 9)
+    results = await asyncio.gather(*tasks)
+    return time.perf_counter() - start, sum(1 for success, _ in results if success)
+
+
+def run_pipeline(mode, url, keystore, out, mem_cap_mb):
+    """Child process: download url + sign it, print JSON timings and peak RSS"""
+    if mem_cap_mb:
+        cap = mem_cap_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (cap, cap))
+    import httpx
+
+    upload = out + ".upload"
+    start = time.perf_counter()
+    known = None
+    if mode == "streaming":
+        with open(upload, "wb") as f:
+            digester = bot.StreamingEntryDigester(f)
+            writer = bot.HashingWriter(digester)
+            asyncio.run(bot.stream_download(types.SimpleNamespace(file_path=url), writer))
+        apk_sha256 = writer.hexdigest()
+        known = digester.digests()
+    else:
+        # Purana path: poori file memory mein (download_to_memory), phir alag se hash
+        with open(upload, "wb") as f:
+            f.write(httpx.get(url, timeout=None).content)
+        apk_sha256 = bot.sha256_file(upload)
+    downloaded = time.perf_counter()
+
+    signer = bot.NativeSigner.from_keystore(keystore, ALIAS, PASSWORD)
+    stats = signer.sign(upload, out, known=known)
+    done = time.perf_counter()
+    print(json.dumps({
+        "download": downloaded - start,
+        "sign": done - downloaded,
+        "total": done - start,
+        "streamed": stats["streamed"],
+        "sha256": apk_sha256,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def bench_streaming(size, mem_cap_mb):
+    """Upload -> sign end-to-end: streaming pipeline vs sequential path, under a memory cap"""
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        keystore = os.path.join(workdir, "bench.p12")
+        make_keystore(keystore)
+        make_apk(os.path.join(workdir, "upload.apk"), size)
+
+        # Local file server - Telegram file download ki jagah
+        handler = functools.partial(QuietHandler, directory=workdir)
+        server = QuietServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/upload.apk"
+
+        cap = f"{mem_cap_mb}MB" if mem_cap_mb else "none"
+        print(f"\nEnd-to-end download + sign ({size}MB APK, memory cap {cap})")
+        print(f"{'pipeline':>20} {'download':>10} {'sign':>10} {'total':>10} {'peak RSS':>10}")
+        try:
+            for mode in ("sequential", "streaming"):
+                for cap_mb in dict.fromkeys((mem_cap_mb, 0)):
+                    result = subprocess.run([
+                        sys.executable, os.path.abspath(__file__), "--pipeline", mode, "--url", url,
+                        "--keystore", keystore, "--out", os.path.join(workdir, f"{mode}.apk"),
+                        "--mem-cap", str(cap_mb),
+                    ], capture_output=True, text=True)
+                    label = mode if cap_mb == mem_cap_mb else f"{mode} (no cap)"
+                    if result.returncode == 0:
+                        r = json.loads(result.stdout.strip().splitlines()[-1])
+                        print(f"{label:>20} {r['download']:9.2f}s {r['sign']:9.2f}s {r['total']:9.2f}s {r['peak_rss_mb']:8.0f}MB")
+                        break
+                    # Cap ke andar fail hua - latency compare karne ke liye bina cap ke dobara chalao
+                    error = (result.stderr.strip().splitlines() or ["failed"])[-1]
+                    print(f"{label:>20} ❌ {error[:80]}")
+        finally:
+            server.shutdown()
+
+
+# End-to-end suite: asli handlers (generate_certificate / sign_apk / handle_message / handle_document)
+# fake Bot API + local file server ke saath - har backend apne child process mein
+BENCH_USER_ID = 424242
+BENCH_TOKEN = "123456:BENCH"
+E2E_BACKENDS = {
+    # name: (KEYSTORE_BACKEND, SIGN_BACKEND, tools needed on PATH)
+    "native": ("native", "native", ()),
+    "jvm": ("keytool", "jarsigner", ("keytool", "jarsigner")),
+}
+# /generate "Bench" aur /sign "bench" - registry alias lookup case-insensitive hona chahiye (JKS jaisa)
+GENERATE_ANSWERS = [ALIAS.title(), "Bench Org", "Perf", "Mumbai", "Maharashtra", "IN", PASSWORD, PASSWORD, "25", "RSA-2048"]
+# Webhook load: har admin /sign, APK upload (None), alias, /cancel - har message ka ek reply, fixed order mein.
+# Alias download khatam hone se pehle process ho jaye to "🔑" ki jagah "👤" aata hai (reordered)
+WEBHOOK_SCRIPT = [("/sign", "📱"), (None, "📥"), (ALIAS, "🔑"), ("/cancel", "❌ Operation")]
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def fake_message_update(update_id, user_id, text=None, document=None):
+    """Update JSON for a private-chat message from user_id (text or document)"""
+    message = {
+        "message_id": update_id, "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+    }
+    if document:
+        message["document"] = document
+    else:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+class FakeBotApi(BaseRequest):
+    """In-memory stand-in for the Bot API: records replies, answers getFile from the local file server"""
+
+    def __init__(self, files, latency=0.0):
+        self.files = files  # file_id -> (file_path, size)
+        self.latency = latency  # har API call pe simulated network round-trip (seconds)
+        self.sent = []
+        self.replies = collections.defaultdict(list)  # chat_id -> [(perf_counter, text)] sendMessage order mein
+        self.calls = collections.Counter()
+        self.uploaded_bytes = 0
+        self._message_id = 0
+        self._changed = asyncio.Condition()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif endpoint in ("sendMessage", "editMessageText"):
+            self._message_id += 1
+            result = {
+                "message_id": params.get("message_id", self._message_id), "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", BENCH_USER_ID)), "type": "private"},
+                "text": params.get("text", ""),
+            }
+            async with self._changed:
+                self.sent.append((endpoint, result["text"]))
+                if endpoint == "sendMessage":
+                    self.replies[result["chat"]["id"]].append((time.perf_counter(), result["text"]))
+                self._changed.notify_all()
+        elif endpoint == "sendDocument":
+            # Multipart file handle ko chunk by chunk padho - jaise httpx upload karta
+            filename = "document"
+            for name, content, _ in (request_data.multipart_data or {}).values():
+                filename = name
+                if isinstance(content, bytes):
+                    self.uploaded_bytes += len(content)
+                    continue
+                while True:
+                    chunk = content.read(64 * 1024)
+                    if not chunk:
+                        break
+                    self.uploaded_bytes += len(chunk)
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", BENCH_USER_ID)), "type": "private"},
+                "document": {"file_id": f"doc{self._message_id}", "file_unique_id": f"doc{self._message_id}", "file_name": filename},
+            }
+            async with self._changed:
+                self.sent.append((endpoint, filename))
+                self._changed.notify_all()
+        elif endpoint in ("deleteMessage", "setWebhook", "deleteWebhook"):
+            result = True
+        elif endpoint == "getFile":
+            path, size = self.files[params["file_id"]]
+            result = {"file_id": params["file_id"], "file_unique_id": params["file_id"], "file_size": size, "file_path": path}
+        else:
+            return 400, json.dumps({"ok": False, "error_code": 400, "description": f"{endpoint} not faked"}).encode()
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def wait_for(self, mark, match, timeout):
+        """Wait for the first (endpoint, text) sent after index mark that satisfies match, return its text"""
+        def found():
+            return next((text for endpoint, text in self.sent[mark:] if match(endpoint, text)), None)
+        async with self._changed:
+            await asyncio.wait_for(self._changed.wait_for(found), timeout)
+        return found()
+
+    async def wait_final(self, mark, timeout):
+        """Wait for the first ✅/❌ reply sent after index mark and return its text"""
+        return await self.wait_for(mark, lambda endpoint, text: endpoint == "sendMessage" and text.startswith(("✅", "❌")), timeout)
+
+    async def wait_document(self, mark, timeout):
+        """Wait for result delivery after index mark (sendDocument or the ⚠️ over-limit reply)"""
+        return await self.wait_for(
+            mark, lambda endpoint, text: endpoint == "sendDocument" or text.startswith("⚠️"), timeout
+        )
+
+
+class FakeChat:
+    """Feeds fake Updates from one admin's private chat straight into the application"""
+
+    def __init__(self, application, user_id):
+        self.application = application
+        self.user_id = user_id
+        self._update_id = 0
+
+    async def send(self, text=None, document=None):
+        self._update_id += 1
+        update = Update.de_json(fake_message_update(self._update_id, self.user_id, text, document), self.application.bot)
+        await self.application.process_update(update)
+
+
+class FileApiHandler(QuietHandler):
+    """Serves <directory>/<basename> for any /file/bot<token>/<path> URL"""
+
+    def translate_path(self, path):
+        return os.path.join(self.directory, posixpath.basename(urlparse(path).path))
+
+
+async def _e2e_session(base_file_url, apk, size_mb, repeat):
+    document = {
+        "file_id": "bench_apk", "file_unique_id": "bench_apk", "file_name": os.path.basename(apk),
+        "mime_type": "application/vnd.android.package-archive", "file_size": os.path.getsize(apk),
+    }
+    api = FakeBotApi({"bench_apk": (os.path.basename(apk), document["file_size"])})
+    application = bot.build_application(
+        Application.builder().token(BENCH_TOKEN).request(api).get_updates_request(api)
+        .base_file_url(base_file_url).updater(None)
+    )
+    chat = FakeChat(application, BENCH_USER_ID)
+    timeout = bot.JOB_TIMEOUT + 60
+    result = {"generate": [], "upload_to_reply": [], "sign_job": []}
+
+    await application.initialize()
+    await application.start()
+    if bot.worker_tier:
+        bot.worker_tier.start()
+        bot.worker_tier.ensure_polling()
+    else:
+        bot.bot.key_pool.start()
+    try:
+        # /generate - prompts ke jawab, aakhri jawab se ✅ tak
+        for _ in range(repeat):
+            await chat.send("/generate")
+            for answer in GENERATE_ANSWERS[:-1]:
+                await chat.send(answer)
+            mark, start = len(api.sent), time.perf_counter()
+            await chat.send(GENERATE_ANSWERS[-1])
+            reply = await api.wait_final(mark, timeout)
+            if not reply.startswith("✅"):
+                raise RuntimeError(f"/generate failed: {reply}")
+            if bot.SEND_RESULTS:
+                await api.wait_document(mark, timeout)
+            result["generate"].append(time.perf_counter() - start)
+
+        # /sign - upload (getFile + download) se signed APK delivery tak, aur sirf job (schemes ke baad) alag
+        for _ in range(repeat):
+            await chat.send("/sign")
+            mark, start = len(api.sent), time.perf_counter()
+            await chat.send(document=document)
+            await chat.send(ALIAS)
+            await chat.send(PASSWORD)
+            job_start = time.perf_counter()
+            await chat.send("v1,v2,v3")
+            reply = await api.wait_final(mark, timeout)
+            if not reply.startswith("✅"):
+                raise RuntimeError(f"/sign failed: {reply}")
+            if bot.SEND_RESULTS:
+                await api.wait_document(mark, timeout)
+            done = time.perf_counter()
+            result["upload_to_reply"].append(done - start)
+            result["sign_job"].append(done - job_start)
+    finally:
+        await application.stop()
+        await application.shutdown()
+        if bot.worker_tier:
+            bot.worker_tier.stop()
+        bot.job_runner.shutdown()
+        bot.bot.key_pool.stop()
+    result["api_calls"] = dict(api.calls)
+    result["uploaded_bytes"] = api.uploaded_bytes
+    return result
+
+
+def run_e2e_child(spec):
+    """Child process: one backend x one APK size through the real handlers, print JSON"""
+    spec = json.loads(spec)
+    result = asyncio.run(_e2e_session(spec["base_file_url"], spec["apk"], spec["size_mb"], spec["repeat"]))
+    result["stages"] = bot.metrics.summary()
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    # keytool/jarsigner JVMs (aur worker processes) ka peak alag
+    result["children_peak_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(json.dumps(result))
+
+
+def bench_e2e(sizes, backends, repeat, entries, stored_ratio, workers, json_path=None):
+    """End-to-end /generate + /sign through the handlers: latency percentiles, MB/s, peak RSS per backend"""
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cpus": os.cpu_count(),
+        "config": {"sizes_mb": sizes, "repeat": repeat, "entries": entries, "stored_ratio": stored_ratio, "workers": workers},
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        files = os.path.join(workdir, "files")
+        os.makedirs(files)
+        handler = functools.partial(FileApiHandler, directory=files)
+        server = QuietServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_file_url = f"http://127.0.0.1:{server.server_address[1]}/file/bot"
+
+        print(f"\nEnd-to-end handlers ({entries} entries, {stored_ratio:.0%} stored, {workers} worker processes)")
+        print(f"{'backend':>8} {'size':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'MB/s':>8} {'job p50':>9} {'generate':>9} {'peak RSS':>9}")
+        try:
+            for size in sizes:
+                apk = os.path.join(files, f"synthetic_{size}.apk")
+                make_apk(apk, size, entries, stored_ratio)
+                for name in backends:
+                    keystore_backend, sign_backend, tools = E2E_BACKENDS[name]
+                    missing = [tool for tool in tools if shutil.which(tool) is None]
+                    if missing:
+                        print(f"{name:>8} {size:>6}MB ⚠️  skipped ({', '.join(missing)} not on PATH)")
+                        continue
+                    rundir = os.path.join(workdir, f"{name}_{size}")
+                    os.makedirs(rundir)
+                    env = dict(
+                        os.environ, ADMIN_IDS=str(BENCH_USER_ID), KEYSTORE_BACKEND=keystore_backend,
+                        SIGN_BACKEND=sign_backend, WORKER_PROCESSES=str(workers), SIGN_CACHE_MAX_MB="0", METRICS_PORT="0",
+                        UPLOAD_MAX_MB=os.environ.get("UPLOAD_MAX_MB", "2000"),  # local Bot API limit - 1 GB bhi deliver ho
+                    )
+                    spec = json.dumps({"base_file_url": base_file_url, "apk": apk, "size_mb": size, "repeat": repeat})
+                    proc = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--e2e-child", spec],
+                        cwd=rundir, env=env, capture_output=True, text=True,
+                    )
+                    if proc.returncode != 0:
+                        error = (proc.stderr.strip().splitlines() or ["failed"])[-1]
+                        print(f"{name:>8} {size:>6}MB ❌ {error[:80]}")
+                        report["results"].append({"backend": name, "size_mb": size, "error": error})
+                        shutil.rmtree(rundir, ignore_errors=True)
+                        continue
+                    r = json.loads(proc.stdout.strip().splitlines()[-1])
+                    latency = r["upload_to_reply"]
+                    row = {
+                        "backend": name, "size_mb": size,
+                        "latency": {q: percentile(latency, p) for q, p in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+                        "throughput_mb_s": size / statistics.median(latency),
+                        "sign_job_p50": percentile(r["sign_job"], 0.50),
+                        "generate_p50": percentile(r["generate"], 0.50),
+                        "peak_rss_mb": r["peak_rss_mb"],
+                        "children_peak_rss_mb": r["children_peak_rss_mb"],
+                        "samples": {k: r[k] for k in ("upload_to_reply", "sign_job", "generate")},
+                        "stages": r["stages"],
+                        "api_calls": r["api_calls"],
+                        "uploaded_bytes": r["uploaded_bytes"],
+                    }
+                    report["results"].append(row)
+                    rss = max(r["peak_rss_mb"], r["children_peak_rss_mb"])
+                    print(f"{name:>8} {size:>6}MB {row['latency']['p50']:8.2f}s {row['latency']['p95']:8.2f}s "
+                          f"{row['latency']['p99']:8.2f}s {row['throughput_mb_s']:8.1f} {row['sign_job_p50']:8.2f}s "
+                          f"{row['generate_p50']:8.2f}s {rss:7.0f}MB")
+                    shutil.rmtree(rundir, ignore_errors=True)
+                os.remove(apk)
+        finally:
+            server.shutdown()
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {json_path}")
+    return report
+
+
+async def _webhook_session(base_file_url, apk, admins, rounds, concurrency, latency):
+    document = {
+        "file_id": "bench_apk", "file_unique_id": "bench_apk", "file_name": os.path.basename(apk),
+        "mime_type": "application/vnd.android.package-archive", "file_size": os.path.getsize(apk),
+    }
+    api = FakeBotApi({"bench_apk": (os.path.basename(apk), document["file_size"])}, latency=latency)
+    builder = (
+        Application.builder().token(BENCH_TOKEN).request(api).get_updates_request(api).base_file_url(base_file_url)
+    )
+    if concurrency > 1:
+        builder = builder.concurrent_updates(bot.PerUserUpdateProcessor(concurrency))
+    application = bot.build_application(builder)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    url = f"http://127.0.0.1:{port}/{bot.WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": bot.WEBHOOK_SECRET}
+    user_ids = [BENCH_USER_ID + i for i in range(admins)]
+    update_ids = iter(range(1, admins * rounds * len(WEBHOOK_SCRIPT) + 1))
+    posted = collections.defaultdict(list)
+
+    async def admin(client, user_id):
+        # Burst: agla message pichhle reply ka wait kiye bina (webhook POST sirf queue tak)
+        for _ in range(rounds):
+            for text, _ in WEBHOOK_SCRIPT:
+                posted[user_id].append(time.perf_counter())
+                update = fake_message_update(next(update_ids), user_id, text, None if text else document)
+                response = await client.post(url, json=update, headers=headers)
+                response.raise_for_status()
+
+    def replied():
+        return all(len(api.replies[user_id]) >= rounds * len(WEBHOOK_SCRIPT) for user_id in user_ids)
+
+    await application.initialize()
+    await application.start()
+    await application.updater.start_webhook(
+        listen="127.0.0.1", port=port, url_path=bot.WEBHOOK_PATH, webhook_url=url,
+        secret_token=bot.WEBHOOK_SECRET, allowed_updates=bot.ALLOWED_UPDATES,
+    )
+    try:
+        start = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(admin(client, user_id) for user_id in user_ids))
+        async with api._changed:
+            await asyncio.wait_for(api._changed.wait_for(replied), 120)
+        elapsed = time.perf_counter() - start
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+        bot.job_runner.shutdown()
+
+    latencies, out_of_order = [], 0
+    expected = [prefix for _, prefix in WEBHOOK_SCRIPT] * rounds
+    for user_id in user_ids:
+        replies = api.replies[user_id]
+        latencies += [done - sent for sent, (done, _) in zip(posted[user_id], replies)]
+        out_of_order += sum(not text.startswith(prefix) for prefix, (_, text) in zip(expected, replies))
+    return {
+        "messages": len(latencies),
+        "throughput_msg_s": len(latencies) / elapsed,
+        "latency": {q: percentile(latencies, p) for q, p in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))},
+        "out_of_order": out_of_order,
+    }
+
+
+def run_webhook_child(spec):
+    """Child process: one concurrent_updates setting behind the webhook server, print JSON"""
+    spec = json.loads(spec)
+    result = asyncio.run(_webhook_session(
+        spec["base_file_url"], spec["apk"], spec["admins"], spec["rounds"], spec["concurrency"], spec["latency"]
+    ))
+    print(json.dumps(result))
+
+
+def bench_webhook(admins, rounds, concurrency_levels, latency_ms):
+    """Webhook mode under several admins: messages/s, per-message latency and per-user ordering"""
+    print(f"\nWebhook updates ({admins} admins x {rounds * len(WEBHOOK_SCRIPT)} messages, {latency_ms:g} ms Bot API latency)")
+    print(f"{'concurrent':>10} {'msg/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'reordered':>10}")
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        files = os.path.join(workdir, "files")
+        os.makedirs(files)
+        apk = os.path.join(files, "synthetic_webhook.apk")
+        make_apk(apk, 1, entries=50)
+        server = QuietServer(("127.0.0.1", 0), functools.partial(FileApiHandler, directory=files))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_file_url = f"http://127.0.0.1:{server.server_address[1]}/file/bot"
+        try:
+            for concurrency in concurrency_levels:
+                rundir = os.path.join(workdir, f"concurrent_{concurrency}")
+                os.makedirs(rundir)
+                env = dict(
+                    os.environ, METRICS_PORT="0", WORKER_PROCESSES="0",
+                    ADMIN_IDS=",".join(str(BENCH_USER_ID + i) for i in range(admins)),
+                )
+                spec = json.dumps({
+                    "base_file_url": base_file_url, "apk": apk, "admins": admins, "rounds": rounds,
+                    "concurrency": concurrency, "latency": latency_ms / 1000,
+                })
+                proc = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--webhook-child", spec],
+                    cwd=rundir, env=env, capture_output=True, text=True,
+                )
+                shutil.rmtree(rundir, ignore_errors=True)
+                if proc.returncode != 0:
+                    error = (proc.stderr.strip().splitlines() or ["failed"])[-1]
+                    print(f"{concurrency:>10} ❌ {error[:80]}")
+                    continue
+                r = json.loads(proc.stdout.strip().splitlines()[-1])
+                r["concurrency"] = concurrency
+                results.append(r)
+                print(f"{concurrency:>10} {r['throughput_msg_s']:8.1f} {r['latency']['p50'] * 1000:7.0f}ms "
+                      f"{r['latency']['p95'] * 1000:7.0f}ms {r['latency']['p99'] * 1000:7.0f}ms {r['out_of_order']:>10}")
+        finally:
+            server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="APK Signing Bot benchmarks")
+    parser.add_argument("--sizes", default="1,10,50", help="APK sizes in MB (comma separated)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size (best time is reported)")
+    parser.add_argument("--v2-size", type=int, default=200, help="APK size in MB for the v2/v3 throughput run")
+    parser.add_argument("--batch", type=int, default=8, help="APKs per batch for the batch signing run (0 = skip)")
+    parser.add_argument("--batch-size", type=int, default=20, help="Size in MB of each APK in the batch run")
+    parser.add_argument("--worker-jobs", type=int, default=16, help="Sign jobs for the worker tier load test (0 = skip)")
+    parser.add_argument("--stream-size", type=int, default=1024, help="APK size in MB for the end-to-end streaming run (0 = skip)")
+    parser.add_argument("--mem-cap", type=int, default=768, help="Address space cap in MB for the streaming run (0 = no cap)")
+    parser.add_argument("--e2e-sizes", default="1,10,100,1024", help="APK sizes in MB for the end-to-end handler suite (empty = skip)")
+    parser.add_argument("--e2e-backends", default="native,jvm", help=f"Backends for the end-to-end suite ({', '.join(E2E_BACKENDS)})")
+    parser.add_argument("--e2e-repeat", type=int, default=5, help="Samples per backend and size in the end-to-end suite")
+    parser.add_argument("--e2e-workers", type=int, default=0, help="WORKER_PROCESSES for the end-to-end suite (0 = in-process jobs)")
+    parser.add_argument("--entries", type=int, default=200, help="ZIP entries per synthetic APK in the end-to-end suite")
+    parser.add_argument("--stored-ratio", type=float, default=0.3, help="Fraction of STORED (vs DEFLATED) entries in the end-to-end suite")
+    parser.add_argument("--e2e-only", action="store_true", help="Run only the end-to-end suite")
+    parser.add_argument("--json", help="Write the end-to-end results as JSON to this path")
+    parser.add_argument("--webhook-admins", type=int, default=8, help="Simultaneous admins for the webhook load test (0 = skip)")
+    parser.add_argument("--webhook-rounds", type=int, default=10, help="/sign + /cancel rounds per admin in the webhook load test")
+    parser.add_argument("--webhook-concurrency", default="1,32", help="concurrent_updates values to compare (1 = sequential)")
+    parser.add_argument("--api-latency", type=float, default=20, help="Simulated Bot API round-trip in ms for the webhook load test")
+    parser.add_argument("--webhook-only", action="store_true", help="Run only the webhook load test")
+    parser.add_argument("--e2e-child", help=argparse.SUPPRESS)
+    parser.add_argument("--webhook-child", help=argparse.SUPPRESS)
+    parser.add_argument("--pipeline", choices=("sequential", "streaming"), help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--keystore", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.pipeline:
+        return run_pipeline(args.pipeline, args.url, args.keystore, args.out, args.mem_cap)
+
+    if args.e2e_child:
+        return run_e2e_child(args.e2e_child)
+
+    if args.webhook_child:
+        return run_webhook_child(args.webhook_child)
+
+    webhook_levels = [int(x) for x in args.webhook_concurrency.split(",") if x]
+    if args.webhook_only:
+        bench_webhook(args.webhook_admins, args.webhook_rounds, webhook_levels, args.api_latency)
+        return
+
+    e2e_sizes = [float(x) if "." in x else int(x) for x in args.e2e_sizes.split(",") if x]
+    if args.e2e_only:
+        bench_e2e(e2e_sizes, args.e2e_backends.split(","), args.e2e_repeat, args.entries,
+                  args.stored_ratio, args.e2e_workers, args.json)
+        return
+
+    sizes = [float(x) if "." in x else int(x) for x in args.sizes.split(",")]
+    bench_v1(sizes, args.repeat)
+    bench_v2(args.v2_size, args.repeat)
+    bench_algorithms(max(args.repeat, 5))
+    bench_key_cache(max(args.repeat, 5))
+    if args.batch:
+        bench_batch(args.batch, args.batch_size, args.repeat)
+    if args.worker_jobs:
+        bench_workers(args.worker_jobs, args.batch_size)
+    if args.stream_size:
+        bench_streaming(args.stream_size, args.mem_cap)
+    if args.webhook_admins:
+        bench_webhook(args.webhook_admins, args.webhook_rounds, webhook_levels, args.api_latency)
+    if e2e_sizes:
+        bench_e2e(e2e_sizes, args.e2e_backends.split(","), args.e2e_repeat, args.entries,
+                  args.stored_ratio, args.e2e_workers, args.json)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
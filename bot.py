@@ -9,10 +9,38 @@ import os
 import sys
 import subprocess
 import logging
+import multiprocessing
 import asyncio
-from datetime import datetime
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+import base64
+import hashlib
+import hmac
+import io
+import pickle
+import re
+import secrets
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import urlparse
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict, deque
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, padding, rsa
+from cryptography.hazmat.primitives.serialization import pkcs7, pkcs12
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.x509.oid import NameOID
+from telegram import InputFile, Update
+from telegram.error import TelegramError
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, filters, ContextTypes
 
 # Bot Configuration - YEH VALUES APNI ACTUAL VALUES SE REPLACE KARNA
 BOT_TOKEN = os.environ.get('BOT_TOKEN', '8461756232:AAFfv224qFN0eh62osr1A5EXbkb0yZZw1aw')  # Render environment variable se
@@ -20,6 +48,84 @@ API_ID = os.environ.get('API_ID', '20088778')  # Render environment variable se
 API_HASH = os.environ.get('API_HASH', '331f2d7782d1eb9ecf4c6ff0ac0ddcda')  # Render environment variable se
 ADMIN_IDS = [int(x) for x in os.environ.get('ADMIN_IDS', '5827445104').split(',')]  # Multiple IDs support
 
+# Job runner limits - keytool/jarsigner ek saath kitne chal sakte hain aur kitni der tak
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', os.cpu_count() or 2))
+JOB_TIMEOUT = int(os.environ.get('JOB_TIMEOUT', '300'))  # seconds per job
+WORK_DIR = os.environ.get('WORK_DIR') or None  # per-job temp workspaces yahan bante hain (default: system temp)
+QUEUE_MAX_DEPTH = int(os.environ.get('QUEUE_MAX_DEPTH', '50'))  # sab admins ke milake max waiting jobs
+QUEUE_MAX_PER_USER = int(os.environ.get('QUEUE_MAX_PER_USER', '10'))  # ek admin ke max waiting jobs
+
+# Metrics - per-stage latency histograms, /stats command aur Prometheus text endpoint
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '9464'))  # 127.0.0.1:<port>/metrics (0 = off)
+SLOW_JOB_SECONDS = float(os.environ.get('SLOW_JOB_SECONDS', '30'))  # isse slow job ka stage trace log hota hai (0 = off)
+
+# Worker tier - signing alag processes mein (bot process sirf frontend), durable SQLite queue ke through
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', os.cpu_count() or 2))  # 0 = jobs bot process mein hi
+JOB_QUEUE_DB = os.environ.get('JOB_QUEUE_DB', 'jobs.db')
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))  # worker crash pe job kitni baar dobara chale
+
+# Signing backend: 'native' (in-process, no JVM) ya 'jarsigner' (purana subprocess path)
+SIGN_BACKEND = os.environ.get('SIGN_BACKEND', 'native')
+# Keystore backend: 'native' (ek hi pass mein JKS + PKCS12 + PEM) ya 'keytool' (teen JVM launches)
+KEYSTORE_BACKEND = os.environ.get('KEYSTORE_BACKEND', 'native')
+SIGN_SCHEMES = os.environ.get('SIGN_SCHEMES', 'v1,v2,v3')  # default signature schemes for /sign
+ZIP_ALIGN = os.environ.get('ZIP_ALIGN', '1') == '1'  # signing ke saath hi zipalign
+ZIP_ALIGN_SO = int(os.environ.get('ZIP_ALIGN_SO', '16384'))  # .so page alignment (16 KiB, 4 KiB ke saath bhi compatible)
+INCREMENTAL_V1 = os.environ.get('INCREMENTAL_V1', '1') == '1'  # purane manifest ke unchanged digests reuse karo
+DIGEST_WORKERS = int(os.environ.get('DIGEST_WORKERS', os.cpu_count() or 2))  # v2/v3 chunk hashing threads
+STREAM_DIGEST = os.environ.get('STREAM_DIGEST', '1') == '1'  # upload aate aate hi entries digest karo
+VERIFY_SIGNED = os.environ.get('VERIFY_SIGNED', '1') == '1'  # sign ke baad in-process v1/v2/v3 verify
+
+# Key algorithm for /generate (RSA-2048, RSA-3072, RSA-4096, EC-P256)
+KEY_ALGORITHM = os.environ.get('KEY_ALGORITHM', 'RSA-2048')
+
+# Pre-generated key pool - /generate ko RSA keygen ka wait na karna pade
+KEY_POOL_SIZE = int(os.environ.get('KEY_POOL_SIZE', '4'))  # 0 = pool disabled
+KEY_POOL_SPILL = os.environ.get('KEY_POOL_SPILL')  # optional file jahan shutdown pe warm keys save hoti hain (.<algorithm> suffix ke saath)
+KEY_POOL_PASSPHRASE = os.environ.get('KEY_POOL_PASSPHRASE')  # spill file encrypt karne ke liye (zaroori)
+
+# Signed APK cache - same APK + same key dobara aaye to turant result
+SIGN_CACHE_DIR = os.environ.get('SIGN_CACHE_DIR', 'signed_cache')
+SIGN_CACHE_MAX_BYTES = int(os.environ.get('SIGN_CACHE_MAX_MB', '2048')) * 1024 * 1024  # 0 = cache disabled
+
+# Keystore registry - har admin ke kai keystores (user + alias se), SQLite index ke saath
+KEYSTORE_DB = os.environ.get('KEYSTORE_DB', 'keystores.db')
+KEY_CACHE_TTL = int(os.environ.get('KEY_CACHE_TTL', '900'))  # unlocked key kitne seconds memory mein rahe (0 = cache off)
+KEY_CACHE_MAX = int(os.environ.get('KEY_CACHE_MAX', '32'))  # max unlocked keys (LRU eviction)
+
+# Conversation sessions - adhoore /generate, /sign, /batch flows idle hone pe hata do
+SESSION_TTL = int(os.environ.get('SESSION_TTL', '1800'))  # idle seconds ke baad session + uploads delete (0 = never)
+SESSION_SWEEP_SECONDS = int(os.environ.get('SESSION_SWEEP_SECONDS', '60'))  # eviction thread kitni der mein chale
+SESSION_DB = os.environ.get('SESSION_DB')  # optional SQLite file - in-progress flows restart ke baad bhi chalein
+SESSION_SECRET_FIELDS = ('store_pass', 'key_pass')  # passwords kabhi disk pe nahi likhe jaate
+UPLOAD_PREFIX = "uploaded_"  # handle_document ke downloads (cwd mein)
+
+# Batch signing (/batch) - kai APKs / .apks bundles ek saath, process pool pe
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 2))
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '50'))  # ek batch mein max APKs (archives ke andar wale bhi)
+BATCH_ARCHIVE_EXTENSIONS = ('.apks', '.xapk', '.zip')  # split-APK bundles / APK archives
+BATCH_REPORT_CHARS = 3500  # chat reply mein itna report; baaki batch_report.txt mein (Telegram limit 4096)
+
+# Result delivery - signed APK + keystore bundle wapas chat mein upload
+SEND_RESULTS = os.environ.get('SEND_RESULTS', '1') == '1'
+BOT_API_URL = os.environ.get('BOT_API_URL')  # local Bot API server (--local mode), e.g. http://127.0.0.1:8081/bot
+BOT_API_FILE_URL = os.environ.get('BOT_API_FILE_URL') or (BOT_API_URL.replace('/bot', '/file/bot') if BOT_API_URL else None)
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_MB', '2000' if BOT_API_URL else '50')) * 1024 * 1024  # cloud Bot API: 50 MB
+UPLOAD_CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', '4'))  # batch results ek saath kitne upload hon
+UPLOAD_TIMEOUT = int(os.environ.get('UPLOAD_TIMEOUT', '600'))  # seconds per upload
+
+# Updates - webhook (WEBHOOK_URL set ho to) ya polling; dono mein updates concurrently, per-user order mein
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # public HTTPS base URL (Render pe $RENDER_EXTERNAL_URL), unset = polling
+WEBHOOK_LISTEN = os.environ.get('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', os.environ.get('PORT', '8443')))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or secrets.token_urlsafe(32)  # X-Telegram-Bot-Api-Secret-Token check
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '32'))  # ek saath process hone wale updates (1 = sequential)
+ALLOWED_UPDATES = [Update.MESSAGE]  # sirf messages handle hote hain - baaki types Telegram bheje hi nahi
+
+# Files produced by /generate (workspace se cert_dir mein publish hote hain)
+KEYSTORE_FILES = ["android.jks", "android.p12", "certificate.cer", "sign_apk.sh", "README_APK_SIGNING.txt"]
+
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -27,15 +133,2967 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class JobTimeoutError(Exception):
+    """Raised when a job does not finish within its timeout"""
+
+
+class JobRunner:
+    """Run blocking keytool/jarsigner jobs off the event loop"""
+
+    def __init__(self, concurrency=JOB_CONCURRENCY, timeout=JOB_TIMEOUT):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="job")
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Semaphore ko running loop ke andar hi banana padta hai
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def run(self, func, *args, timeout=None):
+        """Run func(*args) in the job executor and await its result"""
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            future = loop.run_in_executor(self.executor, self._traced, func, *args)
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise JobTimeoutError(f"Job timed out after {timeout} seconds")
+
+    @staticmethod
+    def _traced(func, *args):
+        # Job ke saare stages ek trace mein (slow job ho to breakdown log)
+        with metrics.trace(getattr(func, "__name__", "job")):
+            return func(*args)
+
+    def shutdown(self):
+        """Stop accepting jobs and wait for running ones"""
+        self.executor.shutdown(wait=True)
+
+
+class StageMetrics:
+    """Per-stage latency histograms, bytes counters and per-job traces
+
+    Har stage ke liye Prometheus-style cumulative buckets (endpoint ke liye) aur
+    last SAMPLE_SIZE samples (p50/p95/p99 ke liye). trace() ke andar jitne
+    stage chalte hain woh ek job trace mein jaate hain; job SLOW_JOB_SECONDS se
+    slow ho to poora breakdown log hota hai.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    SAMPLE_SIZE = 1024
+
+    def __init__(self, slow_seconds=SLOW_JOB_SECONDS):
+        self.slow_seconds = slow_seconds
+        self.slow_jobs = 0
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, stage, seconds, nbytes=0):
+        with self._lock:
+            data = self._stages.get(stage)
+            if data is None:
+                data = self._stages[stage] = {
+                    "count": 0, "sum": 0.0, "bytes": 0,
+                    "buckets": [0] * len(self.BUCKETS),
+                    "samples": deque(maxlen=self.SAMPLE_SIZE),
+                }
+            data["count"] += 1
+            data["sum"] += seconds
+            data["bytes"] += nbytes
+            data["samples"].append(seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    data["buckets"][i] += 1
+        spans = getattr(self._local, "spans", None)
+        if spans is not None:
+            spans.append((stage, seconds, nbytes))
+
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        """Time the with-block as one sample of stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, nbytes)
+
+    @contextmanager
+    def trace(self, job):
+        """Collect every stage recorded on this thread into one job trace (yields the span list)"""
+        spans = []
+        previous = getattr(self._local, "spans", None)
+        self._local.spans = spans
+        start = time.perf_counter()
+        try:
+            yield spans
+        finally:
+            self._local.spans = previous
+            self.check_slow(job, time.perf_counter() - start, spans)
+
+    def check_slow(self, job, total, spans):
+        if not self.slow_seconds or total < self.slow_seconds:
+            return
+        self.slow_jobs += 1
+        breakdown = ", ".join(
+            f"{stage}={seconds:.3f}s" + (f"/{nbytes / 1024 / 1024:.1f}MB" if nbytes else "")
+            for stage, seconds, nbytes in spans
+        )
+        logger.warning(f"Slow job {job}: {total:.2f}s [{breakdown}]")
+
+    @staticmethod
+    def _percentile(samples, q):
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self):
+        """{stage: {count, p50, p95, p99, total, bytes}} (seconds)"""
+        with self._lock:
+            result = {}
+            for stage, data in self._stages.items():
+                samples = list(data["samples"])
+                result[stage] = {
+                    "count": data["count"],
+                    "p50": self._percentile(samples, 0.50),
+                    "p95": self._percentile(samples, 0.95),
+                    "p99": self._percentile(samples, 0.99),
+                    "total": data["sum"],
+                    "bytes": data["bytes"],
+                }
+            return result
+
+    def prometheus(self, gauges=None):
+        """Prometheus text exposition format"""
+        lines = [
+            "# HELP apk_bot_stage_seconds Latency of each job stage",
+            "# TYPE apk_bot_stage_seconds histogram",
+        ]
+        with self._lock:
+            stages = [(stage, dict(data, buckets=list(data["buckets"]))) for stage, data in self._stages.items()]
+        for stage, data in stages:
+            for bound, count in zip(self.BUCKETS, data["buckets"]):
+                lines.append(f'apk_bot_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'apk_bot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {data["count"]}')
+            lines.append(f'apk_bot_stage_seconds_sum{{stage="{stage}"}} {data["sum"]:.6f}')
+            lines.append(f'apk_bot_stage_seconds_count{{stage="{stage}"}} {data["count"]}')
+        lines += ["# HELP apk_bot_stage_bytes_total Bytes processed by each stage", "# TYPE apk_bot_stage_bytes_total counter"]
+        lines += [f'apk_bot_stage_bytes_total{{stage="{stage}"}} {data["bytes"]}' for stage, data in stages]
+        lines += ["# TYPE apk_bot_slow_jobs_total counter", f"apk_bot_slow_jobs_total {self.slow_jobs}"]
+        for name, value in (gauges or {}).items():
+            lines += [f"# TYPE apk_bot_{name} gauge", f"apk_bot_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, gauges=None):
+        """Serve /metrics on 127.0.0.1:port from a daemon thread, return the server"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus(gauges() if gauges else None).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+metrics = StageMetrics()
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue (global or per admin) is at its depth limit"""
+
+
+class FairScheduler:
+    """Per-admin job queues in front of JobRunner
+
+    Round-robin between admins (ek admin ka burst baaki sabko starve na kare),
+    global concurrency cap, bounded queue depth, aur small jobs (keystore
+    generate) ko line mein aage jagah. on_position(n) callback har baar call
+    hota hai jab job ki queue position badle (0 = ab chal raha hai).
+    """
+
+    def __init__(self, runner, concurrency=JOB_CONCURRENCY, max_depth=QUEUE_MAX_DEPTH, max_per_user=QUEUE_MAX_PER_USER):
+        self.runner = runner
+        self.concurrency = max(1, concurrency)
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self._queues = OrderedDict()  # user_id -> deque of jobs; dict order = round-robin turn
+
+    def submit(self, user_id, func, *args, small=False, timeout=None, on_position=None):
+        """Queue func(*args) for user_id and return an asyncio.Future for its result"""
+        queue = self._queues.get(user_id, ())
+        if self.waiting >= self.max_depth:
+            self.rejected += 1
+            raise QueueFullError(f"Server is busy ({self.waiting} jobs waiting). Please try again in a few minutes.")
+        if len(queue) >= self.max_per_user:
+            self.rejected += 1
+            raise QueueFullError(f"You already have {len(queue)} jobs waiting. Please wait for them to finish.")
+
+        job = {
+            "user_id": user_id,
+            "func": func,
+            "args": args,
+            "small": small,
+            "timeout": timeout,
+            "on_position": on_position,
+            "position": None,
+            "submitted": time.perf_counter(),
+            "future": asyncio.get_running_loop().create_future(),
+        }
+        self._queues.setdefault(user_id, deque()).append(job)
+        self.waiting += 1
+        self._dispatch()
+        return job["future"]
+
+    def cancel(self, user_id):
+        """Drop every waiting job of user_id, return how many were cancelled"""
+        queue = self._queues.pop(user_id, ())
+        for job in queue:
+            job["future"].cancel()
+        self.waiting -= len(queue)
+        self._dispatch()
+        return len(queue)
+
+    @staticmethod
+    def _pick(queues):
+        """Pop the next job: a small job at any queue head first, else the next admin in turn"""
+        for user_id, queue in queues.items():
+            if queue[0]["small"]:
+                break
+        else:
+            user_id = next(iter(queues))
+        queue = queues.pop(user_id)
+        job = queue.popleft()
+        if queue:
+            queues[user_id] = queue  # line ke end mein - round-robin
+        return job
+
+    def _dispatch(self):
+        while self.running < self.concurrency and self._queues:
+            job = self._pick(self._queues)
+            self.waiting -= 1
+            if job["future"].cancelled():
+                continue
+            self.running += 1
+            metrics.record("queue_wait", time.perf_counter() - job["submitted"])
+            self._notify(job, 0)
+            asyncio.ensure_future(self._run(job))
+
+        # Baaki sabki position dobara (wahi order jismein _pick unhe nikalega)
+        queues = OrderedDict((user_id, deque(queue)) for user_id, queue in self._queues.items())
+        position = 0
+        while queues:
+            position += 1
+            self._notify(self._pick(queues), position)
+
+    def _notify(self, job, position):
+        previous, job["position"] = job["position"], position
+        # Turant start hone wale job ke liye koi update nahi - status message pehle se "working" hai
+        if job["on_position"] and previous != position and not (previous is None and position == 0):
+            asyncio.ensure_future(job["on_position"](position))
+
+    async def _run(self, job):
+        future = job["future"]
+        try:
+            result = await self.runner.run(job["func"], *job["args"], timeout=job["timeout"])
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._dispatch()
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queues": {user_id: len(queue) for user_id, queue in self._queues.items()},
+        }
+
+
+# Worker tier jobs - sirf yeh APKSigningBot methods queue ke through worker processes mein chalte hain
+WORKER_JOBS = ("sign_apk_process", "sign_batch_process", "generate_keystore")
+SECRETS_TOKEN_FIELD = "_secrets_token"  # jobs.db payload mein passwords ki jagah yeh token
+
+
+def _open_job_queue(db_path):
+    db = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, payload BLOB NOT NULL,"
+        " chat_id INTEGER, status TEXT NOT NULL DEFAULT 'queued', worker_pid INTEGER,"
+        " attempts INTEGER NOT NULL DEFAULT 0, result BLOB,"
+        " created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+    return db
+
+
+def _worker_main(db_path, conn, slot, digest_workers, key_pool_size, poll_interval):
+    """Worker process loop: claim the oldest queued job, run it, store the pickled result
+
+    conn = bot process se pipe: passwords (sirf memory mein), /lock evictions aur
+    cache stats isi pe aate-jaate hain - jobs.db mein kabhi nahi.
+    """
+    global DIGEST_WORKERS
+    DIGEST_WORKERS = digest_workers  # saare workers milke cores share karte hain
+    # Har worker ka apna chhota key pool + apni spill file (ek hi key do workers ko na mile)
+    spill = f"{KEY_POOL_SPILL}.worker{slot}" if KEY_POOL_SPILL else None
+    bot.key_pool = KeyPool(key_pool_size, spill, KEY_POOL_PASSPHRASE, bot.key_pool.algorithm)
+    bot.key_pool.start()
+    parent = os.getppid()
+    db = _open_job_queue(db_path)
+    pid = os.getpid()
+    state = {"stopping": False, "secrets": {}}
+
+    def send_stats():
+        conn.send(("stats", {"key_cache": bot.key_cache.stats(), "signed_cache": bot.signed_cache.stats()}))
+
+    def handle(message):
+        if message[0] == "evict":
+            _, request, paths = message
+            evicted = sum(bot.key_cache.evict(path) for path in paths) if paths is not None else bot.key_cache.evict()
+            send_stats()  # ack se pehle - /lock ke reply tak stats taaze rahein
+            conn.send(("evicted", request, evicted))
+        elif message[0] == "secrets":
+            state["secrets"][message[1]] = message[2]
+        elif message[0] == "stop":
+            state["stopping"] = True
+
+    def fetch_secrets(token):
+        # Bot se is job ke passwords maango; restart ke baad bot ke paas nahi honge (None)
+        conn.send(("secrets?", token))
+        deadline = time.monotonic() + 30
+        while token not in state["secrets"] and conn.poll(max(0, deadline - time.monotonic())):
+            handle(conn.recv())
+        return state["secrets"].pop(token, None)
+
+    try:
+        while os.getppid() == parent and not state["stopping"]:  # bot process mar gaya to worker bhi band
+            while conn.poll():
+                handle(conn.recv())
+            bot.key_cache.evict_expired()
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT id, kind, payload FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                conn.poll(poll_interval)
+                continue
+            job_id, kind, payload = row
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker_pid = ?, attempts = attempts + 1, started_at = ? WHERE id = ?",
+                (pid, time.time(), job_id),
+            )
+            db.execute("COMMIT")
+
+            user_data = pickle.loads(payload)
+            token = user_data.pop(SECRETS_TOKEN_FIELD, None)
+            hidden = fetch_secrets(token) if token else {}
+            with metrics.trace(kind) as spans:
+                try:
+                    if hidden is None:
+                        result = (False, "The bot restarted before this job ran and passwords are never stored on disk. Please start again.")
+                    elif kind in WORKER_JOBS:
+                        user_data.update(hidden)
+                        result = getattr(bot, kind)(user_data)
+                    else:
+                        result = (False, f"Unknown job: {kind}")
+                except Exception as e:
+                    result = (False, f"Worker error: {e}")
+            # user_data bhi wapas (jobs usmein output likhte hain, jaise keystore_dir) - passwords ke bina
+            for field in SESSION_SECRET_FIELDS:
+                user_data.pop(field, None)
+            db.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ? AND worker_pid = ?",
+                (pickle.dumps((result, user_data, spans)), time.time(), job_id, pid),
+            )
+            send_stats()
+    finally:
+        bot.key_pool.stop()  # warm keys spill file mein
+        bot.key_cache.evict()
+
+
+class WorkerTier:
+    """Run signing jobs in N worker processes fed from a durable SQLite queue
+
+    Bot process sirf job queue mein daalta hai aur results poll karta hai. Worker
+    crash ho to uska running job wapas queue mein (JOB_MAX_ATTEMPTS tak) aur naya
+    worker spawn hota hai; timeout pe job fail aur uska worker band. Bot restart ke
+    baad bache hue jobs bhi chalte hain; unke results on_orphan_result(chat_id, kind,
+    result) se bheje jaate hain. Passwords har worker ko pipe se milte hain, disk pe nahi.
+    """
+
+    def __init__(self, db_path=JOB_QUEUE_DB, processes=WORKER_PROCESSES, poll_interval=0.05, fallback=None):
+        self.db_path = os.path.abspath(db_path)
+        self.processes = max(1, processes)
+        self.poll_interval = poll_interval
+        self.fallback = fallback
+        self.on_orphan_result = None
+        self.restarts = 0
+        self.requeued = 0
+        self.completed = 0
+        self.timed_out = 0
+        self._workers = []
+        self._conns = {}  # worker pid -> bot side of its pipe
+        self._waiters = {}  # job_id -> (future, user_data)
+        self._secrets = {}  # token -> {store_pass, key_pass} - sirf is process ki memory mein
+        self._tokens = {}  # job_id -> token
+        self._evictions = {}  # request id -> [pids left, keys evicted, future]
+        self._requests = 0
+        self._worker_stats = {}  # pid -> latest {"key_cache": ..., "signed_cache": ...}
+        self._poller = None
+        self._loop = None
+        self._db = None
+        self._context = multiprocessing.get_context("spawn")  # fork + threads = deadlock ka risk
+
+    def start(self):
+        """Open the queue, requeue jobs left running by a previous run and spawn the workers"""
+        self._db = _open_job_queue(self.db_path)
+        self._requeue("status = 'running'")
+        self._workers = [self._spawn(slot) for slot in range(self.processes)]
+
+    def _spawn(self, slot):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                self.db_path,
+                child_conn,
+                slot,
+                max(1, DIGEST_WORKERS // self.processes),
+                -(-KEY_POOL_SIZE // self.processes),  # ceil - pool on hai to har worker mein kam se kam 1
+                self.poll_interval,
+            ),
+            name="sign-worker",
+        )
+        process.start()
+        child_conn.close()
+        self._conns[process.pid] = conn
+        if self._loop is not None:
+            self._loop.add_reader(conn.fileno(), self._on_message, process.pid)
+        return process
+
+    def _requeue(self, where, params=()):
+        """Put matching running jobs back in the queue, or fail them after JOB_MAX_ATTEMPTS"""
+        failed = pickle.dumps(((False, "Job failed: worker crashed repeatedly"), None, []))
+        with self._db:
+            self.requeued += self._db.execute(
+                f"UPDATE jobs SET status = 'queued', worker_pid = NULL WHERE {where} AND attempts < ?",
+                (*params, JOB_MAX_ATTEMPTS),
+            ).rowcount
+            self._db.execute(
+                f"UPDATE jobs SET status = 'done', result = ?, finished_at = ? WHERE {where} AND attempts >= ?",
+                (failed, time.time(), *params, JOB_MAX_ATTEMPTS),
+            )
+
+    def supervise(self):
+        """Respawn dead workers and requeue the jobs they were running"""
+        for i, process in enumerate(self._workers):
+            if process.is_alive():
+                continue
+            process.join()
+            self._forget(process.pid)
+            self._requeue("status = 'running' AND worker_pid = ?", (process.pid,))
+            self._workers[i] = self._spawn(i)
+            self.restarts += 1
+            logger.warning(f"Worker {process.pid} exited ({process.exitcode}), restarted as {self._workers[i].pid}")
+
+    async def run(self, func, *args, timeout=None):
+        """Same interface as JobRunner.run; WORKER_JOBS go through the queue, anything else to fallback"""
+        kind = getattr(func, "__name__", "")
+        if kind not in WORKER_JOBS or len(args) != 1:
+            return await self.fallback.run(func, *args, timeout=timeout)
+        user_data = args[0]
+        job_id = self.enqueue(kind, user_data, user_data.get('user_id'))
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[job_id] = (future, user_data)
+        self.ensure_polling()
+        timeout = JOB_TIMEOUT if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.abandon(job_id)
+            raise JobTimeoutError(f"Job timed out after {timeout} seconds and was stopped")
+        finally:
+            self._waiters.pop(job_id, None)
+
+    def enqueue(self, kind, user_data, chat_id=None):
+        """Queue a job; passwords stay in memory and only a token goes into jobs.db"""
+        payload = {k: v for k, v in user_data.items() if k not in SESSION_SECRET_FIELDS}
+        hidden = {k: user_data[k] for k in SESSION_SECRET_FIELDS if k in user_data}
+        if hidden:
+            payload[SECRETS_TOKEN_FIELD] = secrets.token_hex(16)
+            self._secrets[payload[SECRETS_TOKEN_FIELD]] = hidden
+        with self._db:
+            job_id = self._db.execute(
+                "INSERT INTO jobs (kind, payload, chat_id, created_at) VALUES (?, ?, ?, ?)",
+                (kind, pickle.dumps(payload), chat_id, time.time()),
+            ).lastrowid
+        if hidden:
+            self._tokens[job_id] = payload[SECRETS_TOKEN_FIELD]
+        return job_id
+
+    def abandon(self, job_id):
+        """Drop a timed-out job from the queue and terminate the worker running it (supervise respawns)"""
+        self._db.execute("BEGIN IMMEDIATE")  # worker beech mein claim na kar le
+        row = self._db.execute("SELECT status, worker_pid FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        self._db.execute("COMMIT")
+        self._secrets.pop(self._tokens.pop(job_id, None), None)
+        if row is None:
+            return
+        self.timed_out += 1
+        status, pid = row
+        if status == 'running':
+            for process in self._workers:
+                if process.pid == pid and process.is_alive():
+                    logger.warning(f"Job {job_id} timed out, terminating worker {pid}")
+                    process.terminate()
+
+    def collect(self):
+        """Hand finished jobs to their waiters (or on_orphan_result) and delete them from the queue"""
+        rows = self._db.execute("SELECT id, kind, chat_id, result FROM jobs WHERE status = 'done'").fetchall()
+        for job_id, kind, chat_id, payload in rows:
+            result, user_data, spans = pickle.loads(payload)
+            for stage, seconds, nbytes in spans:
+                metrics.record(stage, seconds, nbytes)
+            self._secrets.pop(self._tokens.pop(job_id, None), None)
+            waiter = self._waiters.pop(job_id, None)
+            if waiter:
+                future, original = waiter
+                if user_data:
+                    original.update(user_data)
+                if not future.done():
+                    future.set_result(result)
+            elif self.on_orphan_result:
+                # Bot restart se pehle queue hua job - chat mein seedha result bhejo
+                self.on_orphan_result(chat_id, kind, result)
+            with self._db:
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self.completed += 1
+
+    async def evict_keys(self, paths=None, timeout=2.0):
+        """Drop unlocked keys (of these keystore paths, or all) in every worker
+
+        Return (keys evicted, busy workers) - busy worker apna job khatam karke evict karta hai.
+        """
+        self.ensure_polling()
+        self._requests += 1
+        request = self._requests
+        future = asyncio.get_running_loop().create_future()
+        state = self._evictions[request] = [set(self._conns), 0, future]
+        for pid in list(state[0]):
+            try:
+                self._conns[pid].send(("evict", request, paths))
+            except OSError:
+                state[0].discard(pid)
+        if state[0]:
+            try:
+                await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._evictions.pop(request, None)
+        return state[1], len(state[0])
+
+    def worker_stats(self, name):
+        """Latest per-worker snapshots of one cache's stats ("key_cache" / "signed_cache")"""
+        return [stats[name] for stats in self._worker_stats.values()]
+
+    def _on_message(self, pid):
+        conn = self._conns.get(pid)
+        try:
+            while conn is not None and conn.poll():
+                message = conn.recv()
+                if message[0] == "secrets?":
+                    conn.send(("secrets", message[1], self._secrets.get(message[1])))
+                elif message[0] == "stats":
+                    self._worker_stats[pid] = message[1]
+                elif message[0] == "evicted":
+                    state = self._evictions.get(message[1])
+                    if state:
+                        state[0].discard(pid)
+                        state[1] += message[2]
+                        if not state[0] and not state[2].done():
+                            state[2].set_result(None)
+        except (EOFError, OSError):
+            self._forget(pid)
+
+    def _forget(self, pid):
+        """Stop listening to a dead worker (its cumulative counters stay, its unlocked keys are gone)"""
+        conn = self._conns.pop(pid, None)
+        if conn is None:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(conn.fileno())
+        conn.close()
+        if pid in self._worker_stats:
+            self._worker_stats[pid]["key_cache"]["entries"] = 0
+        for state in self._evictions.values():
+            state[0].discard(pid)
+            if not state[0] and not state[2].done():
+                state[2].set_result(None)
+
+    def ensure_polling(self):
+        """Start the result poller / worker supervisor on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            for pid, conn in self._conns.items():
+                loop.add_reader(conn.fileno(), self._on_message, pid)
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.ensure_future(self._poll_loop())
+
+    async def _poll_loop(self):
+        while True:
+            self.supervise()
+            self.collect()
+            await asyncio.sleep(self.poll_interval)
+
+    def stop(self):
+        """Stop polling and the workers (queued jobs stay in the DB for the next start)"""
+        if self._poller:
+            self._poller.cancel()
+        # Pehle shant band karo (key pool spill save ho), atke hue ko terminate
+        for conn in self._conns.values():
+            try:
+                conn.send(("stop",))
+            except OSError:
+                pass
+        deadline = time.monotonic() + 5
+        for process in self._workers:
+            process.join(max(0, deadline - time.monotonic()))
+        for process in self._workers:
+            if process.is_alive():
+                process.terminate()
+                process.join(5)
+        for pid in list(self._conns):
+            self._forget(pid)
+        self._workers = []
+        self._loop = None
+        if self._db:
+            self._db.close()
+
+    def stats(self):
+        counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            "workers": sum(1 for p in self._workers if p.is_alive()),
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "completed": self.completed,
+            "restarts": self.restarts,
+            "requeued": self.requeued,
+            "timed_out": self.timed_out,
+        }
+
+
+class KeystoreError(Exception):
+    """Raised when a keystore cannot be opened or the alias is missing"""
+
+
+# Keystore loading (JKS + PKCS12) - jarsigner ke bina key nikalne ke liye
+JKS_MAGIC = b"\xfe\xed\xfe\xed"
+JKS_KEY_PROTECTOR_OID = "1.3.6.1.4.1.42.2.17.1.1"
+JKS_INTEGRITY_SALT = b"Mighty Aphrodite"
+
+
+def _der_read(data, pos):
+    """Read one DER TLV at pos, return (tag, value, next_pos)"""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        num = length & 0x7F
+        length = int.from_bytes(data[pos:pos + num], "big")
+        pos += num
+    return tag, data[pos:pos + length], pos + length
+
+
+def _der_oid(value):
+    """Decode a DER OBJECT IDENTIFIER value to dotted string"""
+    parts = [value[0] // 40, value[0] % 40]
+    num = 0
+    for byte in value[1:]:
+        num = (num << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            parts.append(num)
+            num = 0
+    return ".".join(str(p) for p in parts)
+
+
+def _jks_keystream(password, salt, length):
+    """Sun KeyProtector keystream: SHA1(password + previous digest) blocks"""
+    digest = salt
+    stream = bytearray()
+    while len(stream) < length:
+        digest = hashlib.sha1(password + digest).digest()
+        stream += digest
+    return bytes(stream[:length])
+
+
+def _jks_read_utf(data, pos):
+    length, = struct.unpack_from(">H", data, pos)
+    pos += 2
+    return data[pos:pos + length].decode("utf-8"), pos + length
+
+
+def _load_jks(data, alias, store_pass, key_pass):
+    """Parse a JKS keystore and decrypt the private key for alias"""
+    password = store_pass.encode("utf-16-be")
+    expected = hashlib.sha1(password + JKS_INTEGRITY_SALT + data[:-20]).digest()
+    if expected != data[-20:]:
+        raise KeystoreError("Keystore password is incorrect")
+
+    _, _, count = struct.unpack_from(">III", data, 0)
+    pos = 12
+    for _ in range(count):
+        tag, = struct.unpack_from(">I", data, pos)
+        entry_alias, pos = _jks_read_utf(data, pos + 4)
+        pos += 8  # creation timestamp
+        if tag == 1:
+            key_len, = struct.unpack_from(">I", data, pos)
+            protected = data[pos + 4:pos + 4 + key_len]
+            pos += 4 + key_len
+            cert_count, = struct.unpack_from(">I", data, pos)
+            pos += 4
+            certs = []
+            for _ in range(cert_count):
+                _, pos = _jks_read_utf(data, pos)
+                cert_len, = struct.unpack_from(">I", data, pos)
+                certs.append(x509.load_der_x509_certificate(data[pos + 4:pos + 4 + cert_len]))
+                pos += 4 + cert_len
+            if entry_alias.lower() != alias.lower():
+                continue
+
+            # EncryptedPrivateKeyInfo ::= SEQUENCE { AlgorithmIdentifier, OCTET STRING }
+            _, epki, _ = _der_read(protected, 0)
+            _, algorithm, inner = _der_read(epki, 0)
+            _, encrypted, _ = _der_read(epki, inner)
+            _, oid, _ = _der_read(algorithm, 0)
+            if _der_oid(oid) != JKS_KEY_PROTECTOR_OID:
+                raise KeystoreError("Unsupported JKS key protection algorithm")
+
+            key_password = (key_pass or store_pass).encode("utf-16-be")
+            salt, body, check = encrypted[:20], encrypted[20:-20], encrypted[-20:]
+            stream = _jks_keystream(key_password, salt, len(body))
+            plain = bytes(a ^ b for a, b in zip(body, stream))
+            if hashlib.sha1(key_password + plain).digest() != check:
+                raise KeystoreError("Key password is incorrect")
+            return serialization.load_der_private_key(plain, password=None), certs
+        elif tag == 2:
+            _, pos = _jks_read_utf(data, pos)
+            cert_len, = struct.unpack_from(">I", data, pos)
+            pos += 4 + cert_len
+        else:
+            raise KeystoreError(f"Unknown JKS entry type {tag}")
+
+    raise KeystoreError(f"Alias not found in keystore: {alias}")
+
+
+def _load_pkcs12(data, alias, store_pass):
+    """Open a PKCS12 keystore (JDK 9+ keytool ka default format)"""
+    try:
+        bundle = pkcs12.load_pkcs12(data, store_pass.encode("utf-8"))
+    except ValueError:
+        raise KeystoreError("Keystore password is incorrect or file is not a keystore")
+    if bundle.key is None or bundle.cert is None:
+        raise KeystoreError("Keystore does not contain a private key")
+    friendly_name = bundle.cert.friendly_name
+    if friendly_name and friendly_name.decode("utf-8").lower() != alias.lower():
+        raise KeystoreError(f"Alias not found in keystore: {alias}")
+    certs = [bundle.cert.certificate] + [c.certificate for c in bundle.additional_certs]
+    return bundle.key, certs
+
+
+def load_signing_key(path, alias, store_pass, key_pass=None):
+    """Load (private_key, cert_chain) for alias from a JKS or PKCS12 keystore"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] == JKS_MAGIC:
+        return _load_jks(data, alias, store_pass, key_pass)
+    return _load_pkcs12(data, alias, store_pass)
+
+
+# Keystore generation - keytool ke bina JKS / PKCS12 / PEM ek saath
+JKS_VERSION = 2
+PKCS12_KDF_ROUNDS = 10000
+
+
+def _der_tlv(tag, value):
+    """Encode one DER TLV"""
+    length = len(value)
+    if length < 0x80:
+        return bytes([tag, length]) + value
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, "big") + value
+
+
+def _der_encode_oid(oid):
+    parts = [int(p) for p in oid.split(".")]
+    out = bytearray([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        encoded = [part & 0x7F]
+        part >>= 7
+        while part:
+            encoded.append(0x80 | (part & 0x7F))
+            part >>= 7
+        out += bytes(reversed(encoded))
+    return _der_tlv(0x06, bytes(out))
+
+
+def build_subject(alias_name, org_unit, org_name, city, state, country):
+    """X.500 name in keytool -dname order (CN, OU, O, L, ST, C)"""
+    # DER mein ulta order jaata hai - C pehle, CN last (keytool jaisa hi)
+    return x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, country),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, state),
+        x509.NameAttribute(NameOID.LOCALITY_NAME, city),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, org_name),
+        x509.NameAttribute(NameOID.ORGANIZATIONAL_UNIT_NAME, org_unit),
+        x509.NameAttribute(NameOID.COMMON_NAME, alias_name),
+    ])
+
+
+# name -> (keytool -keyalg, keytool -keysize, jarsigner -sigalg, factory)
+KEY_ALGORITHMS = {
+    "RSA-2048": ("RSA", 2048, "SHA256withRSA", lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048)),
+    "RSA-3072": ("RSA", 3072, "SHA256withRSA", lambda: rsa.generate_private_key(public_exponent=65537, key_size=3072)),
+    "RSA-4096": ("RSA", 4096, "SHA256withRSA", lambda: rsa.generate_private_key(public_exponent=65537, key_size=4096)),
+    "EC-P256": ("EC", 256, "SHA256withECDSA", lambda: ec.generate_private_key(ec.SECP256R1())),
+}
+KEY_ALGORITHM_ALIASES = {
+    "rsa": "RSA-2048", "2048": "RSA-2048", "3072": "RSA-3072", "4096": "RSA-4096",
+    "ec": "EC-P256", "ecdsa": "EC-P256", "p256": "EC-P256", "p-256": "EC-P256", "secp256r1": "EC-P256",
+}
+
+
+def parse_key_algorithm(text):
+    """Map user input like 'ec', 'rsa-4096' or '3072' to a KEY_ALGORITHMS name"""
+    value = (text or "").strip().upper().replace(" ", "-").replace("_", "-")
+    for name in KEY_ALGORITHMS:
+        if value in (name, name.replace("-", "")):
+            return name
+    key = value.lower()
+    if key.startswith("rsa") and key != "rsa":
+        key = key[3:].lstrip("-")
+    if key not in KEY_ALGORITHM_ALIASES:
+        raise ValueError(f"Unknown key algorithm: {text}")
+    return KEY_ALGORITHM_ALIASES[key]
+
+
+def generate_key(algorithm):
+    """Generate a fresh private key for a KEY_ALGORITHMS name"""
+    return KEY_ALGORITHMS[algorithm][3]()
+
+
+def jarsigner_sigalg(private_key):
+    """jarsigner -sigalg matching the stored key type"""
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return "SHA256withECDSA"
+    if isinstance(private_key, dsa.DSAPrivateKey):
+        return "SHA256withDSA"
+    return "SHA256withRSA"
+
+
+def key_description(private_key):
+    """Short label like 'RSA-2048' or 'EC-P256' for a private key"""
+    if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return "EC-P256" if isinstance(private_key.curve, ec.SECP256R1) else f"EC-{private_key.curve.name}"
+    if isinstance(private_key, dsa.DSAPrivateKey):
+        return f"DSA-{private_key.key_size}"
+    return f"RSA-{private_key.key_size}"
+
+
+def create_self_signed(subject, validity_days, private_key=None):
+    """Create a key (RSA-2048 unless given) and a self-signed SHA-256 certificate"""
+    if private_key is None:
+        private_key = generate_key("RSA-2048")
+    now = datetime.now(timezone.utc)
+    public_key = private_key.public_key()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(subject)
+        .public_key(public_key)
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + timedelta(days=validity_days))
+        .add_extension(x509.SubjectKeyIdentifier.from_public_key(public_key), critical=False)
+        .sign(private_key, hashes.SHA256())
+    )
+    return private_key, cert
+
+
+def serialize_jks(alias, private_key, certs, store_pass, key_pass):
+    """Serialise a single-key JKS keystore (Sun KeyProtector + SHA1 integrity)"""
+    plain = private_key.private_bytes(
+        serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    key_password = key_pass.encode("utf-16-be")
+    salt = os.urandom(20)
+    stream = _jks_keystream(key_password, salt, len(plain))
+    check = hashlib.sha1(key_password + plain).digest()
+    encrypted = salt + bytes(a ^ b for a, b in zip(plain, stream)) + check
+    algorithm = _der_tlv(0x30, _der_encode_oid(JKS_KEY_PROTECTOR_OID) + b"\x05\x00")
+    protected = _der_tlv(0x30, algorithm + _der_tlv(0x04, encrypted))
+
+    alias_bytes = alias.lower().encode("utf-8")
+    out = bytearray(JKS_MAGIC + struct.pack(">II", JKS_VERSION, 1))
+    out += struct.pack(">IH", 1, len(alias_bytes)) + alias_bytes
+    out += struct.pack(">Q", int(time.time() * 1000))
+    out += struct.pack(">I", len(protected)) + protected
+    out += struct.pack(">I", len(certs))
+    for cert in certs:
+        der = cert.public_bytes(serialization.Encoding.DER)
+        out += struct.pack(">H", 5) + b"X.509" + struct.pack(">I", len(der)) + der
+    out += hashlib.sha1(store_pass.encode("utf-16-be") + JKS_INTEGRITY_SALT + bytes(out)).digest()
+    return bytes(out)
+
+
+def serialize_pkcs12(alias, private_key, certs, store_pass):
+    """Serialise a PKCS12 keystore with keytool's (JDK 12+) default PBES2/AES-256 settings"""
+    encryption = (
+        serialization.PrivateFormat.PKCS12.encryption_builder()
+        .kdf_rounds(PKCS12_KDF_ROUNDS)
+        .key_cert_algorithm(pkcs12.PBES.PBESv2SHA256AndAES256CBC)
+        .hmac_hash(hashes.SHA256())
+        .build(store_pass.encode("utf-8"))
+    )
+    return pkcs12.serialize_key_and_certificates(
+        alias.lower().encode("utf-8"), private_key, certs[0], certs[1:] or None, encryption
+    )
+
+
+def write_keystore_bundle(target_dir, alias, private_key, cert, store_pass, key_pass):
+    """Write android.jks, android.p12 and certificate.cer from the same key + cert"""
+    with metrics.stage("export"):
+        files = {
+            "android.jks": serialize_jks(alias, private_key, [cert], store_pass, key_pass),
+            "certificate.cer": cert.public_bytes(serialization.Encoding.PEM),
+        }
+    with metrics.stage("pkcs12"):
+        files["android.p12"] = serialize_pkcs12(alias, private_key, [cert], store_pass)
+    for name, data in files.items():
+        with open(os.path.join(target_dir, name), "wb") as f:
+            f.write(data)
+
+
+class KeyPool:
+    """Background pool of ready-made key pairs, refilled on a worker thread"""
+
+    def __init__(self, size, spill_path=None, passphrase=None, algorithm="RSA-2048"):
+        self.size = max(0, size)
+        # Algorithm file name mein - KEY_ALGORITHM badalne pe purani keys doosre pool mein nahi aati
+        self.spill_path = f"{spill_path}.{algorithm}" if spill_path else None
+        self.passphrase = passphrase
+        self.algorithm = algorithm
+        self.factory = KEY_ALGORITHMS[algorithm][3]
+        self.hits = 0
+        self.misses = 0
+        self.refilled = 0
+        self.refill_seconds = 0.0
+        self.last_refill_seconds = 0.0
+        self._keys = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        """Load spilled keys (if any) and start the refill thread"""
+        if self.size == 0 or self._thread is not None:
+            return
+        self._load_spill()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._refill_loop, name="key-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop refilling and spill the remaining keys to disk if configured"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._save_spill()
+
+    def get(self):
+        """Pop a ready key (hit) or generate one inline (miss)"""
+        with self._lock:
+            key = self._keys.popleft() if self._keys else None
+            if key is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self._wakeup.set()
+        return key if key is not None else self.factory()
+
+    def stats(self):
+        with self._lock:
+            available = len(self._keys)
+        return {
+            "size": self.size,
+            "available": available,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refilled": self.refilled,
+            "refill_avg_ms": self.refill_seconds / self.refilled * 1000 if self.refilled else 0.0,
+            "last_refill_ms": self.last_refill_seconds * 1000,
+        }
+
+    def _refill_loop(self):
+        while not self._stopping:
+            with self._lock:
+                missing = self.size - len(self._keys)
+            if missing <= 0:
+                # Pool bhara hua hai - agle get() tak so jao
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            start = time.perf_counter()
+            key = self.factory()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._keys.append(key)
+                self.refilled += 1
+                self.refill_seconds += elapsed
+                self.last_refill_seconds = elapsed
+
+    def _load_spill(self):
+        if not self.spill_path or not self.passphrase or not os.path.exists(self.spill_path):
+            return
+        try:
+            with open(self.spill_path, "rb") as f:
+                data = f.read()
+            # Ek key do baar use na ho, isliye load karte hi file hata do
+            os.remove(self.spill_path)
+            dropped = 0
+            for block in data.split(b"-----END ENCRYPTED PRIVATE KEY-----")[:-1]:
+                pem = block.strip() + b"\n-----END ENCRYPTED PRIVATE KEY-----\n"
+                key = serialization.load_pem_private_key(pem, self.passphrase.encode("utf-8"))
+                if self._matches(key):
+                    self._keys.append(key)
+                else:
+                    dropped += 1
+            logger.info(f"Key pool: loaded {len(self._keys)} keys from {self.spill_path}")
+            if dropped:
+                logger.warning(f"Key pool: dropped {dropped} spilled keys that are not {self.algorithm}")
+        except Exception as e:
+            logger.error(f"Key pool: could not load spill file: {e}")
+
+    def _matches(self, key):
+        """True if key has the pool's algorithm type and size"""
+        kind, size = KEY_ALGORITHMS[self.algorithm][:2]
+        if kind == "RSA":
+            return isinstance(key, rsa.RSAPrivateKey) and key.key_size == size
+        return isinstance(key, ec.EllipticCurvePrivateKey) and key.curve.key_size == size
+
+    def _save_spill(self):
+        if not self.spill_path:
+            return
+        if not self.passphrase:
+            logger.warning("Key pool: KEY_POOL_PASSPHRASE not set, not spilling keys to disk")
+            return
+        with self._lock:
+            keys = list(self._keys)
+            self._keys.clear()
+        if not keys:
+            return
+        encryption = serialization.BestAvailableEncryption(self.passphrase.encode("utf-8"))
+        data = b"".join(
+            k.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, encryption)
+            for k in keys
+        )
+        tmp_path = f"{self.spill_path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.spill_path)
+        logger.info(f"Key pool: spilled {len(keys)} keys to {self.spill_path}")
+
+
+# APK v1 (JAR) signing - jarsigner ki jagah in-process
+MANIFEST_NAME = "META-INF/MANIFEST.MF"
+SIGNATURE_FILE_RE = re.compile(r"^META-INF/([^/]+\.(SF|RSA|DSA|EC)|SIG-[^/]+)$", re.IGNORECASE)
+DIGEST_CHUNK = 1024 * 1024
+CREATED_BY = "1.0 (APK Signing Bot)"
+
+
+def is_signature_entry(name):
+    """True for v1 signature files that must not be digested or kept on re-sign"""
+    return name.upper() == MANIFEST_NAME or bool(SIGNATURE_FILE_RE.match(name))
+
+
+def signature_base_name(alias):
+    """jarsigner-style .SF/.RSA base name: first 8 chars of alias, upper-cased"""
+    name = re.sub(r"[^A-Z0-9_-]", "_", alias.upper())[:8]
+    return name or "CERT"
+
+
+def _manifest_line(key, value):
+    """Encode one manifest attribute, wrapped at 72 bytes per JAR spec"""
+    line = f"{key}: {value}".encode("utf-8")
+    out = [line[:72]]
+    for i in range(72, len(line), 71):
+        out.append(b" " + line[i:i + 71])
+    return b"\r\n".join(out) + b"\r\n"
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+# Per-entry manifest attributes jo incremental re-sign ke liye CRC32/size yaad rakhte hain
+ENTRY_CRC_ATTR = "X-Entry-CRC32"
+ENTRY_SIZE_ATTR = "X-Entry-Size"
+
+
+def _manifest_lines(data):
+    """Logical MANIFEST.MF / .SF lines as bytes (b"" = section break)
+
+    72-byte wrap multi-byte UTF-8 character ko beech se kaat sakta hai - isliye
+    continuation lines bytes mein hi jodte hain, decode poori line ka hota hai.
+    """
+    line = None
+    for raw in data.split(b"\n"):
+        raw = raw.rstrip(b"\r")
+        if raw.startswith(b" ") and line:
+            line += raw[1:]
+            continue
+        if line is not None:
+            yield line
+        line = raw
+    if line is not None:
+        yield line
+
+
+def parse_manifest(data):
+    """Parse MANIFEST.MF into {entry name: {attribute: value}} (main section skipped)"""
+    entries = {}
+    current = {}
+    for line in _manifest_lines(data):
+        if not line:
+            if "Name" in current:
+                entries[current.pop("Name")] = current
+            current = {}
+            continue
+        key, _, value = line.decode("utf-8").partition(": ")
+        current[key] = value
+    if "Name" in current:
+        entries[current.pop("Name")] = current
+    return entries
+
+
+class NativeSigner:
+    """In-process APK signer (v1 JAR signature) built on hashlib + cryptography"""
+
+    def __init__(self, private_key, certs, alias):
+        self.private_key = private_key
+        self.certs = certs
+        self.alias = alias
+        self.base_name = signature_base_name(alias)
+        self.fingerprint = certs[0].fingerprint(hashes.SHA256()).hex()
+
+    @classmethod
+    def from_keystore(cls, path, alias, store_pass, key_pass=None):
+        private_key, certs = load_signing_key(path, alias, store_pass, key_pass)
+        return cls(private_key, certs, alias)
+
+    @classmethod
+    def _from_der(cls, key_der, cert_ders, alias):
+        private_key = serialization.load_der_private_key(key_der, password=None)
+        return cls(private_key, [x509.load_der_x509_certificate(c) for c in cert_ders], alias)
+
+    def __reduce__(self):
+        # Batch process pool ke workers ko already-decrypted key bhejne ke liye (sirf pipe pe, disk pe nahi)
+        key_der = self.private_key.private_bytes(
+            serialization.Encoding.DER, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+        cert_ders = [c.public_bytes(serialization.Encoding.DER) for c in self.certs]
+        return NativeSigner._from_der, (key_der, cert_ders, self.alias)
+
+    @property
+    def block_extension(self):
+        if isinstance(self.private_key, rsa.RSAPrivateKey):
+            return "RSA"
+        if isinstance(self.private_key, ec.EllipticCurvePrivateKey):
+            return "EC"
+        if isinstance(self.private_key, dsa.DSAPrivateKey):
+            return "DSA"
+        raise KeystoreError("Unsupported key type for APK signing")
+
+    def digest_entries(self, zf, previous=None, known=None):
+        """Stream every signable entry through SHA-256, return ([(name, digest, crc, size)], reused names, streamed)
+
+        previous = signed_manifest_sections() of the APK (verified old manifest); entries
+        whose CRC32 + size still match what was recorded there keep their old digest.
+        known = {name: (digest, crc, size)} from StreamingEntryDigester (upload ke waqt hi nikale gaye).
+        """
+        digests = []
+        seen = set()
+        reused = set()
+        streamed = 0
+        for info in zf.infolist():
+            if info.is_dir() or is_signature_entry(info.filename):
+                continue
+            if info.filename in seen:
+                raise ValueError(f"Duplicate ZIP entry: {info.filename}")
+            seen.add(info.filename)
+
+            old = (previous or {}).get(info.filename)
+            if (old and "SHA-256-Digest" in old
+                    and old.get(ENTRY_CRC_ATTR) == f"{info.CRC:08x}"
+                    and old.get(ENTRY_SIZE_ATTR) == str(info.file_size)):
+                digests.append((info.filename, base64.b64decode(old["SHA-256-Digest"]), info.CRC, info.file_size))
+                reused.add(info.filename)
+                continue
+
+            hit = (known or {}).get(info.filename)
+            if hit and hit[1] == info.CRC and hit[2] == info.file_size:
+                digests.append((info.filename, hit[0], info.CRC, info.file_size))
+                streamed += 1
+                continue
+
+            sha = hashlib.sha256()
+            with zf.open(info) as entry:
+                while True:
+                    chunk = entry.read(DIGEST_CHUNK)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+            digests.append((info.filename, sha.digest(), info.CRC, info.file_size))
+        return digests, reused, streamed
+
+    def build_manifest(self, digests):
+        """Return (manifest_bytes, [(name, section_bytes)])"""
+        main = b"Manifest-Version: 1.0\r\n" + _manifest_line("Created-By", CREATED_BY) + b"\r\n"
+        sections = []
+        for name, digest, crc, size in digests:
+            section = (
+                _manifest_line("Name", name)
+                + _manifest_line("SHA-256-Digest", _b64(digest))
+                + _manifest_line(ENTRY_CRC_ATTR, f"{crc:08x}")
+                + _manifest_line(ENTRY_SIZE_ATTR, str(size))
+                + b"\r\n"
+            )
+            sections.append((name, section))
+        return main + b"".join(s for _, s in sections), sections
+
+    def build_signature_file(self, manifest, sections, extra_attributes=()):
+        """Build the .SF file that signs the manifest and each of its sections"""
+        out = [
+            b"Signature-Version: 1.0\r\n",
+            _manifest_line("Created-By", CREATED_BY),
+            _manifest_line("SHA-256-Digest-Manifest", _b64(hashlib.sha256(manifest).digest())),
+        ]
+        out.extend(_manifest_line(k, v) for k, v in extra_attributes)
+        out.append(b"\r\n")
+        for name, section in sections:
+            out.append(_manifest_line("Name", name))
+            out.append(_manifest_line("SHA-256-Digest", _b64(hashlib.sha256(section).digest())))
+            out.append(b"\r\n")
+        return b"".join(out)
+
+    def build_signature_block(self, signature_file):
+        """Detached PKCS#7 SignedData over the .SF bytes (no signed attributes)"""
+        builder = pkcs7.PKCS7SignatureBuilder().set_data(signature_file)
+        builder = builder.add_signer(self.certs[0], self.private_key, hashes.SHA256())
+        for cert in self.certs[1:]:
+            builder = builder.add_certificate(cert)
+        return builder.sign(serialization.Encoding.DER, [
+            pkcs7.PKCS7Options.DetachedSignature,
+            pkcs7.PKCS7Options.NoAttributes,
+            pkcs7.PKCS7Options.Binary,
+        ])
+
+    def sign_v1(self, in_path, out_path, block_schemes=(), incremental=True, align=ZIP_ALIGN, known=None):
+        """Write in_path to out_path with a v1 signature, return stats dict"""
+        with zipfile.ZipFile(in_path) as zf:
+            previous = None
+            if incremental:
+                # Sirf verified purane signature ke digests - foreign / broken / tampered manifest pe full pass
+                previous = signed_manifest_sections(zf)
+            with metrics.stage("digest", sum(i.file_size for i in zf.infolist())):
+                digests, reused, streamed = self.digest_entries(zf, previous, known)
+            has_old_signature = any(is_signature_entry(i.filename) for i in zf.infolist())
+        has_old_signature = has_old_signature or has_signing_block(in_path)
+
+        # v2/v3 bhi lag raha ho to .SF mein batao (stripping protection)
+        extra = []
+        if block_schemes:
+            extra.append(("X-Android-APK-Signed", ", ".join(s[1:] for s in block_schemes)))
+
+        with metrics.stage("sign"):
+            manifest, sections = self.build_manifest(digests)
+            signature_file = self.build_signature_file(manifest, sections, extra)
+            signature_block = self.build_signature_block(signature_file)
+
+        # Is sign mein nikale digests (streamed / hashed) verify_apk() ke liye - sign ke turant baad
+        # dobara hash na karna pade. Purane manifest se liye digests nahi: verifier unhe khud check kare
+        stats = {"entries": len(digests), "reused": len(reused), "streamed": streamed,
+                 "digests": {name: (digest, crc, size) for name, digest, crc, size in digests if name not in reused}}
+        if has_old_signature or align:
+            # Ek hi streaming pass: purane signature files hatao + stored entries align karo
+            with metrics.stage("strip", os.path.getsize(in_path)):
+                stats.update(rewrite_apk(in_path, out_path, align))
+        elif os.path.abspath(in_path) != os.path.abspath(out_path):
+            shutil.copyfile(in_path, out_path)
+
+        with zipfile.ZipFile(out_path, "a", compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(MANIFEST_NAME, manifest)
+            zf.writestr(f"META-INF/{self.base_name}.SF", signature_file)
+            zf.writestr(f"META-INF/{self.base_name}.{self.block_extension}", signature_block)
+
+        return stats
+
+    @property
+    def signature_algorithm_id(self):
+        """APK Signature Scheme v2/v3 algorithm ID for this key (SHA-256 variants)"""
+        if isinstance(self.private_key, rsa.RSAPrivateKey):
+            return SIG_RSA_PKCS1_SHA256
+        if isinstance(self.private_key, ec.EllipticCurvePrivateKey):
+            return SIG_ECDSA_SHA256
+        if isinstance(self.private_key, dsa.DSAPrivateKey):
+            return SIG_DSA_SHA256
+        raise KeystoreError("Unsupported key type for APK signing")
+
+    def raw_sign(self, data):
+        """Sign bytes with the private key using the SHA-256 scheme for its type"""
+        if isinstance(self.private_key, rsa.RSAPrivateKey):
+            return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+        if isinstance(self.private_key, ec.EllipticCurvePrivateKey):
+            return self.private_key.sign(data, ec.ECDSA(hashes.SHA256()))
+        return self.private_key.sign(data, hashes.SHA256())
+
+    def build_block_signer(self, scheme, digest, block_schemes):
+        """Encode one v2 or v3 signer record over the APK content digest"""
+        algorithm = self.signature_algorithm_id
+        digests = _lp(_lp(struct.pack("<I", algorithm) + _lp(digest)))
+        certs = _lp(b"".join(_lp(c.public_bytes(serialization.Encoding.DER)) for c in self.certs))
+        public_key = self.certs[0].public_key().public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+
+        attributes = b""
+        if scheme == "v2" and "v3" in block_schemes:
+            # v3 ko hata ke v2 pe downgrade rokne ke liye
+            attributes = _lp(struct.pack("<II", STRIPPING_PROTECTION_ATTR_ID, 3))
+
+        sdk_range = struct.pack("<II", V3_MIN_SDK, ANDROID_MAX_SDK)
+        if scheme == "v3":
+            signed_data = digests + certs + sdk_range + _lp(attributes)
+        else:
+            signed_data = digests + certs + _lp(attributes)
+
+        signatures = _lp(_lp(struct.pack("<I", algorithm) + _lp(self.raw_sign(signed_data))))
+        if scheme == "v3":
+            signer = _lp(signed_data) + sdk_range + signatures + _lp(public_key)
+        else:
+            signer = _lp(signed_data) + signatures + _lp(public_key)
+        return _lp(_lp(signer))
+
+    def apply_signing_block(self, in_path, out_path, block_schemes, workers=None):
+        """Insert an APK Signing Block with v2/v3 signers, return digest stats"""
+        with open(in_path, "rb") as f, open(out_path, "wb", buffering=0) as out:
+            fd = f.fileno()
+            entries_end, cd_offset, cd_size, eocd_offset = find_zip_sections(fd)
+            eocd = bytearray(_pread_exact(fd, os.fstat(fd).st_size - eocd_offset, eocd_offset))
+            # Digest ke waqt EOCD ka CD offset signing block ki jagah point karta hai
+            struct.pack_into("<I", eocd, 16, entries_end)
+            sections = [(fd, 0, entries_end), (fd, cd_offset, cd_size), bytes(eocd)]
+            start = time.perf_counter()
+            digest, chunks = compute_apk_digest(sections, workers or DIGEST_WORKERS)
+            elapsed = time.perf_counter() - start
+            metrics.record("digest", elapsed, entries_end + cd_size + len(eocd))
+
+            with metrics.stage("sign"):
+                pairs = []
+                for scheme in block_schemes:
+                    block_id = APK_SIGNATURE_SCHEME_V2_BLOCK_ID if scheme == "v2" else APK_SIGNATURE_SCHEME_V3_BLOCK_ID
+                    pairs.append((block_id, self.build_block_signer(scheme, digest, block_schemes)))
+                block = build_signing_block(pairs)
+
+            struct.pack_into("<I", eocd, 16, entries_end + len(block))
+            _copy_range(fd, out, 0, entries_end)
+            out.write(block)
+            _copy_range(fd, out, cd_offset, cd_offset + cd_size)
+            out.write(eocd)
+        return {"chunks": chunks, "digest_seconds": elapsed, "bytes": entries_end + cd_size + len(eocd)}
+
+    def sign(self, in_path, out_path, schemes=("v1", "v2", "v3"), incremental=INCREMENTAL_V1, align=ZIP_ALIGN, known=None):
+        """Sign in_path into out_path with the requested schemes, return stats dict"""
+        schemes = parse_schemes(schemes)
+        block_schemes = [s for s in schemes if s != "v1"]
+        stats = {"schemes": schemes, "reused": 0, "streamed": 0}
+
+        if "v1" in schemes:
+            stats.update(self.sign_v1(in_path, out_path, block_schemes, incremental, align, known))
+        else:
+            with zipfile.ZipFile(in_path) as zf:
+                names = [i.filename for i in zf.infolist() if not i.is_dir()]
+            stats["entries"] = sum(1 for n in names if not is_signature_entry(n))
+            if stats["entries"] != len(names) or align:
+                with metrics.stage("strip", os.path.getsize(in_path)):
+                    stats.update(rewrite_apk(in_path, out_path, align))
+            else:
+                # Purana signing block apply_signing_block khud hata deta hai
+                shutil.copyfile(in_path, out_path)
+
+        if block_schemes:
+            tmp_path = f"{out_path}.tmp"
+            try:
+                stats.update(self.apply_signing_block(out_path, tmp_path, block_schemes))
+                os.replace(tmp_path, out_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        if align:
+            with metrics.stage("align_check"):
+                stats["misaligned"] = check_alignment(out_path)
+        stats["signer"] = self.certs[0].subject.rfc4514_string()
+        stats["fingerprint"] = self.fingerprint
+        return stats
+
+
+def parse_schemes(schemes):
+    """Normalise 'v1,v2,v3' (string or iterable) into an ordered tuple"""
+    if isinstance(schemes, str):
+        schemes = re.split(r"[\s,+]+", schemes.strip().lower())
+    result = []
+    for scheme in schemes:
+        if not scheme:
+            continue
+        scheme = scheme if scheme.startswith("v") else f"v{scheme}"
+        if scheme not in ("v1", "v2", "v3"):
+            raise ValueError(f"Unknown signature scheme: {scheme}")
+        if scheme not in result:
+            result.append(scheme)
+    if not result:
+        raise ValueError("No signature scheme selected")
+    return tuple(sorted(result))
+
+
+# APK Signature Scheme v2/v3 - APK Signing Block
+APK_SIG_BLOCK_MAGIC = b"APK Sig Block 42"
+APK_SIGNATURE_SCHEME_V2_BLOCK_ID = 0x7109871A
+APK_SIGNATURE_SCHEME_V3_BLOCK_ID = 0xF05368C0
+STRIPPING_PROTECTION_ATTR_ID = 0xBEEFF00D
+SIG_RSA_PKCS1_SHA256 = 0x0103
+SIG_ECDSA_SHA256 = 0x0201
+SIG_DSA_SHA256 = 0x0301
+V3_MIN_SDK = 28
+ANDROID_MAX_SDK = 0x7FFFFFFF
+EOCD_SIGNATURE = b"PK\x05\x06"
+EOCD_MIN_SIZE = 22
+
+
+def _lp(data):
+    """uint32 little-endian length prefix"""
+    return struct.pack("<I", len(data)) + data
+
+
+def _pread_exact(fd, length, offset):
+    """os.pread that fails loudly on a truncated file"""
+    data = os.pread(fd, length, offset)
+    if len(data) != length:
+        raise ValueError("Unexpected end of APK file")
+    return data
+
+
+def find_zip_sections(fd):
+    """Locate (entries_end, cd_offset, cd_size, eocd_offset); entries_end skips an old signing block
+
+    Sirf file ka tail aur CD ke just pehle ke bytes padhe jaate hain - poori file nahi.
+    """
+    size = os.fstat(fd).st_size
+    tail_len = min(size, EOCD_MIN_SIZE + 0xFFFF)
+    tail_start = size - tail_len
+    tail = _pread_exact(fd, tail_len, tail_start)
+
+    # EOCD record kam se kam EOCD_MIN_SIZE bytes ka hota hai
+    search_end = len(tail) - EOCD_MIN_SIZE + len(EOCD_SIGNATURE)
+    eocd_pos = tail.rfind(EOCD_SIGNATURE, 0, search_end)
+    while eocd_pos >= 0:
+        comment_len, = struct.unpack_from("<H", tail, eocd_pos + 20)
+        if eocd_pos + EOCD_MIN_SIZE + comment_len == len(tail):
+            break
+        eocd_pos = tail.rfind(EOCD_SIGNATURE, 0, eocd_pos)
+    if eocd_pos < 0:
+        raise ValueError("Not a ZIP/APK file (end of central directory not found)")
+    eocd_offset = tail_start + eocd_pos
+
+    cd_size, cd_offset = struct.unpack_from("<II", tail, eocd_pos + 12)
+    if cd_offset == 0xFFFFFFFF or cd_offset + cd_size > eocd_offset:
+        raise ValueError("ZIP64 or malformed APKs are not supported")
+
+    entries_end = cd_offset
+    if cd_offset >= 32:
+        footer = _pread_exact(fd, 24, cd_offset - 24)
+        if footer[8:] == APK_SIG_BLOCK_MAGIC:
+            block_size, = struct.unpack_from("<Q", footer, 0)
+            entries_end = cd_offset - block_size - 8
+    return entries_end, cd_offset, cd_size, eocd_offset
+
+
+def has_signing_block(path):
+    """True if the APK already carries an APK Signing Block (v2/v3/...)"""
+    with open(path, "rb") as f:
+        entries_end, cd_offset, _, _ = find_zip_sections(f.fileno())
+    return entries_end != cd_offset
+
+
+def build_signing_block(pairs):
+    """Serialise [(id, value)] into an APK Signing Block"""
+    body = b"".join(struct.pack("<QI", len(value) + 4, block_id) + value for block_id, value in pairs)
+    size = len(body) + 8 + len(APK_SIG_BLOCK_MAGIC)
+    return struct.pack("<Q", size) + body + struct.pack("<Q", size) + APK_SIG_BLOCK_MAGIC
+
+
+def _chunk_digest(chunk):
+    """Digest one 1 MiB chunk; chunk is bytes or (fd, offset, length) read with pread"""
+    if isinstance(chunk, tuple):
+        fd, offset, length = chunk
+        chunk = _pread_exact(fd, length, offset)
+    sha = hashlib.sha256(b"\xa5")
+    sha.update(struct.pack("<I", len(chunk)))
+    sha.update(chunk)
+    return sha.digest()
+
+
+def compute_apk_digest(sections, workers):
+    """v2/v3 content digest: 1 MiB chunk SHA-256s spread over a thread pool
+
+    sections = bytes ya (fd, offset, length). Har worker apna chunk khud pread
+    karta hai, isliye memory ~ workers x 1 MiB rehti hai, APK size se independent.
+    hashlib GIL chhod deta hai, isliye threads hi cores pe scale karte hain.
+    """
+    chunks = []
+    for section in sections:
+        if isinstance(section, tuple):
+            fd, offset, length = section
+            chunks.extend(
+                (fd, offset + i, min(DIGEST_CHUNK, length - i)) for i in range(0, length, DIGEST_CHUNK)
+            )
+        else:
+            chunks.extend(section[i:i + DIGEST_CHUNK] for i in range(0, len(section), DIGEST_CHUNK))
+    if workers > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="digest") as pool:
+            chunk_digests = list(pool.map(_chunk_digest, chunks))
+    else:
+        chunk_digests = [_chunk_digest(c) for c in chunks]
+    top = hashlib.sha256(b"\x5a" + struct.pack("<I", len(chunk_digests)))
+    for digest in chunk_digests:
+        top.update(digest)
+    return top.digest(), len(chunk_digests)
+
+
+# Raw ZIP records - entries ko inflate kiye bina copy karne ke liye
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_HEADER_SIGNATURE = b"PK\x01\x02"
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+LOCAL_HEADER_SIZE = 30
+CENTRAL_HEADER_SIZE = 46
+
+
+def iter_central_directory(data):
+    """Yield (name, header_bytes, fields) for every record in central directory bytes"""
+    pos = 0
+    end = len(data)
+    while pos < end:
+        if data[pos:pos + 4] != CENTRAL_HEADER_SIGNATURE:
+            raise ValueError("Corrupt central directory")
+        (flags, method, crc, compressed_size, size, name_len, extra_len,
+         comment_len) = struct.unpack_from("<HHxxxxIIIHHH", data, pos + 8)
+        local_offset, = struct.unpack_from("<I", data, pos + 42)
+        record_len = CENTRAL_HEADER_SIZE + name_len + extra_len + comment_len
+        raw_name = bytes(data[pos + CENTRAL_HEADER_SIZE:pos + CENTRAL_HEADER_SIZE + name_len])
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+        yield name, bytes(data[pos:pos + record_len]), {
+            "flags": flags,
+            "method": method,
+            "crc": crc,
+            "compressed_size": compressed_size,
+            "size": size,
+            "local_offset": local_offset,
+        }
+        pos += record_len
+
+
+def read_central_directory(fd):
+    """Return (central directory bytes, eocd_offset) for an open APK"""
+    _, cd_offset, cd_size, eocd_offset = find_zip_sections(fd)
+    return _pread_exact(fd, cd_size, cd_offset), eocd_offset
+
+
+def local_record_span(fd, fields):
+    """(start, data_start, end, local_header) of an entry's local record (+ data descriptor)"""
+    start = fields["local_offset"]
+    fixed = _pread_exact(fd, LOCAL_HEADER_SIZE, start)
+    if fixed[:4] != LOCAL_HEADER_SIGNATURE:
+        raise ValueError("Corrupt local file header")
+    name_len, extra_len = struct.unpack_from("<HH", fixed, 26)
+    local_header = fixed + _pread_exact(fd, name_len + extra_len, start + LOCAL_HEADER_SIZE)
+    data_start = start + len(local_header)
+    end = data_start + fields["compressed_size"]
+    if fields["flags"] & 0x08:
+        end += 16 if os.pread(fd, 4, end) == DATA_DESCRIPTOR_SIGNATURE else 12
+    return start, data_start, end, local_header
+
+
+# zipalign - stored entries 4 bytes pe, stored .so files page boundary pe
+ALIGNMENT_EXTRA_ID = 0xD935  # apksigner ka alignment extra field
+ALIGNMENT_EXTRA_MIN = 6
+
+
+def entry_alignment(name, method):
+    """Required data alignment for an entry (1 = none, compressed entries are never aligned)"""
+    if method != zipfile.ZIP_STORED:
+        return 1
+    return ZIP_ALIGN_SO if name.endswith(".so") else 4
+
+
+def _strip_alignment_extra(extra):
+    """Drop old alignment records / zipalign zero padding from a local extra field"""
+    records = bytearray()
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, size = struct.unpack_from("<HH", extra, pos)
+        if pos + 4 + size > len(extra):
+            break
+        if header_id not in (0, ALIGNMENT_EXTRA_ID):
+            records += extra[pos:pos + 4 + size]
+        pos += 4 + size
+    return bytes(records)
+
+
+def _aligned_extra(extra, offset, name_len, alignment):
+    """Local extra field padded so the entry data starts on an alignment boundary"""
+    extra = _strip_alignment_extra(extra)
+    data_start = offset + LOCAL_HEADER_SIZE + name_len + len(extra) + ALIGNMENT_EXTRA_MIN
+    padding = (alignment - data_start % alignment) % alignment
+    return extra + struct.pack("<HHH", ALIGNMENT_EXTRA_ID, 2 + padding, alignment) + b"\x00" * padding
+
+
+def rewrite_apk(in_path, out_path, align=True, strip=True):
+    """Copy an APK without its old META-INF signature files, optionally zipaligned
+
+    Baaki entries ke compressed bytes jaise ke taise copy hote hain (no recompression);
+    align=True ho to stored entries ka local extra field pad hota hai. Central
+    directory naye offsets ke saath dobara banti hai. strip=False signature files
+    bhi rakhta hai (v1 sirf entry contents sign karta hai, offsets nahi).
+    """
+    kept = removed = aligned = padding = 0
+    with open(in_path, "rb") as f, open(out_path, "wb", buffering=0) as out:
+        fd = f.fileno()
+        cd_bytes, eocd_offset = read_central_directory(fd)
+        central = bytearray()
+        for name, header, fields in iter_central_directory(cd_bytes):
+            if strip and is_signature_entry(name):
+                removed += 1
+                continue
+            start, data_start, end, local_header = local_record_span(fd, fields)
+            new_offset = out.tell()
+            alignment = entry_alignment(name, fields["method"]) if align else 1
+            if alignment > 1:
+                name_len, extra_len = struct.unpack_from("<HH", local_header, 26)
+                name_end = LOCAL_HEADER_SIZE + name_len
+                extra = _aligned_extra(local_header[name_end:], new_offset, name_len, alignment)
+                out.write(local_header[:26] + struct.pack("<HH", name_len, len(extra)) + local_header[LOCAL_HEADER_SIZE:name_end] + extra)
+                _copy_range(fd, out, data_start, end)
+                aligned += 1
+                padding += len(extra) - extra_len
+            else:
+                _copy_range(fd, out, start, end)
+            header = bytearray(header)
+            struct.pack_into("<I", header, 42, new_offset)
+            central += header
+            kept += 1
+
+        new_cd_offset = out.tell()
+        eocd = bytearray(_pread_exact(fd, os.fstat(fd).st_size - eocd_offset, eocd_offset))
+        struct.pack_into("<HHII", eocd, 8, kept, kept, len(central), new_cd_offset)
+        out.write(central)
+        out.write(eocd)
+    return {"kept": kept, "removed": removed, "aligned": aligned, "padding_bytes": padding}
+
+
+def check_alignment(path):
+    """Return [(name, data_offset, required_alignment)] for misaligned stored entries"""
+    misaligned = []
+    with open(path, "rb") as f:
+        fd = f.fileno()
+        cd_bytes, _ = read_central_directory(fd)
+        for name, _, fields in iter_central_directory(cd_bytes):
+            alignment = entry_alignment(name, fields["method"])
+            if alignment == 1 or name.endswith("/"):
+                continue
+            _, data_start, _, _ = local_record_span(fd, fields)
+            if data_start % alignment:
+                misaligned.append((name, data_start, alignment))
+    return misaligned
+
+
+def _copy_range(fd, out, start, end):
+    """Copy bytes [start, end) of fd to the unbuffered file out
+
+    Linux pe copy_file_range (kernel copy, userspace buffer nahi), warna
+    DIGEST_CHUNK size ke pread buffers.
+    """
+    pos = start
+    if hasattr(os, "copy_file_range"):
+        try:
+            while pos < end:
+                copied = os.copy_file_range(fd, out.fileno(), end - pos, pos)
+                if copied == 0:
+                    break
+                pos += copied
+        except OSError:
+            pass
+    while pos < end:
+        chunk = _pread_exact(fd, min(DIGEST_CHUNK, end - pos), pos)
+        out.write(chunk)
+        pos += len(chunk)
+
+
+# In-process signature verification - jarsigner -verify (naya JVM + poora re-hash) ki jagah
+class VerificationError(Exception):
+    """Raised when a signed APK does not verify"""
+
+
+# JAR manifest "<name>-Digest" attributes -> hashlib name
+JAR_DIGESTS = {"SHA-256": "sha256", "SHA-384": "sha384", "SHA-512": "sha512", "SHA1": "sha1", "SHA-1": "sha1"}
+CMS_DIGEST_OIDS = {
+    "2.16.840.1.101.3.4.2.1": hashes.SHA256,
+    "2.16.840.1.101.3.4.2.2": hashes.SHA384,
+    "2.16.840.1.101.3.4.2.3": hashes.SHA512,
+    "1.3.14.3.2.26": hashes.SHA1,
+}
+CMS_MESSAGE_DIGEST_OID = "1.2.840.113549.1.9.4"
+# v2/v3 algorithm IDs jinke content digest SHA-256 chunked hote hain (wahi jo hum sign karte hain)
+BLOCK_SHA256_ALGORITHMS = (SIG_RSA_PKCS1_SHA256, SIG_ECDSA_SHA256, SIG_DSA_SHA256)
+
+
+def _main_attributes(data):
+    """Main section of a MANIFEST.MF / .SF as {attribute: value}"""
+    attributes = {}
+    for line in _manifest_lines(data):
+        if not line:
+            break
+        key, _, value = line.decode("utf-8").partition(": ")
+        attributes[key] = value
+    return attributes
+
+
+def _raw_manifest_sections(data):
+    """Split MANIFEST.MF into (main section bytes, {entry name: section bytes})"""
+    sections, current = [], []
+    for line in data.splitlines(keepends=True):
+        current.append(line)
+        if not line.strip(b"\r\n"):
+            sections.append(b"".join(current))
+            current = []
+    if current:
+        sections.append(b"".join(current))
+    main, named = sections[0] if sections else b"", {}
+    for section in sections[1:]:
+        name = _main_attributes(section).get("Name")
+        if name is not None:
+            named[name] = section
+    return main, named
+
+
+def _jar_digest(attributes, suffix="-Digest"):
+    """(hashlib name, expected digest bytes) from the first supported <alg><suffix> attribute"""
+    for name, algorithm in JAR_DIGESTS.items():
+        value = attributes.get(f"{name}{suffix}")
+        if value is not None:
+            return algorithm, base64.b64decode(value)
+    return None, None
+
+
+def _verify_raw(public_key, signature, data, algorithm):
+    """Check signature over data with public_key (RSA PKCS#1 v1.5 / ECDSA / DSA)"""
+    try:
+        if isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(signature, data, padding.PKCS1v15(), algorithm)
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            public_key.verify(signature, data, ec.ECDSA(algorithm))
+        elif isinstance(public_key, dsa.DSAPublicKey):
+            public_key.verify(signature, data, algorithm)
+        else:
+            raise VerificationError("Unsupported signer key type")
+    except InvalidSignature:
+        raise VerificationError("Signature does not match the signer certificate")
+
+
+def verify_signature_block(block, signature_file):
+    """Verify a detached PKCS#7 .RSA/.EC/.DSA block over the .SF bytes, return the signer cert"""
+    try:
+        certs = pkcs7.load_der_pkcs7_certificates(block)
+        # ContentInfo { contentType, [0] SignedData { ..., signerInfos SET } }
+        _, content_info, _ = _der_read(block, 0)
+        _, _, pos = _der_read(content_info, 0)
+        _, explicit, _ = _der_read(content_info, pos)
+        _, signed_data, _ = _der_read(explicit, 0)
+        pos = 0
+        while pos < len(signed_data):
+            _, signer_infos, pos = _der_read(signed_data, pos)
+        _, signer_info, _ = _der_read(signer_infos, 0)
+
+        # SignerInfo { version, issuerAndSerial, digestAlg, [0] signedAttrs?, sigAlg, signature }
+        _, _, pos = _der_read(signer_info, 0)
+        _, sid, pos = _der_read(signer_info, pos)
+        _, digest_algorithm, pos = _der_read(signer_info, pos)
+        attrs_start = pos
+        tag, signed_attrs, pos = _der_read(signer_info, pos)
+        if tag != 0xA0:
+            signed_attrs, pos = None, attrs_start
+        else:
+            signed_attrs_der = b"\x31" + signer_info[attrs_start + 1:pos]
+        _, _, pos = _der_read(signer_info, pos)
+        _, signature, _ = _der_read(signer_info, pos)
+
+        _, _, serial_pos = _der_read(sid, 0)
+        _, serial, _ = _der_read(sid, serial_pos)
+        _, oid, _ = _der_read(digest_algorithm, 0)
+    except (IndexError, ValueError) as e:
+        raise VerificationError(f"Malformed signature block: {e}")
+
+    serial = int.from_bytes(serial, "big", signed=True)
+    cert = next((c for c in certs if c.serial_number == serial), None)
+    if cert is None:
+        raise VerificationError("Signer certificate missing from signature block")
+    algorithm = CMS_DIGEST_OIDS.get(_der_oid(oid))
+    if algorithm is None:
+        raise VerificationError(f"Unsupported digest algorithm {_der_oid(oid)}")
+
+    signed = signature_file
+    if signed_attrs is not None:
+        # jarsigner signed attributes daalta hai - messageDigest .SF ka hash hona chahiye
+        message_digest = None
+        pos = 0
+        while pos < len(signed_attrs):
+            _, attribute, pos = _der_read(signed_attrs, pos)
+            _, attr_oid, value_pos = _der_read(attribute, 0)
+            if _der_oid(attr_oid) == CMS_MESSAGE_DIGEST_OID:
+                _, values, _ = _der_read(attribute, value_pos)
+                _, message_digest, _ = _der_read(values, 0)
+        digest = hashes.Hash(algorithm())
+        digest.update(signature_file)
+        if message_digest != digest.finalize():
+            raise VerificationError("Signature file digest does not match the signature block")
+        signed = signed_attrs_der
+    _verify_raw(cert.public_key(), signature, signed, algorithm())
+    return cert
+
+
+def _verify_signature_file(signature_file, manifest):
+    """Check the .SF digests against MANIFEST.MF, return (main attributes, covered names or None = all)"""
+    main = _main_attributes(signature_file)
+    algorithm, expected = _jar_digest(main, "-Digest-Manifest")
+    if algorithm and hashlib.new(algorithm, manifest).digest() == expected:
+        return main, None
+    # Whole-manifest digest nahi mila - har section ka digest check karo (JAR spec fallback)
+    manifest_main, sections = _raw_manifest_sections(manifest)
+    algorithm, expected = _jar_digest(main, "-Digest-Manifest-Main-Attributes")
+    if algorithm and hashlib.new(algorithm, manifest_main).digest() != expected:
+        raise VerificationError("Manifest main attributes were modified")
+    covered = parse_manifest(signature_file)
+    for name, attributes in covered.items():
+        algorithm, expected = _jar_digest(attributes)
+        section = sections.get(name)
+        if section is None or not algorithm or hashlib.new(algorithm, section).digest() != expected:
+            raise VerificationError(f"Manifest section does not match signature file: {name}")
+    return main, set(covered)
+
+
+def _verify_v1_signatures(zf):
+    """Verify the v1 .SF/.RSA chain up to MANIFEST.MF (entry digests not checked)
+
+    Return (signer cert, .SF main attributes, manifest bytes, [covered name sets]) or None if unsigned.
+    """
+    infos = {i.filename.upper(): i for i in zf.infolist()}
+    blocks = sorted(
+        name for name in infos
+        if SIGNATURE_FILE_RE.match(name) and name.rsplit(".", 1)[-1] in ("RSA", "DSA", "EC")
+    )
+    if not blocks:
+        return None
+    if MANIFEST_NAME not in infos:
+        raise VerificationError("MANIFEST.MF missing")
+    manifest = zf.read(infos[MANIFEST_NAME])
+
+    cert = sf_main = None
+    coverage = []
+    for block_name in blocks:
+        sf_info = infos.get(block_name.rsplit(".", 1)[0] + ".SF")
+        if sf_info is None:
+            raise VerificationError(f"Signature file missing for {block_name}")
+        signature_file = zf.read(sf_info)
+        signer_cert = verify_signature_block(zf.read(infos[block_name]), signature_file)
+        main, covered = _verify_signature_file(signature_file, manifest)
+        if covered is not None:
+            coverage.append(covered)
+        if cert is None:
+            cert, sf_main = signer_cert, main
+    return cert, sf_main, manifest, coverage
+
+
+def signed_manifest_sections(zf):
+    """parse_manifest() of the APK's old MANIFEST.MF, limited to sections its v1 signature covers
+
+    None jab APK unsigned ho ya purana signature verify na ho - tab koi old digest
+    reuse nahi hota (warna koi bhi manifest mein galat digest daal ke sign karwa le).
+    """
+    try:
+        signed = _verify_v1_signatures(zf)
+        if signed is None:
+            return None
+        _, _, manifest, coverage = signed
+        sections = parse_manifest(manifest)
+    except (VerificationError, ValueError):
+        return None
+    return {name: attributes for name, attributes in sections.items() if all(name in c for c in coverage)}
+
+
+def _verify_v1(zf, known):
+    """Verify the v1 JAR signature, return (signer cert, entries, reused, .SF main attributes) or None"""
+    signed = _verify_v1_signatures(zf)
+    if signed is None:
+        return None
+    cert, sf_main, manifest, coverage = signed
+
+    # Har entry manifest mein + digest match (signing ke waqt ke digests CRC/size match pe reuse)
+    sections = parse_manifest(manifest)
+    entries = reused = 0
+    for info in zf.infolist():
+        if info.is_dir() or is_signature_entry(info.filename):
+            continue
+        algorithm, expected = _jar_digest(sections.get(info.filename, {}))
+        if algorithm is None or any(info.filename not in covered for covered in coverage):
+            raise VerificationError(f"Unsigned entry: {info.filename}")
+        hit = (known or {}).get(info.filename) if algorithm == "sha256" else None
+        if hit and hit[1] == info.CRC and hit[2] == info.file_size:
+            digest = hit[0]
+            reused += 1
+        else:
+            sha = hashlib.new(algorithm)
+            try:
+                with zf.open(info) as entry:
+                    while True:
+                        chunk = entry.read(DIGEST_CHUNK)
+                        if not chunk:
+                            break
+                        sha.update(chunk)
+            except (zipfile.BadZipFile, zlib.error) as e:
+                raise VerificationError(f"Corrupt entry {info.filename}: {e}")
+            digest = sha.digest()
+        if digest != expected:
+            raise VerificationError(f"Digest mismatch: {info.filename}")
+        entries += 1
+    return cert, entries, reused, sf_main
+
+
+def _lp_read(data, pos):
+    """Read one uint32-length-prefixed item at pos, return (item, next_pos)"""
+    length, = struct.unpack_from("<I", data, pos)
+    end = pos + 4 + length
+    if end > len(data):
+        raise ValueError("Truncated length-prefixed item")
+    return data[pos + 4:end], end
+
+
+def _lp_items(data):
+    """Split a sequence of uint32-length-prefixed items"""
+    pos = 0
+    while pos < len(data):
+        item, pos = _lp_read(data, pos)
+        yield item
+
+
+def _pick_sha256(records):
+    """Value of the first (algorithm id, lp(value)) record using a supported SHA-256 algorithm"""
+    for record in records:
+        algorithm, = struct.unpack_from("<I", record, 0)
+        if algorithm in BLOCK_SHA256_ALGORITHMS:
+            return _lp_read(record, 4)[0]
+    return None
+
+
+def _verify_block_signer(scheme, signer, content_digest):
+    """Verify one v2/v3 signer record, return (signer cert, additional attributes bytes)"""
+    signed_data, pos = _lp_read(signer, 0)
+    if scheme == "v3":
+        pos += 8  # min/max SDK
+    signatures, pos = _lp_read(signer, pos)
+    public_key, _ = _lp_read(signer, pos)
+
+    digests, pos = _lp_read(signed_data, 0)
+    certs, pos = _lp_read(signed_data, pos)
+    if scheme == "v3":
+        pos += 8
+    attributes, _ = _lp_read(signed_data, pos)
+
+    cert_ders = list(_lp_items(certs))
+    if not cert_ders:
+        raise VerificationError(f"{scheme} signer has no certificate")
+    cert = x509.load_der_x509_certificate(cert_ders[0])
+    key_der = cert.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    if key_der != public_key:
+        raise VerificationError(f"{scheme} public key does not match its certificate")
+
+    signature = _pick_sha256(_lp_items(signatures))
+    if signature is None:
+        raise VerificationError(f"{scheme} signer uses an unsupported signature algorithm")
+    _verify_raw(serialization.load_der_public_key(public_key), signature, signed_data, hashes.SHA256())
+    if _pick_sha256(_lp_items(digests)) != content_digest():
+        raise VerificationError(f"{scheme} content digest mismatch (APK modified after signing)")
+    return cert, attributes
+
+
+def verify_apk(path, known=None, workers=None):
+    """Verify v1/v2/v3 signatures in-process, return {schemes, signer, fingerprint, entries, reused}
+
+    known = {name: (digest, crc, size)} - signing ke waqt nikale v1 digests; jin entries
+    ka CRC/size match kare unhe dobara inflate + hash nahi karte. v2/v3 ka content
+    digest ek hi baar (parallel pread) nikalta hai aur dono schemes check karta hai.
+    """
+    signers = {}
+    try:
+        with open(path, "rb") as f:
+            fd = f.fileno()
+            entries_end, cd_offset, cd_size, eocd_offset = find_zip_sections(fd)
+            block = _pread_exact(fd, cd_offset - entries_end, entries_end)
+            eocd = bytearray(_pread_exact(fd, os.fstat(fd).st_size - eocd_offset, eocd_offset))
+            struct.pack_into("<I", eocd, 16, entries_end)
+            digest_cache = []
+
+            def content_digest():
+                if not digest_cache:
+                    sections = [(fd, 0, entries_end), (fd, cd_offset, cd_size), bytes(eocd)]
+                    digest_cache.append(compute_apk_digest(sections, workers or DIGEST_WORKERS)[0])
+                return digest_cache[0]
+
+            # Signing block = size(8) + [len(8) id(4) value]* + size(8) + magic(16)
+            pairs = {}
+            pos = 8
+            while pos < len(block) - 24:
+                length, block_id = struct.unpack_from("<QI", block, pos)
+                pairs[block_id] = block[pos + 12:pos + 8 + length]
+                pos += 8 + length
+
+            v2_attributes = b""
+            for scheme, block_id in (("v2", APK_SIGNATURE_SCHEME_V2_BLOCK_ID), ("v3", APK_SIGNATURE_SCHEME_V3_BLOCK_ID)):
+                if block_id not in pairs:
+                    continue
+                records = list(_lp_items(_lp_read(pairs[block_id], 0)[0]))
+                if not records:
+                    raise VerificationError(f"{scheme} block has no signers")
+                results = [_verify_block_signer(scheme, record, content_digest) for record in records]
+                signers[scheme] = results[0][0]
+                if scheme == "v2":
+                    v2_attributes = results[0][1]
+
+        with zipfile.ZipFile(path) as zf:
+            v1 = _verify_v1(zf, known)
+            if v1:
+                signers["v1"], entries, reused, sf_main = v1
+            else:
+                entries = sum(1 for i in zf.infolist() if not i.is_dir() and not is_signature_entry(i.filename))
+                reused, sf_main = 0, {}
+
+        # Stripping protection: v1 .SF / v2 attribute batate hain ki naye schemes bhi the
+        claimed = {f"v{v}" for v in re.findall(r"\d+", sf_main.get("X-Android-APK-Signed", ""))}
+        for attribute in _lp_items(v2_attributes):
+            attr_id, = struct.unpack_from("<I", attribute, 0)
+            if attr_id == STRIPPING_PROTECTION_ATTR_ID:
+                claimed.add(f"v{struct.unpack_from('<I', attribute, 4)[0]}")
+    except (ValueError, IndexError, struct.error, zipfile.BadZipFile) as e:
+        raise VerificationError(f"Malformed APK signature: {e}")
+
+    stripped = sorted(s for s in claimed & {"v2", "v3"} if s not in signers)
+    if stripped:
+        raise VerificationError(f"{', '.join(stripped)} signature was stripped")
+    if not signers:
+        raise VerificationError("APK is not signed")
+    if "v1" in signers and "v2" in signers and signers["v1"] != signers["v2"]:
+        raise VerificationError("v1 and v2 signers differ")
+
+    schemes = tuple(s for s in ("v1", "v2", "v3") if s in signers)
+    # Android naye scheme ka signer maanta hai (v3 mein key rotation ho sakta hai)
+    cert = signers[schemes[-1]]
+    return {
+        "schemes": schemes,
+        "signer": cert.subject.rfc4514_string(),
+        "fingerprint": cert.fingerprint(hashes.SHA256()).hex(),
+        "entries": entries,
+        "reused": reused,
+    }
+
+
+def verification_summary(result):
+    """Short reply line for a verify_apk() result"""
+    return f"Verified: {', '.join(result['schemes'])} ({result['entries']} entries)"
+
+
+
+def sha256_file(path):
+    """SHA-256 hex digest of a file, read in fixed-size chunks"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(DIGEST_CHUNK)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class HashingWriter:
+    """File-like wrapper that SHA-256 hashes bytes while they are written"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
+
+
+class StreamingEntryDigester:
+    """File-like wrapper that digests APK entries while the upload is still being written
+
+    Local headers ko order mein parse karke har entry ka uncompressed SHA-256 +
+    CRC32 nikalta hai (deflate stream-inflate hota hai, bounded buffers). Result
+    NativeSigner.digest_entries(known=...) use karta hai, taaki v1 ke liye APK
+    dobara inflate na karna pade. Ajeeb ZIP (encrypted, zip64, stored + data
+    descriptor) mile to chup-chaap band ho jaata hai - signer normal path le lega.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.entries = {}
+        self.failed = None
+        self.done = False
+        self._buffer = bytearray()
+        self._entry = None
+        self._descriptor = False
+
+    def write(self, data):
+        if not (self.done or self.failed):
+            self._buffer += data
+            try:
+                self._feed()
+            except (ValueError, zlib.error, struct.error) as e:
+                self.failed = str(e)
+                self._buffer = bytearray()
+        return self.f.write(data)
+
+    def _feed(self):
+        buf = self._buffer
+        pos = 0
+        while True:
+            if self._descriptor:
+                # Data descriptor: optional signature + crc + sizes
+                need = 16 if buf[pos:pos + 4] == DATA_DESCRIPTOR_SIGNATURE else 12
+                if len(buf) - pos < max(need, 4):
+                    break
+                pos += need
+                self._descriptor = False
+            elif self._entry is None:
+                if len(buf) - pos < LOCAL_HEADER_SIZE:
+                    break
+                if buf[pos:pos + 4] != LOCAL_HEADER_SIGNATURE:
+                    # Central directory (ya signing block) shuru - entries khatam
+                    self.done = True
+                    pos = len(buf)
+                    break
+                flags, method = struct.unpack_from("<HH", buf, pos + 6)
+                compressed_size, = struct.unpack_from("<I", buf, pos + 18)
+                name_len, extra_len = struct.unpack_from("<HH", buf, pos + 26)
+                header_len = LOCAL_HEADER_SIZE + name_len + extra_len
+                if len(buf) - pos < header_len:
+                    break
+                if flags & 0x01 or compressed_size == 0xFFFFFFFF or method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    raise ValueError("Unsupported entry in upload stream")
+                has_descriptor = bool(flags & 0x08)
+                if has_descriptor and method == zipfile.ZIP_STORED:
+                    raise ValueError("Stored entry with data descriptor")
+                name = bytes(buf[pos + LOCAL_HEADER_SIZE:pos + LOCAL_HEADER_SIZE + name_len])
+                self._entry = {
+                    "name": name.decode("utf-8" if flags & 0x800 else "cp437"),
+                    "remaining": None if has_descriptor else compressed_size,
+                    "inflater": zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None,
+                    "sha": hashlib.sha256(),
+                    "crc": 0,
+                    "size": 0,
+                }
+                pos += header_len
+            else:
+                entry = self._entry
+                inflater = entry["inflater"]
+                take = len(buf) - pos
+                if entry["remaining"] is not None:
+                    take = min(take, entry["remaining"])
+                    entry["remaining"] -= take
+                data = bytes(buf[pos:pos + take])
+                pos += take
+                if inflater is None:
+                    self._update(entry, data)
+                else:
+                    while data and not inflater.eof:
+                        self._update(entry, inflater.decompress(data, DIGEST_CHUNK))
+                        data = inflater.unconsumed_tail
+                    if inflater.unused_data:
+                        if entry["remaining"] is not None:
+                            raise ValueError(f"Corrupt deflate stream: {entry['name']}")
+                        # Descriptor wali entry - deflate ke baad ka data wapas buffer mein
+                        pos -= len(inflater.unused_data)
+
+                finished = inflater.eof if entry["remaining"] is None else entry["remaining"] == 0
+                if not finished:
+                    break
+                if inflater is not None and not inflater.eof:
+                    raise ValueError(f"Truncated deflate stream: {entry['name']}")
+                self.entries[entry["name"]] = (entry["sha"].digest(), entry["crc"], entry["size"])
+                self._descriptor = entry["remaining"] is None
+                self._entry = None
+        del buf[:pos]
+
+    @staticmethod
+    def _update(entry, data):
+        entry["sha"].update(data)
+        entry["crc"] = zlib.crc32(data, entry["crc"])
+        entry["size"] += len(data)
+
+    def digests(self):
+        """{name: (sha256, crc, size)} if the whole entry stream was parsed, else None"""
+        if self.failed or not self.done:
+            return None
+        return self.entries
+
+
+async def stream_download(file, out, chunk_size=DIGEST_CHUNK):
+    """Stream a Telegram file into out (write() per chunk) without holding it in memory
+
+    Network se agla chunk aata rahe aur pichhla chunk executor mein write/hash/digest
+    hota rahe - download aur hashing overlap karte hain, memory ~ 2 chunks.
+    Local Bot API server (local mode) ho to file_path seedha disk path hota hai.
+    """
+    loop = asyncio.get_running_loop()
+    pending = None
+
+    async def push(chunk):
+        nonlocal pending
+        if pending is not None:
+            await pending
+        pending = loop.run_in_executor(None, out.write, chunk)
+
+    if urlparse(file.file_path).scheme in ("http", "https"):
+        import httpx  # python-telegram-bot ki dependency
+        async with httpx.AsyncClient(timeout=httpx.Timeout(JOB_TIMEOUT)) as client:
+            async with client.stream("GET", file.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(chunk_size):
+                    await push(chunk)
+    else:
+        with open(file.file_path, "rb") as src:
+            while True:
+                chunk = await loop.run_in_executor(None, src.read, chunk_size)
+                if not chunk:
+                    break
+                await push(chunk)
+    if pending is not None:
+        await pending
+
+
+class SignedApkCache:
+    """Content-addressed cache of signed APKs with size-bounded LRU eviction"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> size, oldest first
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(apk_sha256, fingerprint, alias, schemes):
+        """Cache key = input APK hash + signer cert + alias + schemes"""
+        material = "\0".join([apk_sha256, fingerprint, alias.lower(), ",".join(schemes)])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.apk")
+
+    def _load(self):
+        # Restart ke baad disk se index dobara banao (mtime = last use)
+        if self._loaded:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".apk"):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                found.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+        self._loaded = True
+
+    @property
+    def total_bytes(self):
+        return sum(self._entries.values())
+
+    def get(self, key, dest_path):
+        """Copy the cached signed APK to dest_path, return True on hit"""
+        with self._lock:
+            self._load()
+            path = self._path(key)
+            # Dusre worker process ne bhi likha/hataya ho sakta hai - disk hi source of truth
+            if key not in self._entries and os.path.exists(path):
+                self._entries[key] = os.path.getsize(path)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self._entries.pop(key, None)
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            shutil.copyfile(path, dest_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key, src_path):
+        """Store a signed APK and evict least-recently-used entries over budget"""
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._load()
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, self._path(key))
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            while self.total_bytes > self.max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                try:
+                    os.remove(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class KeystoreRegistry:
+    """SQLite index of keystores keyed by (user_id, alias); files live under root_dir/<user>/<alias>/"""
+
+    def __init__(self, db_path, root_dir):
+        self.db_path = db_path
+        self.root_dir = os.path.abspath(root_dir)
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+        self.max_lookup_seconds = 0.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS keystores ("
+            " user_id INTEGER NOT NULL, alias TEXT NOT NULL, directory TEXT NOT NULL,"
+            " algorithm TEXT, fingerprint TEXT, created_at REAL NOT NULL,"
+            " PRIMARY KEY (user_id, alias))"
+        )
+        # JKS aliases case-insensitive hain (serialize_jks lowercase likhta hai) - purani rows bhi lowercase
+        self._db.execute("UPDATE OR IGNORE keystores SET alias = lower(alias)")
+        self._db.commit()
+
+    def keystore_dir(self, user_id, alias):
+        """Directory for a user's alias (alias sanitised + short hash so names never collide)"""
+        alias = alias.lower()
+        safe = re.sub(r"[^A-Za-z0-9._-]", "_", alias)[:40]
+        tag = hashlib.sha256(alias.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.root_dir, str(user_id), f"{safe}_{tag}")
+
+    def register(self, user_id, alias, directory, algorithm=None, fingerprint=None):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO keystores VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, alias.lower(), directory, algorithm, fingerprint, time.time()),
+            )
+            self._db.commit()
+
+    def lookup(self, user_id, alias):
+        """Return the keystore directory for (user_id, alias), or None"""
+        start = time.perf_counter()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT directory FROM keystores WHERE user_id = ? AND alias = ?", (user_id, alias.lower())
+            ).fetchone()
+            elapsed = time.perf_counter() - start
+            self.lookups += 1
+            self.lookup_seconds += elapsed
+            self.max_lookup_seconds = max(self.max_lookup_seconds, elapsed)
+        return row[0] if row else None
+
+    def list(self, user_id):
+        """[(alias, algorithm, fingerprint, created_at)] for one user, newest first"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT alias, algorithm, fingerprint, created_at FROM keystores"
+                " WHERE user_id = ? ORDER BY created_at DESC", (user_id,)
+            ).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stats(self):
+        with self._lock:
+            count, = self._db.execute("SELECT COUNT(*) FROM keystores").fetchone()
+            return {
+                "keystores": count,
+                "lookups": self.lookups,
+                "avg_lookup_ms": round(self.lookup_seconds / self.lookups * 1000, 3) if self.lookups else 0.0,
+                "max_lookup_ms": round(self.max_lookup_seconds * 1000, 3),
+            }
+
+
+class UnlockedKeyCache:
+    """In-memory cache of decrypted NativeSigners with TTL + LRU eviction
+
+    Key = keystore path + alias + HMAC(passwords) with a per-process secret -
+    galat password pe hit kabhi nahi hota, aur plain password memory mein nahi rakhte.
+    Keystore file badli (mtime/size) to entry stale maani jaati hai.
+    """
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+        self._secret = os.urandom(32)
+        self._entries = OrderedDict()  # key -> (signer, expires_at, file_stamp)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def _key(self, path, alias, store_pass, key_pass):
+        secret = hmac.new(self._secret, f"{store_pass}\0{key_pass}".encode("utf-8"), hashlib.sha256).digest()
+        return (os.path.abspath(path), alias, secret)
+
+    @staticmethod
+    def _stamp(path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def get_signer(self, path, alias, store_pass, key_pass=None):
+        """Return an unlocked NativeSigner, decrypting the keystore only on a miss"""
+        key_pass = key_pass if key_pass is not None else store_pass
+        start = time.perf_counter()
+        stamp = self._stamp(path)
+        if self.enabled:
+            key = self._key(path, alias, store_pass, key_pass)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry[1] > time.monotonic() and entry[2] == stamp:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.hit_seconds += time.perf_counter() - start
+                    return entry[0]
+                if entry:
+                    del self._entries[key]
+                    self.evictions += 1
+
+        signer = NativeSigner.from_keystore(path, alias, store_pass, key_pass)
+        if self.enabled:
+            with self._lock:
+                self._entries[key] = (signer, time.monotonic() + self.ttl, stamp)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += time.perf_counter() - start
+        return signer
+
+    def evict(self, path=None):
+        """Drop unlocked keys (all, or only those of one keystore path); return count"""
+        with self._lock:
+            keys = [k for k in self._entries if path is None or k[0] == os.path.abspath(path)]
+            for k in keys:
+                del self._entries[k]
+            self.evictions += len(keys)
+            return len(keys)
+
+    def evict_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            keys = [k for k, entry in self._entries.items() if entry[1] <= now]
+            for k in keys:
+                del self._entries[k]
+            self.evictions += len(keys)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "avg_hit_ms": round(self.hit_seconds / self.hits * 1000, 3) if self.hits else 0.0,
+                "avg_miss_ms": round(self.miss_seconds / self.misses * 1000, 3) if self.misses else 0.0,
+            }
+
+
+# Session store - admins ki chalti conversations
+def _deep_sizeof(obj, seen=None):
+    """Approximate bytes used by obj and everything it references (dicts, lists, tuples, __slots__)"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(_deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+class Session:
+    """One admin's in-progress /generate, /sign or /batch conversation
+
+    data = job ka user_data dict (jobs isi ko padhte/likhte hain), uploads = is flow
+    ke liye download hui files (sirf yahi delete hoti hain, user ke typed paths nahi).
+    """
+    __slots__ = ("user_id", "expecting", "data", "uploads", "last_active")
+
+    def __init__(self, user_id, data, expecting, uploads=None, last_active=None):
+        self.user_id = user_id
+        self.expecting = expecting
+        self.data = data
+        self.uploads = uploads if uploads is not None else []
+        self.last_active = last_active or time.time()
+
+    @property
+    def mode(self):
+        return self.data.get('mode')
+
+
+class SessionStore:
+    """Per-admin conversation state with idle TTL eviction, upload cleanup and optional persistence
+
+    Idle session discard hote hi uski uploads delete; background sweep un uploaded_*
+    files ko bhi hatata hai jo TTL se purani hain aur kisi session ya chalte job ki
+    nahi. SESSION_DB ho to har step SQLite mein save hota hai - passwords chhod ke;
+    restore ke baad aisi session password prompt pe wapas aati hai (self.restored).
+    """
+
+    def __init__(self, ttl=SESSION_TTL, db_path=SESSION_DB, upload_dir="."):
+        self.ttl = ttl
+        self.db_path = db_path
+        self.upload_dir = os.path.abspath(upload_dir)
+        self.evicted = 0
+        self.files_deleted = 0
+        self.restored = []  # [(user_id, expecting)] - restart ke baad prompt dobara bhejna hai
+        self._sessions = {}
+        self._in_flight = set()  # jobs ko saunpi gayi uploads - sweep inhe nahi chhoota
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._db = None
+
+    def start(self, interval=SESSION_SWEEP_SECONDS):
+        """Restore persisted sessions and start the eviction thread (bot process only)"""
+        if self.db_path and self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " user_id INTEGER PRIMARY KEY, expecting TEXT, payload BLOB NOT NULL, last_active REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._load()
+        if self.ttl and self._thread is None:
+            self._wakeup.clear()
+            self._thread = threading.Thread(target=self._sweep_loop, args=(interval,), name="session-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the eviction thread and close the session database"""
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def begin(self, user_id, mode, expecting, **data):
+        """Start a new flow for user_id (an unfinished previous flow is discarded)"""
+        self.discard(user_id)
+        session = Session(user_id, dict(data, mode=mode, user_id=user_id), expecting)
+        with self._lock:
+            self._sessions[user_id] = session
+        self.save(session)
+        return session
+
+    def get(self, user_id):
+        """Return the user's session (marking it active), or None"""
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                session.last_active = time.time()
+        return session
+
+    def save(self, session):
+        """Persist the session after a step (no-op without SESSION_DB or once the flow ended)"""
+        if self._db is None:
+            return
+        data = {k: v for k, v in session.data.items() if k not in SESSION_SECRET_FIELDS}
+        had_secrets = len(data) != len(session.data)
+        payload = pickle.dumps((data, session.uploads, had_secrets))
+        with self._lock:
+            if self._db is None or self._sessions.get(session.user_id) is not session:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                (session.user_id, session.expecting, payload, session.last_active),
+            )
+            self._db.commit()
+
+    def end(self, user_id):
+        """Hand the flow over to its job; its uploads stay on disk until release()"""
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            if session is not None:
+                self._in_flight.update(session.uploads)
+            self._delete_row(user_id)
+        return session
+
+    def release(self, user_data):
+        """Job finished - files it didn't deliver are now ordinary orphans for the sweep"""
+        with self._lock:
+            self._in_flight.discard(user_data.get('apk_file'))
+            self._in_flight.difference_update(user_data.get('batch_files', []))
+
+    def owns_upload(self, path):
+        """True if path was downloaded for a flow that is now a running job (typed server paths never are)"""
+        with self._lock:
+            return path in self._in_flight
+
+    def discard(self, user_id):
+        """Drop a flow (/cancel, idle, replaced) and delete the files uploaded for it"""
+        with self._lock:
+            session = self._sessions.pop(user_id, None)
+            self._delete_row(user_id)
+        if session is None:
+            return False
+        self._remove_files(session.uploads)
+        return True
+
+    def evict_idle(self):
+        """Discard sessions idle longer than the TTL and sweep orphaned uploads, return sessions evicted"""
+        if not self.ttl:
+            return 0
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            idle = [s for s in self._sessions.values() if s.last_active < cutoff]
+            for session in idle:
+                del self._sessions[session.user_id]
+                self._delete_row(session.user_id)
+            self.evicted += len(idle)
+        for session in idle:
+            self._remove_files(session.uploads)
+        self.sweep_uploads(cutoff)
+        return len(idle)
+
+    def sweep_uploads(self, cutoff):
+        """Delete uploaded_* files older than cutoff that no session or running job references"""
+        with self._lock:
+            live = set(self._in_flight)
+            for session in self._sessions.values():
+                live.update(session.uploads)
+        orphans = []
+        for entry in os.scandir(self.upload_dir):
+            if not entry.name.startswith(UPLOAD_PREFIX) or entry.path in live:
+                continue
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    orphans.append(entry.path)
+            except FileNotFoundError:
+                pass
+        self._remove_files(orphans)
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            in_flight = len(self._in_flight)
+            memory = sum(_deep_sizeof(s) for s in sessions)
+        by_mode = {}
+        for session in sessions:
+            by_mode[session.mode] = by_mode.get(session.mode, 0) + 1
+        now = time.time()
+        return {
+            "sessions": len(sessions),
+            "by_mode": by_mode,
+            "memory_bytes": memory,
+            "oldest_idle_seconds": max((now - s.last_active for s in sessions), default=0.0),
+            "uploads": sum(len(s.uploads) for s in sessions),
+            "in_flight_uploads": in_flight,
+            "evicted": self.evicted,
+            "files_deleted": self.files_deleted,
+            "persistent": self._db is not None,
+        }
+
+    def _sweep_loop(self, interval):
+        while not self._wakeup.wait(interval):
+            try:
+                evicted = self.evict_idle()
+                if evicted:
+                    logger.info(f"Evicted {evicted} idle session(s)")
+            except Exception as e:
+                logger.warning(f"Session sweep failed: {e}")
+
+    def _remove_files(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+                self.files_deleted += 1
+            except FileNotFoundError:
+                pass
+
+    def _delete_row(self, user_id):
+        # Caller _lock pakde hue hai
+        if self._db is not None:
+            self._db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            self._db.commit()
+
+    def _load(self):
+        """Restore persisted flows; ones that held a password go back to the password prompt"""
+        cutoff = time.time() - self.ttl if self.ttl else 0
+        rows = self._db.execute("SELECT user_id, expecting, payload, last_active FROM sessions").fetchall()
+        for user_id, expecting, payload, last_active in rows:
+            if last_active < cutoff:
+                self._db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+                continue
+            data, uploads, had_secrets = pickle.loads(payload)
+            if had_secrets:
+                # Password disk pe nahi tha - wahi step dobara (generate mein key_pass bhi dobara aayega)
+                expecting = 'store_pass'
+                self.restored.append((user_id, expecting))
+            uploads = [path for path in uploads if os.path.exists(path)]
+            self._sessions[user_id] = Session(user_id, data, expecting, uploads, last_active)
+        self._db.commit()
+
+
+# Batch signing - process pool workers
+_batch_signer = None
+
+
+def _init_batch_worker(signer, digest_workers):
+    """Process pool initializer: keep the (already decrypted) signer for every job"""
+    global _batch_signer, DIGEST_WORKERS
+    _batch_signer = signer
+    DIGEST_WORKERS = digest_workers  # saare processes milke cores share karte hain
+
+
+def _batch_sign_one(in_path, out_path, schemes):
+    """Sign (and verify) one batch member in a worker process, return (seconds, entries)"""
+    start = time.perf_counter()
+    stats = _batch_signer.sign(in_path, out_path, schemes)
+    if VERIFY_SIGNED:
+        # /sign jaisa hi check - fail hua member ❌ dikhega aur deliver nahi hoga
+        try:
+            result = verify_apk(out_path, stats.get("digests"))
+        except VerificationError as e:
+            raise VerificationError(f"Signature verification failed: {e}") from None
+        if result["fingerprint"] != _batch_signer.fingerprint:
+            raise VerificationError("Signature verification failed: APK is signed with a different key")
+    return time.perf_counter() - start, stats["entries"]
+
+
+def upload_display_name(path):
+    """Original document name of an uploaded_* file"""
+    return re.sub(rf"^{UPLOAD_PREFIX}\d+_\d+_(batch\d+_)?", "", os.path.basename(path))
+
+
+def clip_report(text, limit=BATCH_REPORT_CHARS):
+    """Cut text at a line boundary to fit a chat message, return (text, clipped)"""
+    if len(text) <= limit:
+        return text, False
+    lines = text.split("\n")
+    kept, size = [], 0
+    for line in lines:
+        if size + len(line) + 1 > limit - 80:
+            break
+        kept.append(line)
+        size += len(line) + 1
+    if not kept:
+        kept = [lines[0][:limit - 80]]
+    kept.append(f"... {len(lines) - len(kept)} more line(s) in batch_report.txt")
+    return "\n".join(kept), True
+
+
+def is_batch_archive(filename):
+    return filename.lower().endswith(BATCH_ARCHIVE_EXTENSIONS)
+
+
+def extract_archive_apks(archive, dest_dir, start_index=0):
+    """Extract the .apk members of a bundle into dest_dir, return [(member_name, path)]"""
+    members = []
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(".apk"):
+                continue
+            # Member name pe bharosa nahi (zip-slip) - apna naam do
+            path = os.path.join(dest_dir, f"{start_index + len(members):03d}_{os.path.basename(info.filename)}")
+            with zf.open(info) as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst, DIGEST_CHUNK)
+            members.append((info.filename, path))
+    return members
+
+
+def rebuild_archive(archive, out_path, signed):
+    """Copy a bundle to out_path with its APK members replaced by signed[member_name] files"""
+    with zipfile.ZipFile(archive) as zin, zipfile.ZipFile(out_path, "w") as zout:
+        for info in zin.infolist():
+            if info.filename in signed:
+                # APK already compressed hai - stored rakho (bundletool bhi yahi karta hai)
+                zout.write(signed[info.filename], info.filename, compress_type=zipfile.ZIP_STORED)
+                continue
+            with zin.open(info) as src, zout.open(info, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dst:
+                shutil.copyfileobj(src, dst, DIGEST_CHUNK)
+
+
+def keystore_bundle(directory):
+    """Zip the /generate output files in directory into memory, return the zip bytes"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name in KEYSTORE_FILES:
+            path = os.path.join(directory, name)
+            if os.path.exists(path):
+                zf.write(path, name)
+    return buffer.getvalue()
+
+
 class APKSigningBot:
     def __init__(self):
-        self.cert_dir = "APK_Signing_Keys"
-        self.current_user_data = {}
+        self.cert_dir = os.path.abspath("APK_Signing_Keys")
+        self.sessions = SessionStore()
+        self._publish_lock = threading.Lock()
+        self.signed_cache = SignedApkCache(SIGN_CACHE_DIR, SIGN_CACHE_MAX_BYTES)
+        self.key_pool = KeyPool(KEY_POOL_SIZE, KEY_POOL_SPILL, KEY_POOL_PASSPHRASE, parse_key_algorithm(KEY_ALGORITHM))
+        self.registry = KeystoreRegistry(KEYSTORE_DB, self.cert_dir)
+        self.key_cache = UnlockedKeyCache(KEY_CACHE_TTL, KEY_CACHE_MAX)
+
+    def workspace(self, prefix):
+        """Create an isolated temp workspace for one job (auto-deleted on exit)"""
+        return tempfile.TemporaryDirectory(prefix=f"{prefix}_", dir=WORK_DIR)
+
+    def publish_files(self, workspace, names, dest_dir=None):
+        """Copy finished job files from a workspace into dest_dir (default cert_dir) atomically"""
+        dest_dir = dest_dir or self.cert_dir
+        os.makedirs(dest_dir, exist_ok=True)
+        with self._publish_lock:
+            for name in names:
+                src = os.path.join(workspace, name)
+                if not os.path.exists(src):
+                    continue
+                dst = os.path.join(dest_dir, name)
+                tmp_dst = f"{dst}.tmp"
+                shutil.copy2(src, tmp_dst)
+                os.replace(tmp_dst, dst)
+
+    def resolve_keystore(self, user_data):
+        """android.jks path for the user's alias from the registry (legacy cert_dir/android.jks fallback)"""
+        directory = None
+        if 'user_id' in user_data:
+            directory = self.registry.lookup(user_data['user_id'], user_data.get('alias_name', 'mykey'))
+        return os.path.join(directory or self.cert_dir, "android.jks")
+
+    def load_signer(self, user_data):
+        """Return (signer, keystore path); unlocked keys come from key_cache when possible"""
+        keystore = self.resolve_keystore(user_data)
+        if not os.path.exists(keystore):
+            raise KeystoreError("Keystore file not found. Please generate certificate first.")
+        store_pass = user_data.get('store_pass', 'android')
+        with metrics.stage("unlock"):
+            signer = self.key_cache.get_signer(
+                keystore, user_data.get('alias_name', 'mykey'), store_pass, user_data.get('key_pass', store_pass)
+            )
+        return signer, keystore
 
     def check_keytool(self):
         """Check if keytool is available"""
         try:
-            subprocess.run(["keytool", "-help"], capture_output=True, check=True)
+            with metrics.stage("toolchain"):
+                subprocess.run(["keytool", "-help"], capture_output=True, check=True)
             return True
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
@@ -64,71 +3122,111 @@ class APKSigningBot:
     def generate_keystore(self, user_data):
         """Generate JKS keystore and related files"""
         try:
-            # Create working directory
-            os.makedirs(self.cert_dir, exist_ok=True)
-            os.chdir(self.cert_dir)
+            with self.workspace("generate") as workdir:
+                return self._generate_keystore_in(workdir, user_data)
+        except Exception as e:
+            return False, f"Error: {str(e)}"
 
-            # Prepare variables
-            alias_name = user_data.get('alias_name', 'mykey')
-            org_name = user_data.get('org_name', 'MyCompany')
-            org_unit = user_data.get('org_unit', 'IT')
-            city = user_data.get('city', 'Mumbai')
-            state = user_data.get('state', 'Maharashtra')
-            country = user_data.get('country', 'IN')
-            store_pass = user_data.get('store_pass', 'android')
-            key_pass = user_data.get('key_pass', store_pass)
-            validity_years = int(user_data.get('validity_years', 25))
-            validity_days = validity_years * 365
+    def _generate_keystore_in(self, workdir, user_data):
+        """Create the keystore bundle inside workdir and publish the results"""
+        # Prepare variables
+        alias_name = user_data.get('alias_name', 'mykey')
+        org_name = user_data.get('org_name', 'MyCompany')
+        org_unit = user_data.get('org_unit', 'IT')
+        city = user_data.get('city', 'Mumbai')
+        state = user_data.get('state', 'Maharashtra')
+        country = user_data.get('country', 'IN')
+        store_pass = user_data.get('store_pass', 'android')
+        key_pass = user_data.get('key_pass', store_pass)
+        validity_years = int(user_data.get('validity_years', 25))
+        validity_days = validity_years * 365
+        algorithm = parse_key_algorithm(user_data.get('key_algorithm', KEY_ALGORITHM))
+        sigalg = KEY_ALGORITHMS[algorithm][2]
 
+        if KEYSTORE_BACKEND == 'keytool':
             dname = f"CN={alias_name}, OU={org_unit}, O={org_name}, L={city}, ST={state}, C={country}"
+            success, message = self._keytool_generate(workdir, alias_name, dname, validity_days, store_pass, key_pass, algorithm)
+        else:
+            try:
+                subject = build_subject(alias_name, org_unit, org_name, city, state, country)
+            except ValueError as e:
+                return False, f"Invalid certificate details: {e}"
+            # Pool sirf default algorithm ki keys rakhta hai; EC keygen waise bhi turant hota hai
+            with metrics.stage("keygen"):
+                if algorithm == self.key_pool.algorithm:
+                    private_key = self.key_pool.get()
+                else:
+                    private_key = generate_key(algorithm)
+                private_key, cert = create_self_signed(subject, validity_days, private_key)
+            write_keystore_bundle(workdir, alias_name, private_key, cert, store_pass, key_pass)
+            success, message = True, ""
+        if not success:
+            return False, message
 
-            # Generate JKS Keystore
-            cmd = [
-                "keytool", "-genkey", "-v",
-                "-keystore", "android.jks",
-                "-alias", alias_name,
-                "-keyalg", "RSA",
-                "-keysize", "2048",
-                "-validity", str(validity_days),
-                "-storepass", store_pass,
-                "-keypass", key_pass,
-                "-dname", dname
-            ]
-
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode != 0:
-                return False, f"Failed to create JKS: {result.stderr}"
-
-            # Export certificate
-            export_cmd = [
-                "keytool", "-export", "-rfc",
-                "-alias", alias_name,
-                "-keystore", "android.jks",
-                "-storepass", store_pass,
-                "-file", "certificate.cer"
-            ]
-            subprocess.run(export_cmd, capture_output=True)
-
-            # Create PKCS12
-            pkcs12_cmd = [
-                "keytool", "-importkeystore",
-                "-srckeystore", "android.jks",
-                "-destkeystore", "android.p12",
-                "-deststoretype", "PKCS12",
-                "-srcstorepass", store_pass,
-                "-deststorepass", store_pass
-            ]
-            subprocess.run(pkcs12_cmd, capture_output=True)
-
-            # Create scripts
-            self.create_scripts(alias_name, store_pass, key_pass, validity_years)
-
-            return True, "Keystore generated successfully!"
+        # Create scripts
+        self.create_scripts(workdir, alias_name, store_pass, key_pass, validity_years, sigalg)
 
-        except Exception as e:
-            return False, f"Error: {str(e)}"
+        # Workspace se final files registry mein (user + alias ki apni directory)
+        user_id = user_data.get('user_id')
+        dest_dir = self.registry.keystore_dir(user_id, alias_name) if user_id is not None else self.cert_dir
+        self.publish_files(workdir, KEYSTORE_FILES, dest_dir)
+        user_data['keystore_dir'] = dest_dir
+        self.key_cache.evict(os.path.join(dest_dir, "android.jks"))
+        if user_id is not None:
+            with open(os.path.join(workdir, "certificate.cer"), "rb") as f:
+                data = f.read()
+            # keytool DER likhta hai, native backend PEM
+            published = x509.load_pem_x509_certificate(data) if data.startswith(b"-----") else x509.load_der_x509_certificate(data)
+            self.registry.register(user_id, alias_name, dest_dir, algorithm, published.fingerprint(hashes.SHA256()).hex())
+
+        return True, "Keystore generated successfully!"
+
+    def _keytool_generate(self, workdir, alias_name, dname, validity_days, store_pass, key_pass, algorithm):
+        """Create android.jks, certificate.cer and android.p12 with keytool (3 JVM launches)"""
+        # Generate JKS Keystore - job ke apne workspace mein (cwd=workdir), taaki parallel jobs ek dusre ko na chhede
+        cmd = [
+            "keytool", "-genkey", "-v",
+            "-keystore", "android.jks",
+            "-alias", alias_name,
+            "-keyalg", KEY_ALGORITHMS[algorithm][0],
+            "-keysize", str(KEY_ALGORITHMS[algorithm][1]),
+            "-validity", str(validity_days),
+            "-storepass", store_pass,
+            "-keypass", key_pass,
+            "-dname", dname
+        ]
+
+        with metrics.stage("keygen"):
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd=workdir, timeout=JOB_TIMEOUT)
+        if result.returncode != 0:
+            return False, f"Failed to create JKS: {result.stderr}"
+
+        # Export certificate
+        export_cmd = [
+            "keytool", "-export", "-rfc",
+            "-alias", alias_name,
+            "-keystore", "android.jks",
+            "-storepass", store_pass,
+            "-file", "certificate.cer"
+        ]
+        with metrics.stage("export"):
+            subprocess.run(export_cmd, capture_output=True, cwd=workdir, timeout=JOB_TIMEOUT)
+
+        # Create PKCS12
+        pkcs12_cmd = [
+            "keytool", "-importkeystore",
+            "-srckeystore", "android.jks",
+            "-destkeystore", "android.p12",
+            "-deststoretype", "PKCS12",
+            "-srcstorepass", store_pass,
+            "-deststorepass", store_pass
+        ]
+        with metrics.stage("pkcs12"):
+            subprocess.run(pkcs12_cmd, capture_output=True, cwd=workdir, timeout=JOB_TIMEOUT)
+
+        return True, ""
 
-    def create_scripts(self, alias_name, store_pass, key_pass, validity_years):
+    def create_scripts(self, target_dir, alias_name, store_pass, key_pass, validity_years, sigalg="SHA256withRSA"):
         """Create signing and verification scripts"""
         
         # sign_apk.sh
@@ -165,7 +3263,7 @@ jarsigner -verbose \\
     -keystore "android.jks" \\
     -storepass "{store_pass}" \\
     -keypass "{key_pass}" \\
-    -sigalg SHA256withRSA \\
+    -sigalg {sigalg} \\
     -digestalg SHA-256 \\
     "$APK_FILE" \\
     "{alias_name}"
@@ -182,9 +3280,10 @@ else
 fi
 '''
 
-        with open("sign_apk.sh", "w") as f:
+        script_path = os.path.join(target_dir, "sign_apk.sh")
+        with open(script_path, "w") as f:
             f.write(sign_apk_script)
-        os.chmod("sign_apk.sh", 0o755)
+        os.chmod(script_path, 0o755)
 
         # Create README
         readme_content = f'''APK SIGNING CERTIFICATE - MT MANAGER STYLE
@@ -228,7 +3327,7 @@ Validity: {validity_years} years
 Generated for: {alias_name}
 '''
 
-        with open("README_APK_SIGNING.txt", "w") as f:
+        with open(os.path.join(target_dir, "README_APK_SIGNING.txt"), "w") as f:
             f.write(readme_content)
 
     def sign_apk_process(self, user_data):
@@ -238,41 +3337,215 @@ Generated for: {alias_name}
             alias_name = user_data.get('alias_name', 'mykey')
             store_pass = user_data.get('store_pass', 'android')
             key_pass = user_data.get('key_pass', store_pass)
+            schemes = parse_schemes(user_data.get('schemes', SIGN_SCHEMES))
             
-            if not os.path.exists(apk_file):
+            if not apk_file or not os.path.exists(apk_file):
                 return False, f"APK file not found: {apk_file}"
             
-            if not os.path.exists("android.jks"):
-                return False, "Keystore file not found. Please generate certificate first."
+            # Registry se keystore, unlocked key cache se signer (repeat sign pe PBE/decrypt nahi)
+            try:
+                signer, keystore = self.load_signer(user_data)
+            except KeystoreError as e:
+                return False, str(e)
+            
+            with self.workspace("sign") as workdir:
+                work_apk = os.path.join(workdir, os.path.basename(apk_file))
+                
+                # Same APK + same key + same schemes pehle sign ho chuka hai? Cache se do
+                cache_key = None
+                if self.signed_cache.enabled:
+                    apk_sha256 = user_data.get('apk_sha256') or sha256_file(apk_file)
+                    cache_key = SignedApkCache.make_key(apk_sha256, signer.fingerprint, alias_name, schemes)
+                    if self.signed_cache.get(cache_key, work_apk):
+                        shutil.move(work_apk, os.path.abspath(apk_file))
+                        return True, self._sign_summary(signer, schemes, "served from cache")
+                
+                known = None
+                if SIGN_BACKEND == 'jarsigner':
+                    # Purani .SF/.RSA aur v2/v3 block hata ke workspace copy pe sign karo, phir original replace
+                    with metrics.stage("strip", os.path.getsize(apk_file)):
+                        rewrite_apk(apk_file, work_apk, align=False, strip=True)
+                    success, message = self._sign_apk_in(workdir, work_apk, keystore, alias_name, store_pass, key_pass, jarsigner_sigalg(signer.private_key))
+                    if success and ZIP_ALIGN:
+                        # jarsigner align nahi karta - uski MANIFEST.MF/.SF/.RSA rakh ke sirf padding badlo
+                        with metrics.stage("strip", os.path.getsize(work_apk)):
+                            rewrite_apk(work_apk, f"{work_apk}.aligned", align=True, strip=False)
+                        os.replace(f"{work_apk}.aligned", work_apk)
+                    if success and schemes != ("v1",):
+                        # jarsigner sirf v1 karta hai - v2/v3 block native engine se lagao
+                        block_schemes = [s for s in schemes if s != "v1"]
+                        signer.apply_signing_block(work_apk, f"{work_apk}.v2", block_schemes)
+                        os.replace(f"{work_apk}.v2", work_apk)
+                    if success:
+                        message = self._sign_summary(signer, schemes, "jarsigner")
+                else:
+                    stats = signer.sign(apk_file, work_apk, schemes, known=user_data.get('entry_digests'))
+                    detail = f"{stats['entries']} entries signed"
+                    if stats['reused']:
+                        detail += f", {stats['reused']} digests reused, {stats['entries'] - stats['reused']} rehashed"
+                    if stats['streamed']:
+                        detail += f", {stats['streamed']} digested during upload"
+                    success, message = True, self._sign_summary(signer, schemes, detail)
+                    if 'misaligned' in stats:
+                        message += "\n" + self._alignment_summary(stats['misaligned'])
+                    known = stats.get('digests')
+                if success and VERIFY_SIGNED:
+                    try:
+                        with metrics.stage("verify", os.path.getsize(work_apk)):
+                            result = verify_apk(work_apk, known)
+                    except VerificationError as e:
+                        return False, f"Signature verification failed: {e}"
+                    if result['fingerprint'] != signer.fingerprint:
+                        return False, "Signature verification failed: APK is signed with a different key"
+                    message += "\n" + verification_summary(result)
+                if success:
+                    if cache_key:
+                        self.signed_cache.put(cache_key, work_apk)
+                    shutil.move(work_apk, os.path.abspath(apk_file))
+                return success, message
+                
+        except Exception as e:
+            return False, f"Error during signing: {str(e)}"
+
+    def sign_batch_process(self, user_data):
+        """Sign every APK of a batch (uploads + bundle members) with one keystore load"""
+        try:
+            files = user_data.get('batch_files', [])
+            schemes = parse_schemes(user_data.get('schemes', SIGN_SCHEMES))
             
-            # Sign the APK
-            cmd = [
-                "jarsigner", "-verbose",
-                "-keystore", "android.jks",
-                "-storepass", store_pass,
-                "-keypass", key_pass,
-                "-sigalg", "SHA256withRSA",
-                "-digestalg", "SHA-256",
-                apk_file,
-                alias_name
-            ]
+            if not files:
+                return False, "No APK files received"
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            # Keystore ek hi baar parse + decrypt (ya key cache se) - workers ko decrypted signer milta hai
+            try:
+                signer, _ = self.load_signer(user_data)
+            except KeystoreError as e:
+                return False, str(e)
             
-            if result.returncode == 0:
-                # Verify signature
-                verify_cmd = ["jarsigner", "-verify", "-verbose", apk_file]
-                verify_result = subprocess.run(verify_cmd, capture_output=True, text=True)
+            with self.workspace("batch") as workdir:
+                # jobs: (label, in_path, out_path, upload, archive_member)
+                jobs = []
+                for upload in files:
+                    if is_batch_archive(upload):
+                        for member, path in extract_archive_apks(upload, workdir, len(jobs)):
+                            jobs.append((f"{upload_display_name(upload)}: {member}", path, f"{path}.signed", upload, member))
+                    else:
+                        out_path = os.path.join(workdir, f"{len(jobs):03d}_signed.apk")
+                        jobs.append((upload_display_name(upload), upload, out_path, upload, None))
                 
-                return True, f"APK signed successfully!\n\nVerification Output:\n{verify_result.stdout}"
-            else:
-                return False, f"Signing failed: {result.stderr}"
+                if not jobs:
+                    return False, "No APK files found in the batch"
+                if len(jobs) > BATCH_MAX_FILES:
+                    return False, f"Too many APKs in one batch ({len(jobs)}, max {BATCH_MAX_FILES})"
+                
+                workers = max(1, min(BATCH_WORKERS, len(jobs)))
+                results = [None] * len(jobs)
+                start = time.perf_counter()
+                # spawn, fork nahi - bot process mein key pool / session sweeper / metrics threads chalte hain
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_batch_worker,
+                    initargs=(signer, max(1, DIGEST_WORKERS // workers)),
+                ) as pool:
+                    futures = {pool.submit(_batch_sign_one, job[1], job[2], schemes): i for i, job in enumerate(jobs)}
+                    for future in as_completed(futures):
+                        try:
+                            results[futures[future]] = future.result()
+                        except Exception as e:
+                            results[futures[future]] = e
+                wall = time.perf_counter() - start
+                for (_, in_path, *_), result in zip(jobs, results):
+                    if not isinstance(result, Exception):
+                        metrics.record("batch_apk", result[0], os.path.getsize(in_path))
                 
+                # Signed files wapas uploads pe; bundle tabhi rebuild jab uske saare members sign ho gaye
+                bundles = {}
+                signed_files = []
+                for (label, in_path, out_path, upload, member), result in zip(jobs, results):
+                    if member is None:
+                        if not isinstance(result, Exception):
+                            shutil.move(out_path, upload)
+                            signed_files.append(upload)
+                        continue
+                    bundles.setdefault(upload, {})[member] = result if isinstance(result, Exception) else out_path
+                for upload, signed in bundles.items():
+                    if not any(isinstance(v, Exception) for v in signed.values()):
+                        rebuilt = os.path.join(workdir, f"rebuilt_{os.path.basename(upload)}")
+                        rebuild_archive(upload, rebuilt, signed)
+                        shutil.move(rebuilt, upload)
+                        signed_files.append(upload)
+                # Delivery (upload) bot process karta hai - job slot agle job ke liye free
+                user_data['signed_files'] = signed_files
+            
+            ok = sum(1 for r in results if not isinstance(r, Exception))
+            lines = []
+            for (label, *_), result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    lines.append(f"❌ {label} - {result}")
+                else:
+                    seconds, entries = result
+                    lines.append(f"✅ {label} - {seconds:.2f}s ({entries} entries)")
+            busy = sum(r[0] for r in results if not isinstance(r, Exception))
+            message = (
+                f"Batch signed: {ok}/{len(jobs)} APKs in {wall:.2f}s "
+                f"({workers} workers, {busy:.2f}s total signing time)\n\n"
+                f"Schemes: {', '.join(schemes)}\n"
+                f"Key: {key_description(signer.private_key)}\n"
+                f"SHA-256: {signer.fingerprint}\n\n"
+                + "\n".join(lines)
+            )
+            return ok > 0, message
+            
         except Exception as e:
-            return False, f"Error during signing: {str(e)}"
+            return False, f"Error during batch signing: {str(e)}"
+
+    def _alignment_summary(self, misaligned):
+        """One-line zipalign verification result"""
+        if not misaligned:
+            return "Alignment: OK (zipaligned)"
+        names = ", ".join(name for name, _, _ in misaligned[:5])
+        more = f" (+{len(misaligned) - 5} more)" if len(misaligned) > 5 else ""
+        return f"Alignment: {len(misaligned)} entries misaligned: {names}{more}"
+
+    def _sign_summary(self, signer, schemes, detail):
+        """Short result text for a native (or cached) sign"""
+        return (
+            f"APK signed successfully! ({detail})\n\n"
+            f"Schemes: {', '.join(schemes)}\n"
+            f"Key: {key_description(signer.private_key)}\n"
+            f"Signer: {signer.certs[0].subject.rfc4514_string()}\n"
+            f"SHA-256: {signer.fingerprint}"
+        )
+
+    def _sign_apk_in(self, workdir, apk_file, keystore, alias_name, store_pass, key_pass, sigalg):
+        """Run jarsigner on an APK inside workdir"""
+        # Sign the APK
+        cmd = [
+            "jarsigner", "-verbose",
+            "-keystore", keystore,
+            "-storepass", store_pass,
+            "-keypass", key_pass,
+            "-sigalg", sigalg,
+            "-digestalg", "SHA-256",
+            apk_file,
+            alias_name
+        ]
+        
+        with metrics.stage("sign", os.path.getsize(apk_file)):
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd=workdir, timeout=JOB_TIMEOUT)
+        
+        if result.returncode == 0:
+            # Verification ab in-process (verify_apk) - align + v2/v3 block ke baad final APK pe
+            return True, "APK signed successfully!"
+        else:
+            return False, f"Signing failed: {result.stderr}"
 
 # Telegram Bot Handlers
 bot = APKSigningBot()
+job_runner = JobRunner()
+worker_tier = WorkerTier(fallback=job_runner) if WORKER_PROCESSES > 0 else None
+scheduler = FairScheduler(worker_tier or job_runner, concurrency=WORKER_PROCESSES or JOB_CONCURRENCY)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send welcome message when command /start is issued."""
@@ -291,6 +3564,10 @@ I can generate APK signing certificates compatible with MT Manager!
 /start - Show this welcome message
 /generate - Generate new APK signing certificate  
 /sign - Sign an APK file with existing certificate
+/batch - Sign several APKs or a .apks/.zip bundle at once
+/keys - List your keystores and key cache stats
+/lock - Forget your unlocked signing keys
+/stats - Per-stage latency and queue stats
 /cancel - Cancel current operation
 
 *How to use:*
@@ -314,17 +3591,14 @@ async def generate_certificate(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("❌ You are not authorized to use this bot.")
         return
 
-    # Initialize user data
-    bot.current_user_data[user_id] = {'mode': 'generate'}
+    # Initialize user session
+    bot.sessions.begin(user_id, 'generate', expecting='alias_name')
     
     await update.message.reply_text(
         "🔐 *Let's create your APK signing certificate!*\n\n"
         "Please enter your *Name/Alias* for the certificate:",
         parse_mode='Markdown'
     )
-    
-    # Set next expected input
-    context.user_data['expecting'] = 'alias_name'
 
 async def sign_apk(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start the APK signing process."""
@@ -334,17 +3608,238 @@ async def sign_apk(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ You are not authorized to use this bot.")
         return
 
-    # Initialize user data for signing
-    bot.current_user_data[user_id] = {'mode': 'sign'}
+    # Initialize user session for signing
+    bot.sessions.begin(user_id, 'sign', expecting='apk_file')
     
     await update.message.reply_text(
         "📱 *APK Signing Process* 📱\n\n"
         "Please send me the APK file you want to sign:",
         parse_mode='Markdown'
     )
+
+async def batch_sign(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start the batch signing process (several APKs / split-APK bundles)."""
+    user_id = update.effective_user.id
+    
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this bot.")
+        return
+
+    bot.sessions.begin(user_id, 'batch', expecting='batch_files', batch_files=[])
+    
+    await update.message.reply_text(
+        "📦 *Batch Signing* 📦\n\n"
+        "Send me the APK files and/or `.apks` / `.xapk` / `.zip` bundles to sign.\n"
+        "Type `done` when all files are uploaded.",
+        parse_mode='Markdown'
+    )
+
+def key_cache_stats():
+    """Unlocked key cache stats summed over the bot process and the signing workers"""
+    snapshots = [bot.key_cache.stats()] + (worker_tier.worker_stats("key_cache") if worker_tier else [])
+    hits = sum(s["hits"] for s in snapshots)
+    misses = sum(s["misses"] for s in snapshots)
+    return {
+        "entries": sum(s["entries"] for s in snapshots),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        "evictions": sum(s["evictions"] for s in snapshots),
+        "avg_hit_ms": round(sum(s["avg_hit_ms"] * s["hits"] for s in snapshots) / hits, 3) if hits else 0.0,
+        "avg_miss_ms": round(sum(s["avg_miss_ms"] * s["misses"] for s in snapshots) / misses, 3) if misses else 0.0,
+    }
+
+def signed_cache_stats():
+    """Signed APK cache stats, hit/miss counters summed over the bot process and the signing workers"""
+    stats = bot.signed_cache.stats()
+    for snapshot in worker_tier.worker_stats("signed_cache") if worker_tier else []:
+        for field in ("hits", "misses", "evictions"):
+            stats[field] += snapshot[field]
+        # Cache directory sabki shared hai - jis process ne index sabse haal mein dekha uska size
+        stats["entries"] = max(stats["entries"], snapshot["entries"])
+        stats["bytes"] = max(stats["bytes"], snapshot["bytes"])
+    return stats
+
+async def list_keys(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List the admin's registered keystores plus registry / key cache metrics."""
+    user_id = update.effective_user.id
+    
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this bot.")
+        return
+    
+    rows = bot.registry.list(user_id)
+    lines = [
+        f"• {alias} ({algorithm or '?'}) {fingerprint[:16] if fingerprint else ''} - "
+        f"{datetime.fromtimestamp(created_at, timezone.utc):%Y-%m-%d}"
+        for alias, algorithm, fingerprint, created_at in rows
+    ]
+    registry = bot.registry.stats()
+    cache = key_cache_stats()
+    text = (
+        "Your keystores:\n" + ("\n".join(lines) if lines else "(none - use /generate)") + "\n\n"
+        f"Registry: {registry['keystores']} keystores, {registry['lookups']} lookups, "
+        f"avg {registry['avg_lookup_ms']} ms, max {registry['max_lookup_ms']} ms\n"
+        f"Key cache: {cache['entries']} unlocked, hit rate {cache['hit_rate']:.0%} "
+        f"({cache['hits']} hits / {cache['misses']} misses), "
+        f"avg hit {cache['avg_hit_ms']} ms, avg unlock {cache['avg_miss_ms']} ms, {cache['evictions']} evictions"
+    )
+    await update.message.reply_text(text)
+
+def metrics_gauges():
+    """Queue / worker / cache gauges for /stats and the Prometheus endpoint"""
+    gauges = {
+        "jobs_running": scheduler.running,
+        "jobs_waiting": scheduler.waiting,
+        "jobs_rejected_total": scheduler.rejected,
+    }
+    cache = signed_cache_stats()
+    gauges.update({
+        "key_cache_hit_rate": key_cache_stats()["hit_rate"],
+        "signed_cache_hits_total": cache["hits"],
+        "signed_cache_misses_total": cache["misses"],
+    })
+    sessions = bot.sessions.stats()
+    gauges.update({
+        "sessions_active": sessions["sessions"],
+        "sessions_memory_bytes": sessions["memory_bytes"],
+        "sessions_evicted_total": sessions["evicted"],
+        "session_files_deleted_total": sessions["files_deleted"],
+    })
+    if worker_tier:
+        tier = worker_tier.stats()
+        gauges.update({"workers_alive": tier["workers"], "worker_restarts_total": tier["restarts"]})
+    return gauges
+
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin-only per-stage latency histograms (p50/p95/p99), bytes and queue stats."""
+    user_id = update.effective_user.id
+    
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this bot.")
+        return
+    
+    lines = [f"{'stage':<11}{'count':>6}{'p50':>8}{'p95':>8}{'p99':>8}{'MB':>8}"]
+    for stage, data in sorted(metrics.summary().items()):
+        lines.append(
+            f"{stage:<11}{data['count']:>6}"
+            f"{data['p50'] * 1000:>8.0f}{data['p95'] * 1000:>8.0f}{data['p99'] * 1000:>8.0f}"
+            f"{data['bytes'] / 1024 / 1024:>8.1f}"
+        )
+    if len(lines) == 1:
+        lines.append("(no jobs yet)")
+    lines.append("")
+    lines += [f"{name}: {value}" for name, value in metrics_gauges().items()]
+    lines.append(f"slow_jobs (>{SLOW_JOB_SECONDS:g}s): {metrics.slow_jobs}")
+    
+    text = "\n".join(lines)
+    await update.message.reply_text(f"📊 *Stage latency (ms)*\n```\n{text}\n```", parse_mode='Markdown')
+
+async def lock_keys(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Explicitly evict the admin's unlocked signing keys from memory."""
+    user_id = update.effective_user.id
+    
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this bot.")
+        return
+    
+    paths = [os.path.join(bot.registry.lookup(user_id, alias), "android.jks") for alias, *_ in bot.registry.list(user_id)]
+    evicted = sum(bot.key_cache.evict(path) for path in paths)
+    busy = 0
+    if worker_tier:
+        # Signing workers mein bhi unlocked keys hain - unhe pipe se evict karwao
+        in_workers, busy = await worker_tier.evict_keys(paths)
+        evicted += in_workers
+    text = f"🔒 {evicted} unlocked key(s) removed from memory."
+    if busy:
+        text += f" {busy} busy worker(s) will drop theirs after the current job."
+    await update.message.reply_text(text)
+
+def start_job(update, context, job, user_data):
+    """End the conversation and run job(update, user_data) as a background task
+
+    Session yahin khatam - job apna user_data khud rakhta hai; job ke baad uski
+    uploads session store ke orphan sweep ke hawale.
+    """
+    bot.sessions.end(update.effective_user.id)
+    task = context.application.create_task(job(update, user_data), update=update)
+    task.add_done_callback(lambda _: bot.sessions.release(user_data))
+
+async def run_scheduled_job(update, label, func, user_data, small=False):
+    """Queue func(user_data) on the fair scheduler and await it
+
+    Ek hi status message bhejte hain aur queue position badalne pe usi ko edit karte hain.
+    """
+    status = await update.message.reply_text(f"⏳ {label}")
+    shown = {'position': None, 'latest': None, 'editing': False}
+    
+    async def show_position(position):
+        # Edit chal raha ho to sirf latest position yaad rakho - Telegram edits coalesce ho jaate hain
+        shown['latest'] = position
+        if shown['editing']:
+            return
+        shown['editing'] = True
+        try:
+            while shown['position'] != shown['latest']:
+                position = shown['latest']
+                text = f"⏳ {label}" if position == 0 else f"🕒 Queued - position {position} in line.\n{label}"
+                try:
+                    await status.edit_text(text)
+                except TelegramError:
+                    pass  # message delete ho gaya / text same hai
+                shown['position'] = position
+        finally:
+            shown['editing'] = False
     
-    # Set next expected input
-    context.user_data['expecting'] = 'apk_file'
+    try:
+        future = scheduler.submit(update.effective_user.id, func, user_data, small=small, on_position=show_position)
+    except QueueFullError:
+        await status.delete()
+        raise
+    try:
+        return await future
+    except asyncio.CancelledError:
+        if future.cancelled():
+            # /cancel se queue se hataya gaya
+            try:
+                await status.edit_text("❌ Cancelled.")
+            except TelegramError:
+                pass
+        raise
+
+async def send_result(update, document, filename, caption=None):
+    """Upload a result (file path or in-memory bytes) to the chat, return True if it was sent
+
+    Job ka scheduler slot pehle hi free ho chuka hota hai, isliye upload agle queued job
+    ke saath parallel chalta hai. Local Bot API server ko sirf file:// path jaata hai
+    (server khud disk se padhta hai); cloud API pe file handle multipart mein chunk by
+    chunk stream hota hai - poori file memory mein nahi aati.
+    """
+    size = len(document) if isinstance(document, bytes) else os.path.getsize(document)
+    if size > UPLOAD_MAX_BYTES:
+        await update.message.reply_text(
+            f"⚠️ `{filename}` is {size / 1024 / 1024:.1f} MB - over the "
+            f"{UPLOAD_MAX_BYTES // 1024 // 1024} MB upload limit.\n"
+            "Run a local Bot API server (`BOT_API_URL`) to receive large files.",
+            parse_mode='Markdown'
+        )
+        return False
+    try:
+        with metrics.stage("upload", size):
+            if isinstance(document, bytes):
+                await update.message.reply_document(InputFile(document, filename=filename), caption=caption)
+            elif BOT_API_URL:
+                await update.message.reply_document(os.path.abspath(document), filename=filename, caption=caption)
+            else:
+                with open(document, "rb") as f:
+                    await update.message.reply_document(
+                        InputFile(f, filename=filename, read_file_handle=False), caption=caption
+                    )
+    except TelegramError as e:
+        logger.warning(f"Upload of {filename} failed: {e}")
+        await update.message.reply_text(f"⚠️ Could not upload {filename}: {e}")
+        return False
+    return True
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle user messages during certificate generation or signing."""
@@ -355,133 +3850,247 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ You are not authorized to use this bot.")
         return
 
-    if user_id not in bot.current_user_data:
+    session = bot.sessions.get(user_id)
+    if session is None:
         await update.message.reply_text("Please use /generate or /sign to start.")
         return
 
-    expecting = context.user_data.get('expecting', '')
-    user_data = bot.current_user_data[user_id]
-    mode = user_data.get('mode', 'generate')
+    mode = session.mode or 'generate'
 
     if mode == 'generate':
-        await handle_generate_mode(update, context, user_data, expecting, text)
+        await handle_generate_mode(update, context, session, text)
     elif mode == 'sign':
-        await handle_sign_mode(update, context, user_data, expecting, text)
+        await handle_sign_mode(update, context, session, text)
+    elif mode == 'batch':
+        await handle_batch_mode(update, context, session, text)
+    bot.sessions.save(session)
 
-async def handle_generate_mode(update, context, user_data, expecting, text):
+async def handle_generate_mode(update, context, session, text):
     """Handle generate certificate mode"""
+    user_data, expecting = session.data, session.expecting
     if expecting == 'alias_name':
         user_data['alias_name'] = text or 'mykey'
-        context.user_data['expecting'] = 'org_name'
+        session.expecting = 'org_name'
         await update.message.reply_text("🏢 Enter *Organization Name*:", parse_mode='Markdown')
         
     elif expecting == 'org_name':
         user_data['org_name'] = text or 'MyCompany'
-        context.user_data['expecting'] = 'org_unit'
+        session.expecting = 'org_unit'
         await update.message.reply_text("🏢 Enter *Organizational Unit*:", parse_mode='Markdown')
         
     elif expecting == 'org_unit':
         user_data['org_unit'] = text or 'IT'
-        context.user_data['expecting'] = 'city'
+        session.expecting = 'city'
         await update.message.reply_text("🏙️ Enter *City*:", parse_mode='Markdown')
         
     elif expecting == 'city':
         user_data['city'] = text or 'Mumbai'
-        context.user_data['expecting'] = 'state'
+        session.expecting = 'state'
         await update.message.reply_text("🏛️ Enter *State*:", parse_mode='Markdown')
         
     elif expecting == 'state':
         user_data['state'] = text or 'Maharashtra'
-        context.user_data['expecting'] = 'country'
+        session.expecting = 'country'
         await update.message.reply_text("🇮🇳 Enter *Country Code* (e.g., IN):", parse_mode='Markdown')
         
     elif expecting == 'country':
         user_data['country'] = text or 'IN'
-        context.user_data['expecting'] = 'store_pass'
+        session.expecting = 'store_pass'
         await update.message.reply_text("🔑 Enter *Keystore Password*:", parse_mode='Markdown')
         
     elif expecting == 'store_pass':
         user_data['store_pass'] = text or 'android'
-        context.user_data['expecting'] = 'key_pass'
+        session.expecting = 'key_pass'
         await update.message.reply_text("🔐 Enter *Key Password* (or press Enter to use same as keystore):", parse_mode='Markdown')
         
     elif expecting == 'key_pass':
         user_data['key_pass'] = text or user_data.get('store_pass', 'android')
-        context.user_data['expecting'] = 'validity_years'
+        session.expecting = 'validity_years'
         await update.message.reply_text("⏰ Enter *Validity in years* (default: 25):", parse_mode='Markdown')
         
     elif expecting == 'validity_years':
         user_data['validity_years'] = text or '25'
+        session.expecting = 'key_algorithm'
+        await update.message.reply_text(
+            f"🧮 Enter *Key Algorithm* (default: `{KEY_ALGORITHM}`):\n"
+            "• `EC-P256` - fastest keygen & signing\n"
+            "• `RSA-2048` - maximum compatibility\n"
+            "• `RSA-3072` / `RSA-4096` - larger RSA keys",
+            parse_mode='Markdown'
+        )
         
-        # All data collected, generate certificate
-        await update.message.reply_text("⏳ Generating your APK signing certificate...")
-        
-        # Check for keytool
-        if not bot.check_keytool():
-            await update.message.reply_text("🔧 keytool not found! Installing Java...")
-            if not bot.install_java():
-                await update.message.reply_text("❌ Failed to install Java. Please install manually.")
-                del bot.current_user_data[update.effective_user.id]
-                return
-        
-        # Generate keystore
-        success, message = bot.generate_keystore(user_data)
+    elif expecting == 'key_algorithm':
+        try:
+            user_data['key_algorithm'] = parse_key_algorithm(text or KEY_ALGORITHM)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}. Please enter `EC-P256`, `RSA-2048`, `RSA-3072` or `RSA-4096`:", parse_mode='Markdown')
+            return
         
+        # All data collected - conversation khatam, job scheduler ki queue mein
+        start_job(update, context, generate_job, user_data)
+
+async def generate_job(update, user_data):
+    """Run keystore generation through the scheduler and report the result"""
+    # Check for keytool
+    if KEYSTORE_BACKEND == 'keytool' and not await job_runner.run(bot.check_keytool):
+        await update.message.reply_text("🔧 keytool not found! Installing Java...")
+        if not await job_runner.run(bot.install_java, timeout=max(JOB_TIMEOUT, 900)):
+            await update.message.reply_text("❌ Failed to install Java. Please install manually.")
+            return
+    
+    # Generate keystore (small job - queue mein aage)
+    try:
+        success, message = await run_scheduled_job(
+            update, "Generating your APK signing certificate...", bot.generate_keystore, user_data, small=True
+        )
+    except QueueFullError as e:
+        await update.message.reply_text(f"🚦 {e}")
+        return
+    except JobTimeoutError as e:
+        success, message = False, str(e)
+    
+    with metrics.stage("reply"):
         if success:
             # Send success message
             await update.message.reply_text(
                 f"✅ *Certificate Generated Successfully!*\n\n"
-                f"📁 Files created in: `{bot.cert_dir}`\n"
+                f"📁 Files created in: `{user_data.get('keystore_dir', bot.cert_dir)}`\n"
                 f"🔑 Alias: `{user_data['alias_name']}`\n"
                 f"🏢 Organization: `{user_data['org_name']}`\n"
-                f"⏰ Validity: `{user_data['validity_years']} years`\n\n"
+                f"⏰ Validity: `{user_data['validity_years']} years`\n"
+                f"🧮 Algorithm: `{user_data['key_algorithm']}`\n\n"
                 f"*Important:* Keep your keystore file safe!\n"
                 f"Now you can use `/sign` command to sign APK files.",
                 parse_mode='Markdown'
             )
         else:
             await update.message.reply_text(f"❌ *Error generating certificate:*\n`{message}`", parse_mode='Markdown')
-        
-        # Clean up
-        del bot.current_user_data[update.effective_user.id]
-        context.user_data.clear()
+    
+    if success and SEND_RESULTS:
+        # Bundle memory mein hi zip hota hai - temp file nahi
+        loop = asyncio.get_running_loop()
+        bundle = await loop.run_in_executor(None, keystore_bundle, user_data.get('keystore_dir', bot.cert_dir))
+        await send_result(
+            update, bundle, f"{user_data['alias_name']}_keystore.zip",
+            caption="🔐 Keystore bundle (JKS, PKCS12, certificate, sign script). Keep it safe - a lost key cannot be recovered!"
+        )
 
-async def handle_sign_mode(update, context, user_data, expecting, text):
+async def handle_sign_mode(update, context, session, text):
     """Handle APK signing mode"""
+    user_data, expecting = session.data, session.expecting
     if expecting == 'apk_file':
         # For now, we'll assume user provides filename
         user_data['apk_file'] = text
-        context.user_data['expecting'] = 'alias_name'
+        session.expecting = 'alias_name'
         await update.message.reply_text("👤 Enter *Certificate Alias*:", parse_mode='Markdown')
         
     elif expecting == 'alias_name':
         user_data['alias_name'] = text or 'mykey'
-        context.user_data['expecting'] = 'store_pass'
+        session.expecting = 'store_pass'
         await update.message.reply_text("🔑 Enter *Keystore Password*:", parse_mode='Markdown')
         
     elif expecting == 'store_pass':
         user_data['store_pass'] = text or 'android'
+        session.expecting = 'schemes'
+        await update.message.reply_text(
+            f"✍️ Enter *Signature Schemes* (e.g. `v1,v2,v3` or `v2`, default: `{SIGN_SCHEMES}`):",
+            parse_mode='Markdown'
+        )
         
-        # All data collected, sign APK
-        await update.message.reply_text("⏳ Signing your APK file...")
-        
-        # Sign APK
-        success, message = bot.sign_apk_process(user_data)
+    elif expecting == 'schemes':
+        try:
+            user_data['schemes'] = ",".join(parse_schemes(text or SIGN_SCHEMES))
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}. Please enter schemes like `v1,v2,v3`:", parse_mode='Markdown')
+            return
         
+        # All data collected - conversation khatam, job scheduler ki queue mein
+        start_job(update, context, batch_job if user_data.get('mode') == 'batch' else sign_job, user_data)
+
+async def sign_job(update, user_data):
+    """Run one APK sign through the scheduler and report the result"""
+    try:
+        success, message = await run_scheduled_job(update, "Signing your APK file...", bot.sign_apk_process, user_data)
+    except QueueFullError as e:
+        await update.message.reply_text(f"🚦 {e}")
+        return
+    except JobTimeoutError as e:
+        success, message = False, str(e)
+    
+    with metrics.stage("reply"):
         if success:
             await update.message.reply_text(
                 f"✅ *APK Signed Successfully!*\n\n"
                 f"📱 File: `{user_data['apk_file']}`\n"
                 f"🔑 Alias: `{user_data['alias_name']}`\n\n"
-                f"{message}",
+                # Signer DN / entry names mein _ * aa sakte hain - code block mein Markdown parse nahi hota
+                f"```\n{message}\n```",
                 parse_mode='Markdown'
             )
         else:
             await update.message.reply_text(f"❌ *Signing failed:*\n`{message}`", parse_mode='Markdown')
+    
+    if success and SEND_RESULTS:
+        apk_file = user_data['apk_file']
+        delivered = await send_result(update, apk_file, upload_display_name(apk_file))
+        if delivered and bot.sessions.owns_upload(apk_file):
+            os.remove(apk_file)  # deliver ho gaya - sirf apni download hatao, admin ka typed path kabhi nahi
+
+async def handle_batch_mode(update, context, session, text):
+    """Handle batch signing mode (file collection, then the /sign prompts)"""
+    user_data, expecting = session.data, session.expecting
+    if expecting == 'batch_files':
+        if (text or '').strip().lower() != 'done':
+            await update.message.reply_text("📎 Send more files, or type `done` to continue.", parse_mode='Markdown')
+            return
+        if not user_data['batch_files']:
+            await update.message.reply_text("❌ No files received yet. Please send at least one APK or bundle.")
+            return
+        session.expecting = 'alias_name'
+        await update.message.reply_text(
+            f"📦 {len(user_data['batch_files'])} file(s) queued.\n\nNow enter *Certificate Alias*:",
+            parse_mode='Markdown'
+        )
+    else:
+        # Alias / password / schemes - wahi steps jo /sign mein hain
+        await handle_sign_mode(update, context, session, text)
+
+async def batch_job(update, user_data):
+    """Sign a collected batch through the scheduler and send one consolidated result"""
+    try:
+        success, message = await run_scheduled_job(
+            update, f"Signing {len(user_data['batch_files'])} file(s)...", bot.sign_batch_process, user_data
+        )
+    except QueueFullError as e:
+        await update.message.reply_text(f"🚦 {e}")
+        return
+    except JobTimeoutError as e:
+        success, message = False, str(e)
+    
+    # 50 APKs ki report 4096 chars se lambi ho sakti hai - reply mein shuru ka hissa, poori file mein
+    report, clipped = clip_report(message)
+    with metrics.stage("reply"):
+        if success:
+            await update.message.reply_text(
+                f"✅ *Batch Signed!*\n\n"
+                f"🔑 Alias: `{user_data['alias_name']}`\n\n"
+                f"```\n{report}\n```",
+                parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_text(f"❌ *Batch signing failed:*\n```\n{report}\n```", parse_mode='Markdown')
+    if clipped:
+        await send_result(update, message.encode(), "batch_report.txt", caption="📄 Full batch report")
+    
+    if success and SEND_RESULTS:
+        uploads = asyncio.Semaphore(UPLOAD_CONCURRENCY)
         
-        # Clean up
-        del bot.current_user_data[update.effective_user.id]
-        context.user_data.clear()
+        async def deliver(path):
+            async with uploads:
+                if await send_result(update, path, upload_display_name(path)) and bot.sessions.owns_upload(path):
+                    os.remove(path)
+        
+        await asyncio.gather(*(deliver(path) for path in user_data.get('signed_files', [])))
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle document (APK file) uploads"""
@@ -490,16 +4099,65 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id not in ADMIN_IDS:
         return
     
-    if user_id in bot.current_user_data and bot.current_user_data[user_id].get('mode') == 'sign':
-        document = update.message.document
+    session = bot.sessions.get(user_id)
+    mode = session.mode if session else None
+    document = update.message.document
+    
+    if mode == 'batch' or (mode == 'sign' and is_batch_archive(document.file_name)):
+        user_data = session.data
+        if not (document.file_name.lower().endswith('.apk') or is_batch_archive(document.file_name)):
+            await update.message.reply_text("❌ Only .apk, .apks, .xapk and .zip files can be batch signed.")
+            return
+        if mode == 'sign':
+            # /sign mein bundle aaya - batch mode mein switch (alias se aage wahi flow)
+            user_data.update({'mode': 'batch', 'batch_files': []})
+        
+        file = await context.bot.get_file(document.file_id)
+        files = user_data['batch_files']
+        filename = os.path.abspath(
+            f"{UPLOAD_PREFIX}{user_id}_{update.message.message_id}_batch{len(files)}_{os.path.basename(document.file_name)}"
+        )
+        session.uploads.append(filename)
+        with open(filename, "wb") as f, metrics.stage("download", document.file_size or 0):
+            await stream_download(file, f)
+        files.append(filename)
+        
+        if mode == 'sign':
+            session.expecting = 'alias_name'
+            await update.message.reply_text(
+                f"📦 Bundle received: `{document.file_name}`\n\n"
+                "Now enter *Certificate Alias*:",
+                parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_text(
+                f"📥 Added `{document.file_name}` ({len(files)} file(s)). Send more or type `done`.",
+                parse_mode='Markdown'
+            )
+        bot.sessions.save(session)
+        return
+    
+    if mode == 'sign':
         if document.file_name.endswith('.apk'):
             # Download the file
             file = await context.bot.get_file(document.file_id)
-            filename = f"uploaded_{document.file_name}"
-            await file.download_to_drive(filename)
+            # User + message id naam mein - doosre admin ya isi admin ke queued job ki same-name upload overwrite na ho
+            filename = os.path.abspath(
+                f"{UPLOAD_PREFIX}{user_id}_{update.message.message_id}_{os.path.basename(document.file_name)}"
+            )
+            session.uploads.append(filename)
+            # Download stream hote hi SHA-256 (cache ke liye) + entry digests (v1 ke liye)
+            with open(filename, "wb") as f, metrics.stage("download", document.file_size or 0):
+                digester = StreamingEntryDigester(f) if STREAM_DIGEST else f
+                writer = HashingWriter(digester)
+                await stream_download(file, writer)
             
-            bot.current_user_data[user_id]['apk_file'] = filename
-            context.user_data['expecting'] = 'alias_name'
+            session.data['apk_file'] = filename
+            session.data['apk_sha256'] = writer.hexdigest()
+            if STREAM_DIGEST:
+                session.data['entry_digests'] = digester.digests()
+            session.expecting = 'alias_name'
+            bot.sessions.save(session)
             
             await update.message.reply_text(
                 f"📥 APK file received: `{document.file_name}`\n\n"
@@ -510,17 +4168,81 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the current operation."""
     user_id = update.effective_user.id
-    if user_id in bot.current_user_data:
-        del bot.current_user_data[user_id]
-    context.user_data.clear()
-    await update.message.reply_text("❌ Operation cancelled.")
+    bot.sessions.discard(user_id)
+    cancelled = scheduler.cancel(user_id)
+    if cancelled:
+        await update.message.reply_text(f"❌ Operation cancelled ({cancelled} queued job(s) removed).")
+    else:
+        await update.message.reply_text("❌ Operation cancelled.")
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log errors and handle them gracefully."""
-    logger.error(f"Update {update} caused error {context.error}")
+    logger.error(f"Update {update} caused error {context.error}", exc_info=context.error)
     if update and update.message:
         await update.message.reply_text("❌ An error occurred. Please try again.")
 
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently, but each user's updates strictly in arrival order
+
+    User ka pehla update uska drainer banta hai: apna slot rakh ke is beech aaye us user
+    ke baaki updates order mein chalata hai. Baad wale updates sirf queue mein judte hain
+    aur slot turant chhod dete hain - ek admin ke 32 documents doosre admins ko nahi rokte.
+    """
+    __slots__ = ("_queues",)
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._queues = {}  # user_id -> deque of waiting coroutines (entry hai = drainer chal raha hai)
+
+    async def do_process_update(self, update, coroutine):
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await coroutine
+            return
+        queue = self._queues.get(user.id)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        queue = self._queues[user.id] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue.popleft()
+                except Exception as e:
+                    # Doosre update ka error - drainer ke user ke baaki updates phir bhi chalein
+                    logger.error(f"Update for user {user.id} failed: {e}", exc_info=e)
+        finally:
+            del self._queues[user.id]
+            for pending in queue:
+                pending.close()  # drainer cancel hua (shutdown) - bache coroutines band
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def build_application(builder):
+    """Build the Application from builder and register all bot handlers"""
+    application = builder.build()
+
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("generate", generate_certificate))
+    application.add_handler(CommandHandler("sign", sign_apk))
+    application.add_handler(CommandHandler("batch", batch_sign))
+    application.add_handler(CommandHandler("keys", list_keys))
+    application.add_handler(CommandHandler("lock", lock_keys))
+    application.add_handler(CommandHandler("stats", show_stats))
+    application.add_handler(CommandHandler("cancel", cancel))
+    application.add_handler(MessageHandler(
+        filters.Document.APK | filters.Document.ZIP | filters.Document.FileExtension("apk")
+        | filters.Document.FileExtension("apks") | filters.Document.FileExtension("xapk"),
+        handle_document
+    ))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_error_handler(error_handler)
+    return application
+
 def main():
     """Start the bot."""
     # Check for required configuration
@@ -528,27 +4250,89 @@ def main():
         print("❌ Please set your actual BOT_TOKEN in environment variables!")
         sys.exit(1)
     
+    async def post_init(application):
+        if worker_tier:
+            # Restart se pehle queue hue jobs ke results seedha chat mein
+            def deliver_orphan(chat_id, kind, result):
+                if chat_id is None:
+                    return
+                success, message = result
+                text = f"{'✅' if success else '❌'} Job finished after a bot restart ({kind}):\n\n{message}"
+                application.create_task(application.bot.send_message(chat_id, text))
+            worker_tier.on_orphan_result = deliver_orphan
+            worker_tier.ensure_polling()
+        # SESSION_DB se restore hui flows - password memory ke saath chala gaya, dobara maango
+        for user_id, expecting in bot.sessions.restored:
+            try:
+                await application.bot.send_message(
+                    user_id, "🔁 Bot restarted. Please re-enter your *Keystore Password*:", parse_mode='Markdown'
+                )
+            except TelegramError as e:
+                logger.warning(f"Could not resume session for {user_id}: {e}")
+        bot.sessions.restored.clear()
+    
     # Create Application
-    application = Application.builder().token(BOT_TOKEN).build()
-
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("generate", generate_certificate))
-    application.add_handler(CommandHandler("sign", sign_apk))
-    application.add_handler(CommandHandler("cancel", cancel))
-    application.add_handler(MessageHandler(filters.Document.APK, handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    application.add_error_handler(error_handler)
+    builder = Application.builder().token(BOT_TOKEN).post_init(post_init).media_write_timeout(UPLOAD_TIMEOUT)
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    if BOT_API_URL:
+        # Local Bot API server: 2000 MB tak ki files, uploads/downloads disk path se
+        builder = builder.base_url(BOT_API_URL).base_file_url(BOT_API_FILE_URL).local_mode(True)
+    application = build_application(builder)
 
     # Start the Bot
     print("🤖 APK Signing Bot is running...")
     
-    # Use proper async polling
+    # Prometheus text endpoint (sirf localhost)
+    if METRICS_PORT:
+        try:
+            metrics.serve(METRICS_PORT, metrics_gauges)
+            logger.info(f"Metrics on http://127.0.0.1:{METRICS_PORT}/metrics")
+        except OSError as e:
+            logger.warning(f"Metrics endpoint disabled: {e}")
+    
+    # Signing worker processes (bot process sirf frontend, key pools workers ke andar)
+    if worker_tier:
+        worker_tier.start()
+    else:
+        # Background key pool - idle time mein RSA keys ready rakho
+        bot.key_pool.start()
+
+    # Idle conversations ka eviction thread (+ SESSION_DB restore)
+    bot.sessions.start()
+
+    # Webhook (Telegram khud POST karta hai, polling round-trip nahi) ya long polling
     try:
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            logger.info(f"Webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+        else:
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
     except Exception as e:
         logger.error(f"Bot failed to start: {e}")
         sys.exit(1)
+    finally:
+        if worker_tier:
+            logger.info(f"Worker tier stats: {worker_tier.stats()}")
+            worker_tier.stop()
+        job_runner.shutdown()
+        bot.key_pool.stop()
+        logger.info(f"Scheduler stats: {scheduler.stats()}")
+        logger.info(f"Key pool stats: {bot.key_pool.stats()}")
+        logger.info(f"Signed APK cache stats: {signed_cache_stats()}")
+        logger.info(f"Keystore registry stats: {bot.registry.stats()}")
+        logger.info(f"Unlocked key cache stats: {key_cache_stats()}")
+        logger.info(f"Session stats: {bot.sessions.stats()}")
+        bot.sessions.stop()
+        bot.key_cache.evict()
+        bot.registry.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file